@@ -33,6 +33,7 @@ ALLOWED_HOSTS = ['*']
 # Application definition
 
 INSTALLED_APPS = [
+    'daphne',
     'django.contrib.admin',
     'django.contrib.auth',
     'django.contrib.contenttypes',
@@ -58,6 +59,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'tracker.instrumentation.QueryInstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -82,6 +84,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'tracker.context_processors.notifications',
             ],
         },
     },
@@ -94,12 +97,39 @@ ASGI_APPLICATION = 'finance_tracker_web.asgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# DATABASE_ENGINE=postgresql reads the DATABASE_* variables below; SQLite
+# connections are tuned with the SQLITE_PROFILE PRAGMAs (see tracker/db.py)
+DATABASE_ENGINE = config('DATABASE_ENGINE', default='sqlite')
+
+if DATABASE_ENGINE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': config('DATABASE_NAME', default='splittracker'),
+            'USER': config('DATABASE_USER', default='splittracker'),
+            'PASSWORD': config('DATABASE_PASSWORD', default=''),
+            'HOST': config('DATABASE_HOST', default='localhost'),
+            'PORT': config('DATABASE_PORT', default='5432'),
+            # Keep connections open between requests and check them before reuse
+            'CONN_MAX_AGE': config('DATABASE_CONN_MAX_AGE', default=60, cast=int),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                'connect_timeout': config('DATABASE_CONNECT_TIMEOUT', default=5, cast=int),
+            },
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': config('DATABASE_NAME', default=str(BASE_DIR / 'db.sqlite3')),
+            'CONN_MAX_AGE': config('DATABASE_CONN_MAX_AGE', default=0, cast=int),
+            'CONN_HEALTH_CHECKS': True,
+        }
     }
-}
+
+# tuned (WAL, busy_timeout, synchronous=NORMAL, mmap) or default
+SQLITE_PROFILE = config('SQLITE_PROFILE', default='tuned')
 
 
 # Password validation
@@ -183,19 +213,80 @@ REST_FRAMEWORK = {
     'DEFAULT_FILTER_BACKENDS': [
         'django_filters.rest_framework.DjangoFilterBackend',
     ],
+    # The API lives under /api/v1/ (see tracker/api.py)
+    'DEFAULT_VERSIONING_CLASS': 'rest_framework.versioning.NamespaceVersioning',
+    'ALLOWED_VERSIONS': ['v1'],
 }
 
 # Channels settings
+# Live notification and group activity events go through this layer. Use a shared
+# one such as channels_redis.core.RedisChannelLayer when running several processes
 CHANNEL_LAYERS = {
     'default': {
         'BACKEND': 'channels.layers.InMemoryChannelLayer'
     }
 }
 
+# Cache for group/user summaries, page versions and unread counts (see
+# tracker/caching.py). The default in-process LocMemCache suits a single
+# process. When the web processes, the notification worker and management
+# commands run side by side they must share one cache, or their invalidations
+# never reach each other: set CACHE_BACKEND to
+# django.core.cache.backends.redis.RedisCache (or PyMemcacheCache) with a
+# CACHE_LOCATION. `check --deploy` reports per-process caches as tracker.W001
+CACHE_BACKEND = config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache')
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKEND,
+        'LOCATION': config('CACHE_LOCATION', default='splittracker'),
+    }
+}
+if CACHE_BACKEND.endswith('.LocMemCache'):
+    CACHES['default']['OPTIONS'] = {'MAX_ENTRIES': config('CACHE_MAX_ENTRIES', default=10000, cast=int)}
+
+# Summary cache hits and misses are counted for one lookup in this many (1.0 counts all)
+CACHE_STATS_SAMPLE_RATE = config('CACHE_STATS_SAMPLE_RATE', default=0.01, cast=float)
+
 # CORS settings
 CORS_ALLOW_ALL_ORIGINS = True  # Only for development
 CORS_ALLOW_CREDENTIALS = True
 
+# Performance instrumentation
+# Raise instead of logging when a view goes over its @query_budget (tests turn this on)
+QUERY_BUDGET_STRICT = config('QUERY_BUDGET_STRICT', default=False, cast=bool)
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'tracker.performance': {
+            'handlers': ['console'],
+            'level': config('PERFORMANCE_LOG_LEVEL', default='WARNING'),
+            'propagate': False,
+        },
+    },
+}
+
+# Notifications
+# Fan out queued notification events right after each request instead of in
+# `manage.py notification_worker` (no coalescing; handy when no worker runs)
+NOTIFICATIONS_EAGER = config('NOTIFICATIONS_EAGER', default=False, cast=bool)
+# Read notifications are deleted after this many days; unread ones are folded into a digest
+NOTIFICATION_RETENTION_DAYS = config('NOTIFICATION_RETENTION_DAYS', default=90, cast=int)
+NOTIFICATION_DIGEST_DAYS = config('NOTIFICATION_DIGEST_DAYS', default=30, cast=int)
+
+# Receipts are re-encoded by `manage.py process_receipts` as JPEG or WEBP
+RECEIPT_IMAGE_FORMAT = config('RECEIPT_IMAGE_FORMAT', default='JPEG')
+
+# Balances are shown in this currency; other currencies are converted with the
+# rates loaded by `manage.py import_rates`
+BASE_CURRENCY = config('BASE_CURRENCY', default='USD')
+
 # Email settings (for development)
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 
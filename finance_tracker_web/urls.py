@@ -23,6 +23,7 @@ from django.contrib.auth import views as auth_views
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include('tracker.urls')),
+    path('api/v1/', include('tracker.api', namespace='v1')),
     path('accounts/', include('allauth.urls')),
 ]
 
@@ -0,0 +1,59 @@
+"""
+Live group activity over websockets.
+
+Every open group page subscribes to its group's channel layer group through
+``GroupActivityConsumer``. When an expense, comment or settlement in the group
+is saved or deleted, a small event describing the change is broadcast there
+once the transaction commits, and the page shows a "new activity" banner.
+
+Events only carry ids and the fields needed for the banner text; pages fetch
+anything else over HTTP. Bulk writes (imports, Settle Up) send one event for
+the whole batch instead of one per row.
+"""
+import functools
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+
+
+def group_channel_group(group_id):
+    """Channel layer group that every open page of group ``group_id`` subscribes to."""
+    return f'activity.group.{group_id}'
+
+
+def _send(group_id, event):
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    async_to_sync(channel_layer.group_send)(
+        group_channel_group(group_id), {'type': 'group.activity', 'event': event}
+    )
+
+
+def broadcast(group_id, kind, action, **fields):
+    """Send a ``kind``/``action`` event to the group's pages once the current transaction commits."""
+    if group_id is None:
+        return
+    event = {'kind': kind, 'action': action, **fields}
+    transaction.on_commit(functools.partial(_send, group_id, event))
+
+
+def expense_event(expense, action):
+    broadcast(
+        expense.group_id, 'expense', action,
+        id=expense.id, title=expense.title, amount=str(expense.amount), currency=expense.currency,
+        paid_by_id=expense.paid_by_id,
+    )
+
+
+def comment_event(comment, action, group_id):
+    broadcast(group_id, 'comment', action, id=comment.id, expense_id=comment.expense_id, user_id=comment.user_id)
+
+
+def settlement_event(settlement, action):
+    broadcast(
+        settlement.group_id, 'settlement', action,
+        id=settlement.id, amount=str(settlement.amount), status=settlement.status,
+        payer_id=settlement.payer_id, receiver_id=settlement.receiver_id,
+    )
@@ -1,51 +1,109 @@
 from django.contrib import admin
-from .models import Group, GroupMember, Expense, ExpenseShare, Settlement, Comment, Notification
+from django.db.models import Count
+from .models import Group, GroupMember, Expense, ExpenseShare, Settlement, Comment, Notification, GroupBalance, NotificationEvent, SpendingRollup, StoredBlob, ExchangeRate
+from .pagination import EstimatedCountPaginator
+
+class LargeTableAdmin(admin.ModelAdmin):
+    # No COUNT(*) over the whole table on every changelist page. Group and user
+    # filters go through search_fields; a dropdown would load every row
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
 @admin.register(Group)
-class GroupAdmin(admin.ModelAdmin):
+class GroupAdmin(LargeTableAdmin):
     list_display = ('name', 'created_at', 'get_member_count')
     search_fields = ('name', 'description')
     
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(member_count=Count('groupmember'))
+    
+    @admin.display(description='Members', ordering='member_count')
     def get_member_count(self, obj):
-        return obj.members.count()
-    get_member_count.short_description = 'Members'
+        return obj.member_count
 
 @admin.register(GroupMember)
-class GroupMemberAdmin(admin.ModelAdmin):
+class GroupMemberAdmin(LargeTableAdmin):
     list_display = ('user', 'group', 'role', 'joined_at')
-    list_filter = ('role', 'group')
+    list_filter = ('role',)
+    list_select_related = ('user', 'group')
+    autocomplete_fields = ('user', 'group')
     search_fields = ('user__email', 'group__name')
 
 @admin.register(Expense)
-class ExpenseAdmin(admin.ModelAdmin):
+class ExpenseAdmin(LargeTableAdmin):
     list_display = ('title', 'amount', 'paid_by', 'group', 'date', 'split_type')
-    list_filter = ('split_type', 'group', 'date')
-    search_fields = ('title', 'description', 'paid_by__email')
+    list_filter = ('split_type', 'date')
+    list_select_related = ('paid_by', 'group')
+    autocomplete_fields = ('paid_by', 'group')
+    search_fields = ('title', 'description', 'paid_by__email', 'group__name')
     date_hierarchy = 'date'
 
 @admin.register(ExpenseShare)
-class ExpenseShareAdmin(admin.ModelAdmin):
+class ExpenseShareAdmin(LargeTableAdmin):
     list_display = ('expense', 'user', 'amount', 'percentage')
-    list_filter = ('expense__group', 'user')
-    search_fields = ('expense__title', 'user__email')
+    list_select_related = ('expense', 'user')
+    autocomplete_fields = ('expense', 'user')
+    search_fields = ('expense__title', 'expense__group__name', 'user__email')
 
 @admin.register(Settlement)
-class SettlementAdmin(admin.ModelAdmin):
+class SettlementAdmin(LargeTableAdmin):
     list_display = ('payer', 'receiver', 'amount', 'status', 'date', 'group')
-    list_filter = ('status', 'group', 'date')
-    search_fields = ('payer__email', 'receiver__email', 'notes')
+    list_filter = ('status', 'date')
+    list_select_related = ('payer', 'receiver', 'group')
+    autocomplete_fields = ('payer', 'receiver', 'group')
+    search_fields = ('payer__email', 'receiver__email', 'group__name', 'notes')
     date_hierarchy = 'date'
 
 @admin.register(Comment)
-class CommentAdmin(admin.ModelAdmin):
+class CommentAdmin(LargeTableAdmin):
     list_display = ('user', 'expense', 'created_at', 'updated_at')
-    list_filter = ('created_at', 'expense__group')
-    search_fields = ('text', 'user__email', 'expense__title')
+    list_filter = ('created_at',)
+    list_select_related = ('user', 'expense')
+    autocomplete_fields = ('user', 'expense')
+    search_fields = ('text', 'user__email', 'expense__title', 'expense__group__name')
     date_hierarchy = 'created_at'
 
 @admin.register(Notification)
-class NotificationAdmin(admin.ModelAdmin):
+class NotificationAdmin(LargeTableAdmin):
     list_display = ('user', 'type', 'is_read', 'created_at')
     list_filter = ('type', 'is_read', 'created_at')
+    list_select_related = ('user',)
+    autocomplete_fields = ('user', 'related_expense', 'related_settlement', 'related_group')
     search_fields = ('content', 'user__email')
     date_hierarchy = 'created_at'
+
+@admin.register(NotificationEvent)
+class NotificationEventAdmin(LargeTableAdmin):
+    list_display = ('type', 'group', 'recipient', 'created_at', 'processed_at')
+    list_filter = ('type', 'processed_at')
+    list_select_related = ('group', 'recipient')
+    autocomplete_fields = ('actor', 'recipient', 'group', 'related_expense', 'related_settlement')
+    search_fields = ('content',)
+
+@admin.register(GroupBalance)
+class GroupBalanceAdmin(LargeTableAdmin):
+    list_display = ('user', 'group', 'currency', 'paid', 'owed', 'settled')
+    list_select_related = ('user', 'group')
+    autocomplete_fields = ('user', 'group')
+    search_fields = ('user__email', 'group__name')
+
+@admin.register(ExchangeRate)
+class ExchangeRateAdmin(admin.ModelAdmin):
+    list_display = ('currency', 'date', 'rate')
+    list_filter = ('currency',)
+    date_hierarchy = 'date'
+
+@admin.register(SpendingRollup)
+class SpendingRollupAdmin(LargeTableAdmin):
+    list_display = ('group', 'user', 'day', 'currency', 'paid', 'expense_count', 'share')
+    list_filter = ('currency',)
+    list_select_related = ('group', 'user')
+    autocomplete_fields = ('group', 'user')
+    search_fields = ('user__email', 'group__name')
+    date_hierarchy = 'day'
+
+@admin.register(StoredBlob)
+class StoredBlobAdmin(admin.ModelAdmin):
+    list_display = ('name', 'size', 'refcount', 'created_at', 'updated_at')
+    list_filter = ('refcount',)
+    search_fields = ('digest', 'name')
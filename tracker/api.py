@@ -0,0 +1,140 @@
+"""
+Read-only JSON API, mounted under ``/api/v1/``.
+
+Endpoints list what the signed-in user can see: their groups, the expenses,
+shares, settlements and comments in those groups, and their notifications.
+Each endpoint:
+
+* pages with an opaque cursor (``?cursor=``, ``?page_size=`` up to
+  ``MAX_PAGE_SIZE``), so deep pages cost the same as the first,
+* returns only ``?fields=a,b`` when given,
+* nests relations listed in ``?embed=`` (``members`` on groups, ``shares`` on
+  expenses) with one extra prefetch query for the whole page,
+* filters on the query parameters in its ``filterset_fields``.
+
+The per-endpoint query counts are asserted in ``ApiTests``.
+"""
+from django.contrib.auth.models import User
+from django.db.models import Count, Prefetch, Q
+from rest_framework import routers, viewsets
+from rest_framework.pagination import CursorPagination
+
+from .models import Comment, Expense, ExpenseShare, Group, GroupMember, Notification, Settlement
+from .serializers import (
+    CommentSerializer, ExpenseSerializer, GroupSerializer, NotificationSerializer, SettlementSerializer,
+    ShareSerializer,
+)
+
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+class ApiCursorPagination(CursorPagination):
+    page_size = PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = MAX_PAGE_SIZE
+
+    def get_ordering(self, request, queryset, view):
+        return view.cursor_ordering
+
+
+class ApiViewSet(viewsets.ReadOnlyModelViewSet):
+    pagination_class = ApiCursorPagination
+    cursor_ordering = ('-id',)
+
+    def query_list(self, name):
+        value = self.request.query_params.get(name, '')
+        return {item.strip() for item in value.split(',') if item.strip()}
+
+    @property
+    def embed(self):
+        return self.query_list('embed')
+
+    def member_groups(self):
+        # A subquery, so visibility costs no query of its own
+        return GroupMember.objects.filter(user=self.request.user).values('group_id')
+
+    def get_serializer(self, *args, **kwargs):
+        kwargs.setdefault('fields', self.query_list('fields'))
+        kwargs.setdefault('embed', self.embed)
+        return super().get_serializer(*args, **kwargs)
+
+
+class GroupViewSet(ApiViewSet):
+    serializer_class = GroupSerializer
+
+    def get_queryset(self):
+        groups = Group.objects.filter(id__in=self.member_groups()).annotate(member_count=Count('groupmember'))
+        if 'members' in self.embed:
+            groups = groups.prefetch_related(
+                Prefetch('members', queryset=User.objects.order_by('groupmember__joined_at', 'id'))
+            )
+        return groups
+
+
+class ExpenseViewSet(ApiViewSet):
+    serializer_class = ExpenseSerializer
+    cursor_ordering = ('-date', '-id')
+    filterset_fields = ['group', 'paid_by', 'currency', 'split_type']
+
+    def get_queryset(self):
+        expenses = Expense.objects.filter(
+            Q(group__in=self.member_groups()) | Q(paid_by=self.request.user)
+        ).select_related('paid_by')
+        if 'shares' in self.embed:
+            expenses = expenses.prefetch_related(
+                Prefetch('shares', queryset=ExpenseShare.objects.select_related('user').order_by('id'))
+            )
+        return expenses
+
+
+class ShareViewSet(ApiViewSet):
+    serializer_class = ShareSerializer
+    filterset_fields = ['expense', 'user']
+
+    def get_queryset(self):
+        return ExpenseShare.objects.filter(
+            Q(expense__group__in=self.member_groups()) | Q(user=self.request.user)
+        ).select_related('user')
+
+
+class SettlementViewSet(ApiViewSet):
+    serializer_class = SettlementSerializer
+    cursor_ordering = ('-date', '-id')
+    filterset_fields = ['group', 'status', 'payer', 'receiver']
+
+    def get_queryset(self):
+        user = self.request.user
+        return Settlement.objects.filter(
+            Q(group__in=self.member_groups()) | Q(payer=user) | Q(receiver=user)
+        ).select_related('payer', 'receiver')
+
+
+class CommentViewSet(ApiViewSet):
+    serializer_class = CommentSerializer
+    cursor_ordering = ('-created_at', '-id')
+    filterset_fields = ['expense']
+
+    def get_queryset(self):
+        return Comment.objects.filter(expense__group__in=self.member_groups()).select_related('user')
+
+
+class NotificationViewSet(ApiViewSet):
+    serializer_class = NotificationSerializer
+    cursor_ordering = ('-created_at', '-id')
+    filterset_fields = ['is_read', 'type']
+
+    def get_queryset(self):
+        return Notification.objects.filter(user=self.request.user)
+
+
+router = routers.DefaultRouter()
+router.register('groups', GroupViewSet, basename='group')
+router.register('expenses', ExpenseViewSet, basename='expense')
+router.register('shares', ShareViewSet, basename='share')
+router.register('settlements', SettlementViewSet, basename='settlement')
+router.register('comments', CommentViewSet, basename='comment')
+router.register('notifications', NotificationViewSet, basename='notification')
+
+app_name = 'api'
+urlpatterns = router.urls
@@ -0,0 +1,225 @@
+"""
+Materialized per-member balances for groups.
+
+Every page that shows balances reads ``GroupBalance`` rows instead of
+aggregating the whole expense history. The rows are kept in step by the signal
+handlers in ``tracker.signals`` and can be rebuilt or verified from scratch
+with ``manage.py rebuild_balances``.
+
+Rows are kept per currency, and settlements count in the base currency.
+``group_balances`` and ``user_balances`` convert each row's total with the
+current FX rate (see ``tracker.currency``) and add them up.
+"""
+import functools
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.db.models import Sum
+
+from .batching import flush, pending
+from .currency import base_currency, convert_totals
+from .models import Expense, ExpenseShare, GroupBalance, Settlement
+
+ZERO = Decimal('0.00')
+
+PAID, OWED, SETTLED = range(3)
+
+
+def to_decimal(value):
+    """Normalize an amount assigned from a form, fixture or float."""
+    if isinstance(value, Decimal):
+        return value
+    return Decimal(str(value or 0))
+
+
+class BalanceChanges:
+    """Collects ledger deltas keyed by (group_id, user_id, currency) and applies them at once."""
+
+    def __init__(self):
+        self.deltas = defaultdict(lambda: [ZERO, ZERO, ZERO])
+
+    def _add(self, group_id, user_id, currency, column, amount):
+        if group_id is None or user_id is None:
+            return
+        self.deltas[(group_id, user_id, currency or base_currency())][column] += to_decimal(amount)
+
+    def paid(self, group_id, user_id, amount, currency=None):
+        self._add(group_id, user_id, currency, PAID, amount)
+
+    def owed(self, group_id, user_id, amount, currency=None):
+        self._add(group_id, user_id, currency, OWED, amount)
+
+    def settled(self, group_id, user_id, amount):
+        self._add(group_id, user_id, None, SETTLED, amount)
+
+    def apply(self, create=True):
+        """
+        Write the collected deltas: one upsert per batch of rows, or for reversals
+        one SELECT and one UPDATE.
+
+        Pass ``create=False`` when only reversing earlier changes (deletes), so a
+        row removed by a cascade is not resurrected.
+        """
+        deltas = {key: delta for key, delta in self.deltas.items() if any(delta)}
+        self.deltas.clear()
+        if not deltas:
+            return
+        if create:
+            add_increments(GroupBalance, ('group_id', 'user_id', 'currency'), ('paid', 'owed', 'settled'), deltas)
+            return
+
+        flush(GroupBalance)
+        group_ids = {group_id for group_id, _, _ in deltas}
+        user_ids = {user_id for _, user_id, _ in deltas}
+        with transaction.atomic():
+            rows = GroupBalance.objects.select_for_update().filter(
+                group_id__in=group_ids, user_id__in=user_ids
+            )
+            existing = {}
+            for row in rows:
+                key = (row.group_id, row.user_id, row.currency)
+                delta = deltas.get(key)
+                if delta is None:
+                    continue
+                row.paid += delta[PAID]
+                row.owed += delta[OWED]
+                row.settled += delta[SETTLED]
+                existing[key] = row
+
+            if existing:
+                GroupBalance.objects.bulk_update(existing.values(), ['paid', 'owed', 'settled'])
+
+
+def add_increments(model, key_fields, value_fields, deltas):
+    """Upsert ``deltas`` now, or add them to the ones pending in a ``batched_writes`` block."""
+    write = functools.partial(upsert_increments, model, key_fields, value_fields)
+    batch = pending(model, write)
+    if batch is None:
+        write(deltas)
+        return
+    for key, delta in deltas.items():
+        current = batch.get(key)
+        batch[key] = [a + b for a, b in zip(current, delta)] if current else delta
+
+
+def upsert_increments(model, key_fields, value_fields, deltas):
+    """
+    Add ``deltas`` (``{key tuple: [values]}``) to ``model``'s rows, inserting the missing ones.
+
+    Each batch is one ``INSERT ... ON CONFLICT DO UPDATE`` (SQLite and
+    PostgreSQL). The database adds to the existing row or inserts a new one
+    atomically, so two transactions creating the same row at once both succeed
+    instead of one failing on the unique key.
+    """
+    meta = model._meta
+    quote = connection.ops.quote_name
+    table = quote(meta.db_table)
+    keys = [quote(meta.get_field(name).column) for name in key_fields]
+    values = [quote(meta.get_field(name).column) for name in value_fields]
+    columns = keys + values
+    updates = ', '.join(f'{column} = {table}.{column} + excluded.{column}' for column in values)
+    placeholders = '(' + ', '.join(['%s'] * len(columns)) + ')'
+    rows = [(*key, *delta) for key, delta in deltas.items()]
+    batch_size = max(connection.ops.bulk_batch_size(columns, rows), 1)
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            cursor.execute(
+                f'INSERT INTO {table} ({", ".join(columns)}) VALUES {", ".join([placeholders] * len(batch))} '
+                f'ON CONFLICT ({", ".join(keys)}) DO UPDATE SET {updates}',
+                [value for row in batch for value in row],
+            )
+
+
+def _converted(rows, key):
+    # Each row already totals one currency, so only one conversion per row is needed
+    totals = defaultdict(dict)
+    for row in rows:
+        totals[getattr(row, key)][row.currency] = row.balance
+    return {obj_id: convert_totals(by_currency) for obj_id, by_currency in totals.items()}
+
+
+def group_balances(group):
+    """Return ``{user_id: balance}`` in the base currency for every member with ledger activity in ``group``."""
+    return _converted(GroupBalance.objects.filter(group=group), 'user_id')
+
+
+def user_balances(user, groups):
+    """Return ``{group_id: balance}`` in the base currency for ``user`` across ``groups`` in a single query."""
+    return _converted(GroupBalance.objects.filter(user=user, group__in=groups), 'group_id')
+
+
+def compute_balances(group_ids=None):
+    """
+    Aggregate balances from the source tables.
+
+    Returns ``{(group_id, user_id, currency): [paid, owed, settled]}``.
+    """
+    totals = defaultdict(lambda: [ZERO, ZERO, ZERO])
+    base = base_currency()
+
+    expenses = Expense.objects.filter(group__isnull=False)
+    shares = ExpenseShare.objects.filter(expense__group__isnull=False)
+    settlements = Settlement.objects.filter(group__isnull=False, status='completed')
+    if group_ids is not None:
+        expenses = expenses.filter(group_id__in=group_ids)
+        shares = shares.filter(expense__group_id__in=group_ids)
+        settlements = settlements.filter(group_id__in=group_ids)
+
+    for row in expenses.values('group_id', 'paid_by_id', 'currency').annotate(total=Sum('amount')).order_by():
+        totals[(row['group_id'], row['paid_by_id'], row['currency'])][PAID] += row['total']
+    owed = shares.values('expense__group_id', 'user_id', 'expense__currency').annotate(total=Sum('amount')).order_by()
+    for row in owed:
+        totals[(row['expense__group_id'], row['user_id'], row['expense__currency'])][OWED] += row['total']
+    for row in settlements.values('group_id', 'payer_id').annotate(total=Sum('amount')).order_by():
+        totals[(row['group_id'], row['payer_id'], base)][SETTLED] += row['total']
+    for row in settlements.values('group_id', 'receiver_id').annotate(total=Sum('amount')).order_by():
+        totals[(row['group_id'], row['receiver_id'], base)][SETTLED] -= row['total']
+
+    return totals
+
+
+def rebuild_balances(group_ids=None):
+    """Replace the ledger rows (optionally only for ``group_ids``) with freshly computed totals."""
+    totals = compute_balances(group_ids)
+    with transaction.atomic():
+        rows = GroupBalance.objects.all()
+        if group_ids is not None:
+            rows = rows.filter(group_id__in=group_ids)
+        rows.delete()
+        GroupBalance.objects.bulk_create([
+            GroupBalance(group_id=group_id, user_id=user_id, currency=currency,
+                         paid=total[PAID], owed=total[OWED], settled=total[SETTLED])
+            for (group_id, user_id, currency), total in totals.items()
+        ], batch_size=1000)
+        # Local import: the cache module builds on this one
+        from .caching import bump_groups
+        bump_groups(*(group_ids or []), *(group_id for group_id, _, _ in totals))
+    return len(totals)
+
+
+def check_balances(group_ids=None):
+    """
+    Compare the ledger with freshly computed totals.
+
+    Returns a list of ``(group_id, user_id, currency, expected, actual)``
+    tuples for every row that disagrees; an empty list means the ledger is
+    consistent.
+    """
+    expected = compute_balances(group_ids)
+    rows = GroupBalance.objects.all()
+    if group_ids is not None:
+        rows = rows.filter(group_id__in=group_ids)
+    actual = {
+        (row.group_id, row.user_id, row.currency): [row.paid, row.owed, row.settled]
+        for row in rows
+    }
+
+    mismatches = []
+    for key in expected.keys() | actual.keys():
+        want = expected.get(key, [ZERO, ZERO, ZERO])
+        have = actual.get(key, [ZERO, ZERO, ZERO])
+        if want != have:
+            mismatches.append((*key, want, have))
+    return sorted(mismatches, key=lambda mismatch: mismatch[:3])
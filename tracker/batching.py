@@ -0,0 +1,61 @@
+"""
+Batching of derived writes within a request.
+
+Saving an expense fires one ledger write, one rollup write and one search index
+write for the expense, then the same again for its shares. Inside a
+``batched_writes()`` block those writes are collected instead, and each kind
+goes out once when the block ends, still inside the caller's transaction:
+
+    with transaction.atomic(), batched_writes():
+        expense.save()
+        create_shares(expense, allocations)
+
+Outside such a block every write goes out immediately. Reversals (deletes)
+are never deferred; they flush the pending writes of their kind first so
+they see the rows those writes create.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+_pending = ContextVar('tracker_pending_writes', default=None)
+
+
+def pending(key, write):
+    """
+    The active batch's pending values for ``key``, as a dict, or None outside a batch.
+
+    ``write(values)`` is called with the dict when the batch is flushed.
+    """
+    batch = _pending.get()
+    if batch is None:
+        return None
+    if key not in batch:
+        batch[key] = (write, {})
+    return batch[key][1]
+
+
+def flush(key=None):
+    """Write the active batch's pending values for ``key``, or for every key, now."""
+    batch = _pending.get()
+    if not batch:
+        return
+    for name in [key] if key is not None else list(batch):
+        if name in batch:
+            write, values = batch.pop(name)
+            if values:
+                write(values)
+
+
+@contextmanager
+def batched_writes():
+    """Collect derived writes made inside the block and send them when it exits without an error."""
+    if _pending.get() is not None:
+        # Nested blocks join the outer batch
+        yield
+        return
+    token = _pending.set({})
+    try:
+        yield
+        flush()
+    finally:
+        _pending.reset(token)
@@ -0,0 +1,241 @@
+"""
+View benchmarks at several data scales, and a concurrent write benchmark.
+
+Each scale is seeded into a throwaway test database with ``tracker.loadgen``
+and the main pages are requested through the test client as the busiest user.
+
+``run_writes`` posts ``expense_create`` from several threads at once, each with
+its own database connection, into one group of a throwaway database and
+reports throughput and failures for every database profile (``tracker.db``).
+
+Every run uses a private in-process cache (``private_cache``), so it never
+clears or fills the cache the live processes share.
+
+Results are plain dicts so they can be dumped as JSON and compared across runs.
+"""
+import itertools
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection, connections
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+from .instrumentation import RequestRecorder
+from .loadgen import SCALES, seed
+from .db import SQLITE_PROFILES
+from .models import Expense, Group, GroupMember
+
+VIEWS = ['dashboard', 'group_list', 'group_detail', 'notifications', 'expense_detail']
+
+_cache_names = itertools.count()
+
+
+def private_cache():
+    """Swap in an empty LocMemCache of this process's own for the block."""
+    return override_settings(CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': f'benchmark-{os.getpid()}-{next(_cache_names)}',
+    }})
+
+
+def _subjects():
+    """The busiest user, their largest group and that group's newest expense."""
+    busiest = (
+        GroupMember.objects.values('user_id').annotate(groups=Count('id')).order_by('-groups', 'user_id').first()
+    )
+    largest = (
+        GroupMember.objects.filter(group__groupmember__user_id=busiest['user_id'])
+        .values('group_id').annotate(size=Count('id')).order_by('-size', 'group_id').first()
+    )
+    expense = Expense.objects.filter(group_id=largest['group_id']).order_by('-date', '-id').first()
+    return busiest['user_id'], largest['group_id'], expense.id if expense else None
+
+
+def time_views(repeat=5):
+    """
+    Time every view once with an empty cache, then ``repeat`` times warm.
+
+    ``cold`` holds the first request; the other timings and ``queries`` are
+    from the warm requests.
+    """
+    user_id, group_id, expense_id = _subjects()
+    client = Client()
+    client.force_login(User.objects.get(id=user_id))
+    urls = {
+        'dashboard': reverse('tracker:dashboard'),
+        'group_list': reverse('tracker:group_list'),
+        'group_detail': reverse('tracker:group_detail', args=[group_id]),
+        'notifications': reverse('tracker:notifications'),
+        'expense_detail': reverse('tracker:expense_detail', args=[expense_id]) if expense_id else None,
+    }
+
+    results = []
+    for name in VIEWS:
+        if urls[name] is None:
+            continue
+        with private_cache():
+            client.get(urls['group_list'])  # sets the session and CSRF cookies
+        # Cold: a fresh, empty cache, as after a deploy or an eviction
+        with private_cache():
+            started = time.perf_counter()
+            with RequestRecorder() as recorder:
+                response = client.get(urls[name])
+            cold = {
+                'ms': round((time.perf_counter() - started) * 1000, 2),
+                'queries': recorder.queries,
+            }
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                with RequestRecorder() as recorder:
+                    response = client.get(urls[name])
+                timings.append((time.perf_counter() - started) * 1000)
+        results.append({
+            'view': name,
+            'status': response.status_code,
+            'cold': cold,
+            'queries': recorder.queries,
+            'db_ms': round(recorder.db_time * 1000, 2),
+            'min_ms': round(min(timings), 2),
+            'median_ms': round(statistics.median(timings), 2),
+            'max_ms': round(max(timings), 2),
+        })
+    return results
+
+
+def run(scales=('small',), repeat=5, seed_value=0, log=None):
+    """Seed each scale into a fresh test database and time the views; returns a JSON-ready dict."""
+    log = log or (lambda message: None)
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    report = {'database': connection.vendor, 'repeat': repeat, 'scales': []}
+    # Seeding and flushing bump versions too; keep them out of the shared cache
+    cache_override = private_cache()
+    cache_override.enable()
+    try:
+        for scale in scales:
+            call_command('flush', interactive=False, verbosity=0)
+            log(f'Seeding {scale}...')
+            started = time.perf_counter()
+            counts = seed(rng=random.Random(seed_value), **SCALES[scale])
+            seeded = time.perf_counter() - started
+            log(f'Timing views at {scale}...')
+            # time_views gives every view a fresh cache, so summaries cached for
+            # the previous scale (flush restarts primary keys) are never served
+            report['scales'].append({
+                'scale': scale,
+                'rows': counts,
+                'seed_seconds': round(seeded, 2),
+                'views': time_views(repeat),
+            })
+    finally:
+        cache_override.disable()
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+    return report
+
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)] if values else 0
+
+
+def time_concurrent_writes(workers=8, writes=25):
+    """Have ``workers`` members each create ``writes`` expenses in one group at the same time."""
+    group = Group.objects.create(name='Write benchmark')
+    clients = []
+    for i in range(workers):
+        user = User.objects.create_user(f'writer{i}-{group.id}')
+        GroupMember.objects.create(user=user, group=group)
+        client = Client()
+        client.force_login(user)
+        clients.append(client)
+    url = reverse('tracker:expense_create', args=[group.id])
+
+    latencies = []
+    errors = []
+    start = threading.Barrier(workers + 1)
+
+    def worker(client):
+        start.wait()
+        try:
+            for i in range(writes):
+                started = time.perf_counter()
+                try:
+                    response = client.post(url, {
+                        'title': f'Expense {i}', 'amount': '12.00', 'currency': 'USD', 'split_type': 'equal',
+                    })
+                except Exception as e:
+                    errors.append(str(e))
+                    continue
+                if response.status_code == 302:
+                    latencies.append((time.perf_counter() - started) * 1000)
+                else:
+                    errors.append(f'HTTP {response.status_code}')
+        finally:
+            connections.close_all()
+
+    threads = [threading.Thread(target=worker, args=(client,)) for client in clients]
+    for thread in threads:
+        thread.start()
+    started = time.perf_counter()
+    start.wait()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    return {
+        'workers': workers,
+        'writes': len(latencies),
+        'errors': len(errors),
+        'first_error': errors[0] if errors else None,
+        'seconds': round(elapsed, 2),
+        'writes_per_second': round(len(latencies) / elapsed, 1),
+        'median_ms': round(statistics.median(latencies), 2) if latencies else None,
+        'p95_ms': round(_percentile(latencies, 0.95), 2) if latencies else None,
+    }
+
+
+def run_writes(profiles=None, workers=8, writes=25, log=None):
+    """
+    Time concurrent expense creation for each profile; returns a JSON-ready dict.
+
+    SQLite runs every profile in ``SQLITE_PROFILES`` (or ``profiles``) against a
+    temporary database file, since an in-memory database can't be shared
+    between threads. Other databases run once with their configured settings.
+    """
+    log = log or (lambda message: None)
+    sqlite = connection.vendor == 'sqlite'
+    if sqlite:
+        profiles = profiles or list(SQLITE_PROFILES)
+        directory = tempfile.mkdtemp()
+        connection.settings_dict['TEST']['NAME'] = os.path.join(directory, 'benchmark.sqlite3')
+    else:
+        profiles = [connection.vendor]
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    report = {'database': connection.vendor, 'profiles': []}
+    try:
+        for profile in profiles:
+            log(f'Timing writes with the {profile} profile...')
+            with override_settings(SQLITE_PROFILE=profile), private_cache():
+                # Reconnect so the profile's PRAGMAs apply
+                connection.close()
+                result = time_concurrent_writes(workers, writes)
+            report['profiles'].append({'profile': profile, **result})
+    finally:
+        connection.close()
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+        if sqlite:
+            os.rmdir(directory)
+    return report
@@ -0,0 +1,222 @@
+"""
+Versioned caching of per-group and per-user summaries.
+
+Every group and every user has a version number kept in the cache. Summary
+entries have the version in their key, so changing the data only needs a
+version bump. The old entries are never looked up again and expire by
+themselves. The signal handlers in ``tracker.signals`` bump versions:
+
+* a group's version when its expenses, shares, settlements or members change,
+* a user's version when they join or leave a group,
+* an expense's version when it, its shares or its comments change.
+
+The same versions drive conditional GETs of the group and expense pages: a
+version doubles as the page's ``Last-Modified`` time and is part of its ``ETag``.
+
+User summaries also depend on every group the user belongs to, so their keys
+include a digest of those groups' versions as well. Balances are converted to
+the base currency, so their keys also carry ``currency.conversion_key()``.
+
+Versions are millisecond timestamps rather than counters. If a version key is
+evicted or expires (after ``VERSION_TIMEOUT``), the replacement is newer than
+anything cached under the old one.
+Bumps happen after the transaction commits, so a concurrent reader can't
+cache data the change has not committed yet under the new version.
+
+The default ``LocMemCache`` is enough for one process. Deployments that run
+the worker and management commands next to the web processes need a backend
+they all share, such as Redis or Memcached; a per-process cache keeps each
+process's versions to itself, which the ``tracker.W001`` deploy check reports.
+Lookups are counted per kind in the cache itself (see ``cache_stats`` and
+``manage.py cache_stats``), but only for a sample of them
+(``settings.CACHE_STATS_SAMPLE_RATE``), so a cached read doesn't also cost a
+cache write.
+"""
+import functools
+import hashlib
+import random
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F, Q, Window
+from django.db.models.functions import RowNumber
+
+from .balances import group_balances, user_balances
+from .currency import conversion_key
+from .models import Expense, Group, GroupMember
+from .pagination import keyset_page
+
+SUMMARY_TIMEOUT = 60 * 60
+VERSION_TIMEOUT = 7 * 24 * 60 * 60
+PREVIEW_MEMBERS = 3
+KINDS = ('group', 'user')
+
+_MISSING = object()
+
+
+def _version_key(kind, obj_id):
+    return f'version:{kind}:{obj_id}'
+
+
+def _now_version():
+    return int(time.time() * 1000)
+
+
+def get_versions(kind, ids):
+    """``{id: version}`` for ``ids``, starting a version for any that has none yet."""
+    keys = {_version_key(kind, obj_id): obj_id for obj_id in ids}
+    found = cache.get_many(keys)
+    for key in keys.keys() - found.keys():
+        version = _now_version()
+        cache.add(key, version, VERSION_TIMEOUT)
+        found[key] = version
+    return {keys[key]: version for key, version in found.items()}
+
+
+def _bump_now(kind, ids):
+    keys = [_version_key(kind, obj_id) for obj_id in ids]
+    current = cache.get_many(keys)
+    now = _now_version()
+    cache.set_many({key: max(now, current.get(key, 0) + 1) for key in keys}, VERSION_TIMEOUT)
+
+
+def bump(kind, *ids):
+    """Invalidate every cached summary of the given groups or users once the transaction commits."""
+    ids = {obj_id for obj_id in ids if obj_id is not None}
+    if ids:
+        transaction.on_commit(functools.partial(_bump_now, kind, ids))
+
+
+def bump_groups(*group_ids):
+    bump('group', *group_ids)
+
+
+def bump_users(*user_ids):
+    bump('user', *user_ids)
+
+
+def bump_expenses(*expense_ids):
+    bump('expense', *expense_ids)
+
+
+def _count(kind, outcome):
+    rate = settings.CACHE_STATS_SAMPLE_RATE
+    if rate <= 0 or random.random() >= rate:
+        return
+    # Each sampled lookup stands for the ones that were skipped
+    weight = round(1 / rate)
+    key = f'summary-stats:{kind}:{outcome}'
+    try:
+        cache.incr(key, weight)
+    except ValueError:
+        if not cache.add(key, weight, None):
+            cache.incr(key, weight)
+
+
+def cached(kind, key, compute):
+    """Return the value stored under ``key``, computing and storing it on a miss."""
+    value = cache.get(key, _MISSING)
+    if value is _MISSING:
+        _count(kind, 'misses')
+        value = compute()
+        cache.set(key, value, SUMMARY_TIMEOUT)
+    else:
+        _count(kind, 'hits')
+    return value
+
+
+def annotate_versions(kind, objects):
+    """Set ``cache_version`` on each object, for template fragment cache keys."""
+    versions = get_versions(kind, [obj.id for obj in objects])
+    for obj in objects:
+        obj.cache_version = versions[obj.id]
+    return objects
+
+
+def cache_stats():
+    stats = {}
+    counters = cache.get_many([f'summary-stats:{kind}:{outcome}' for kind in KINDS for outcome in ('hits', 'misses')])
+    for kind in KINDS:
+        hits = counters.get(f'summary-stats:{kind}:hits', 0)
+        misses = counters.get(f'summary-stats:{kind}:misses', 0)
+        total = hits + misses
+        stats[kind] = {'hits': hits, 'misses': misses, 'hit_rate': round(hits / total, 3) if total else None}
+    return stats
+
+
+def reset_cache_stats():
+    cache.delete_many([f'summary-stats:{kind}:{outcome}' for kind in KINDS for outcome in ('hits', 'misses')])
+
+
+class GroupSummary:
+    """Cached roster, balances and newest expenses of one group."""
+
+    def __init__(self, group):
+        self.group = group
+        self.version = get_versions('group', [group.id])[group.id]
+        self.prefix = f'summary:group:{group.id}:{self.version}'
+
+    def roster(self):
+        """Members in joining order, each with their ``role`` in this group."""
+        return cached('group', f'{self.prefix}:roster', lambda: list(
+            self.group.members.annotate(role=F('groupmember__role')).order_by('groupmember__joined_at', 'id')
+        ))
+
+    def balances(self):
+        """``{user_id: balance}`` from the ledger."""
+        return cached('group', f'{self.prefix}:balances:{conversion_key()}', lambda: group_balances(self.group))
+
+    def recent_expenses(self, page_size):
+        """The first feed page as ``(expenses, next_cursor)``."""
+        return cached('group', f'{self.prefix}:recent_expenses:{page_size}', lambda: keyset_page(
+            Expense.objects.filter(group=self.group).select_related('paid_by'), page_size=page_size
+        ))
+
+
+class UserSummary:
+    """Cached groups, balances and recent expenses of one user."""
+
+    def __init__(self, user):
+        self.user = user
+        version = get_versions('user', [user.id])[user.id]
+        prefix = f'summary:user:{user.id}:{version}'
+        self.group_ids = cached('user', f'{prefix}:group_ids', lambda: list(
+            GroupMember.objects.filter(user=user).order_by('group_id').values_list('group_id', flat=True)
+        ))
+        group_versions = get_versions('group', self.group_ids)
+        signature = hashlib.md5(
+            ','.join(f'{group_id}:{group_versions[group_id]}' for group_id in self.group_ids).encode()
+        ).hexdigest()
+        self.prefix = f'{prefix}:{signature}'
+
+    def groups(self):
+        """The user's groups with ``member_count`` and the first three ``preview_members``."""
+        return cached('user', f'{self.prefix}:groups', self._groups)
+
+    def _groups(self):
+        groups = list(Group.objects.filter(id__in=self.group_ids).annotate(member_count=Count('groupmember')))
+        # The first members of every group in one query, numbered within each group
+        first_members = GroupMember.objects.filter(group_id__in=self.group_ids).annotate(
+            position=Window(RowNumber(), partition_by=F('group_id'), order_by=[F('joined_at'), F('id')])
+        ).filter(position__lte=PREVIEW_MEMBERS).select_related('user').order_by('group_id', 'position')
+        previews = defaultdict(list)
+        for membership in first_members:
+            previews[membership.group_id].append(membership.user)
+        for group in groups:
+            group.preview_members = previews[group.id]
+        return groups
+
+    def balances(self):
+        """``{group_id: balance}`` from the ledger."""
+        return cached(
+            'user', f'{self.prefix}:balances:{conversion_key()}', lambda: user_balances(self.user, self.group_ids)
+        )
+
+    def recent_expenses(self, limit=5):
+        return cached('user', f'{self.prefix}:recent_expenses:{limit}', lambda: list(
+            Expense.objects.filter(Q(group_id__in=self.group_ids) | Q(paid_by=self.user))
+            .select_related('group', 'paid_by').order_by('-date')[:limit]
+        ))
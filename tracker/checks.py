@@ -0,0 +1,26 @@
+"""
+System checks for deployment settings the tracker relies on.
+"""
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+
+PER_PROCESS_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    backend = settings.CACHES.get('default', {}).get('BACKEND')
+    if backend not in PER_PROCESS_CACHES:
+        return []
+    return [Warning(
+        f'The default cache ({backend}) is not shared between processes.',
+        hint=(
+            'Summary and page versions, exchange rates and unread counts changed by the notification '
+            'worker or management commands will never reach the web processes. Set CACHE_BACKEND to '
+            'a shared backend such as RedisCache or PyMemcacheCache.'
+        ),
+        id='tracker.W001',
+    )]
@@ -0,0 +1,61 @@
+"""
+Websocket consumers.
+
+``NotificationConsumer`` keeps the navbar badge current: it sends the unread
+count when a page connects and again whenever the count changes.
+
+``GroupActivityConsumer`` relays the expense, comment and settlement events of
+one group (see ``tracker.activity``) to that group's open pages.
+
+Both are async consumers that do their database work once, on connect, and
+keep no per-connection state besides their channel layer group, so an idle
+socket costs a daphne process one coroutine and no thread.
+"""
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+
+from .activity import group_channel_group
+from .models import GroupMember
+from .notifications import unread_count, user_channel_group
+
+
+class NotificationConsumer(AsyncJsonWebsocketConsumer):
+    async def connect(self):
+        user = self.scope.get('user')
+        if user is None or not user.is_authenticated:
+            await self.close()
+            return
+        self.group_name = user_channel_group(user.id)
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.accept()
+        count = await database_sync_to_async(unread_count)(user.id)
+        await self.send_json({'type': 'unread', 'count': count})
+
+    async def disconnect(self, code):
+        if hasattr(self, 'group_name'):
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+
+    async def unread_count(self, event):
+        await self.send_json({'type': 'unread', 'count': event['count']})
+
+
+class GroupActivityConsumer(AsyncJsonWebsocketConsumer):
+    async def connect(self):
+        user = self.scope.get('user')
+        group_id = self.scope['url_route']['kwargs']['group_id']
+        if user is None or not user.is_authenticated:
+            await self.close()
+            return
+        if not await GroupMember.objects.filter(group_id=group_id, user_id=user.id).aexists():
+            await self.close()
+            return
+        self.group_name = group_channel_group(group_id)
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.accept()
+
+    async def disconnect(self, code):
+        if hasattr(self, 'group_name'):
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+
+    async def group_activity(self, event):
+        await self.send_json({'type': 'activity', **event['event']})
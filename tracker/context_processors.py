@@ -0,0 +1,9 @@
+from .notifications import unread_count
+
+
+def notifications(request):
+    """Expose the cached unread count to every template for the navbar badge."""
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        return {}
+    return {'unread_count': unread_count(user.id)}
@@ -0,0 +1,146 @@
+"""
+Currency conversion from a locally loaded FX rate table.
+
+Rates are ``ExchangeRate`` rows imported from a file with ``manage.py
+import_rates`` (production jobs have no network access). Each rate is the
+value of one unit of a currency in ``settings.BASE_CURRENCY`` on a given day.
+A lookup uses the latest rate on or before the day, or the earliest one when
+the day predates the table.
+
+Each process loads the whole table into memory once, indexed by currency
+with sorted dates, and answers ``(currency, day)`` lookups through an LRU
+cache. Importing rates stores a new table version in the shared cache, so the
+other processes reload on their next lookup, and bumps the cached summaries of
+every group with balances in another currency.
+
+Converted totals change when new rates are imported and when the day changes
+(a later rate becomes "today's"), so anything caching them keys on
+``conversion_key()``.
+
+Callers convert in bulk. They sum amounts per currency in SQL and convert
+each total once, never individual rows.
+"""
+import bisect
+import csv
+import functools
+import logging
+import time
+from collections import defaultdict
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from .models import ExchangeRate, GroupBalance
+
+logger = logging.getLogger('tracker.currency')
+
+CENT = Decimal('0.01')
+VERSION_KEY = 'version:fx:rates'
+VERSION_TIMEOUT = 7 * 24 * 60 * 60
+LOOKUP_CACHE_SIZE = 4096
+
+
+class RateFileError(Exception):
+    """A rate file that can't be imported; the message says which line and why."""
+
+
+def base_currency():
+    return getattr(settings, 'BASE_CURRENCY', 'USD')
+
+
+class RateTable:
+    """In-memory rates as ``{currency: (sorted dates, rates)}``."""
+
+    def __init__(self, rows, version=None):
+        self.version = version
+        index = defaultdict(list)
+        for currency, day, rate in sorted(rows):
+            index[currency].append((day, rate))
+        self.index = {
+            currency: ([day for day, _ in entries], [rate for _, rate in entries])
+            for currency, entries in index.items()
+        }
+        self.rate = functools.lru_cache(maxsize=LOOKUP_CACHE_SIZE)(self._rate)
+
+    def _rate(self, currency, day):
+        if currency == base_currency():
+            return Decimal(1)
+        if currency not in self.index:
+            # Better a visibly unconverted total than a page that fails to load
+            logger.warning('No exchange rate for %s; treating it as %s', currency, base_currency())
+            return Decimal(1)
+        days, rates = self.index[currency]
+        return rates[max(bisect.bisect_right(days, day) - 1, 0)]
+
+    def convert(self, amount, currency, day=None):
+        """``amount`` in ``currency`` as base currency, rounded to cents."""
+        rate = self.rate(currency, day or timezone.localdate())
+        return (amount * rate).quantize(CENT)
+
+    def convert_totals(self, totals, day=None):
+        """Sum ``{currency: amount}`` into one base currency amount."""
+        return sum((self.convert(amount, currency, day) for currency, amount in totals.items()), Decimal('0.00'))
+
+
+_table = None
+
+
+def rate_table():
+    """The process-wide table, reloaded when another process imported new rates."""
+    global _table
+    version = cache.get(VERSION_KEY)
+    if _table is None or _table.version != version:
+        rows = ExchangeRate.objects.values_list('currency', 'date', 'rate')
+        _table = RateTable(rows.iterator(), version)
+    return _table
+
+
+def conversion_key():
+    """Changes whenever conversions at today's rates can: the table version and today's date."""
+    return f'{cache.get(VERSION_KEY, 0)}-{timezone.localdate().isoformat()}'
+
+
+def convert_totals(totals, day=None):
+    """Sum ``{currency: amount}`` into the base currency, loading rates only when needed."""
+    base = base_currency()
+    if all(currency == base for currency in totals):
+        return sum(totals.values(), Decimal('0.00')).quantize(CENT)
+    return rate_table().convert_totals(totals, day)
+
+
+def read_rates(lines):
+    """Parse ``date,currency,rate`` CSV rows (with a header) into ``(currency, date, rate)`` tuples."""
+    rows = []
+    for line, row in enumerate(csv.DictReader(lines), start=2):
+        try:
+            day = parse_date((row.get('date') or '').strip())
+            rate = Decimal((row.get('rate') or '').strip())
+        except (ValueError, InvalidOperation):
+            day = rate = None
+        currency = (row.get('currency') or '').strip().upper()
+        if day is None or rate is None or rate <= 0 or len(currency) != 3:
+            raise RateFileError(f'Line {line}: expected date,currency,rate but got {row!r}.')
+        rows.append((currency, day, rate))
+    return rows
+
+
+def import_rates(rows, batch_size=1000):
+    """Insert or update ``(currency, date, rate)`` rows, publish the new table version and bump affected groups."""
+    # Imported here: caching depends on balances, which depends on this module
+    from .caching import bump_groups
+
+    ExchangeRate.objects.bulk_create(
+        [ExchangeRate(currency=currency, date=day, rate=rate) for currency, day, rate in rows],
+        batch_size=batch_size,
+        update_conflicts=True,
+        unique_fields=['currency', 'date'],
+        update_fields=['rate'],
+    )
+    cache.set(VERSION_KEY, int(time.time() * 1000), VERSION_TIMEOUT)
+    # Cached balances of groups with foreign currency activity used the old rates
+    foreign = GroupBalance.objects.exclude(currency=base_currency()).values_list('group_id', flat=True)
+    bump_groups(*foreign.distinct())
+    return len(rows)
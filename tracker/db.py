@@ -0,0 +1,47 @@
+"""
+Per-connection database tuning.
+
+SQLite connections get the PRAGMAs of ``settings.SQLITE_PROFILE`` as soon as
+they are opened:
+
+* ``tuned`` (the default) switches to write-ahead logging so readers never
+  block the writer, waits up to ``busy_timeout`` ms for the write lock instead
+  of failing with "database is locked", relaxes fsyncs to ``synchronous=NORMAL``
+  (still safe in WAL mode) and memory-maps the database file.
+* ``default`` restores SQLite's own rollback journal and full fsyncs, which is
+  what a plain Django project runs with. It exists so ``benchmark_writes`` can
+  compare the two.
+
+PostgreSQL needs nothing here; its persistent connections and health checks
+are configured in settings.
+"""
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+SQLITE_PROFILES = {
+    'default': {
+        'journal_mode': 'DELETE',
+        'synchronous': 'FULL',
+        'mmap_size': 0,
+    },
+    'tuned': {
+        'journal_mode': 'WAL',
+        'busy_timeout': 5000,
+        'synchronous': 'NORMAL',
+        'mmap_size': 256 * 1024 * 1024,
+    },
+}
+
+
+def sqlite_pragmas(profile=None):
+    return SQLITE_PROFILES[profile or getattr(settings, 'SQLITE_PROFILE', 'tuned')]
+
+
+@receiver(connection_created)
+def configure_connection(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    # On the raw connection, so the PRAGMAs don't count against query budgets
+    for name, value in sqlite_pragmas().items():
+        connection.connection.execute(f'PRAGMA {name} = {value}')
@@ -0,0 +1,171 @@
+"""
+Streaming export of a group's full ledger history.
+
+Expenses and settlements are read in keyset pages (``id > last_id``) through
+``.iterator(chunk_size=...)`` and each page of expenses pulls its shares with
+one extra query, so memory stays flat no matter how long the history is. The
+generators yield encoded chunks ready for ``StreamingHttpResponse`` or a file.
+
+Under ASGI, Django would drain a sync generator into a list before sending
+any of it, so ``aiter_chunks`` wraps the generator for async consumers.
+"""
+import csv
+import itertools
+import json
+import zlib
+
+from asgiref.sync import sync_to_async
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import Expense, ExpenseShare, Settlement
+
+DEFAULT_CHUNK_SIZE = 2000
+# Chunks fetched per thread hop when streaming to an async server
+ASYNC_BATCH_SIZE = 50
+
+FORMATS = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+}
+
+CSV_COLUMNS = [
+    'record', 'id', 'date', 'expense_id', 'title', 'amount', 'currency', 'split_type',
+    'from_user', 'to_user', 'percentage', 'status', 'payment_method', 'description',
+]
+
+EXPENSE_FIELDS = ('id', 'date', 'title', 'amount', 'currency', 'split_type', 'description', 'paid_by__username')
+SHARE_FIELDS = ('id', 'expense_id', 'amount', 'percentage', 'user__username')
+SETTLEMENT_FIELDS = (
+    'id', 'date', 'amount', 'status', 'payment_method', 'notes', 'payer__username', 'receiver__username',
+)
+
+
+class _LineBuffer:
+    """Write target for ``csv.writer`` that hands back each formatted line."""
+
+    def write(self, value):
+        return value
+
+
+def keyset_pages(queryset, fields, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Yield lists of ``values()`` dicts ordered by id, one page per query.
+
+    Each page continues from the last id seen, so the database never has to
+    skip over earlier rows the way OFFSET pagination would.
+    """
+    last_id = 0
+    while True:
+        page = list(
+            queryset.filter(id__gt=last_id).order_by('id').values(*fields)[:chunk_size]
+            .iterator(chunk_size=chunk_size)
+        )
+        if not page:
+            return
+        yield page
+        last_id = page[-1]['id']
+        if len(page) < chunk_size:
+            return
+
+
+def ledger_records(group, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield ``(expense, shares)`` and ``(settlement, None)`` pairs for ``group``, oldest id first."""
+    for expenses in keyset_pages(Expense.objects.filter(group=group), EXPENSE_FIELDS, chunk_size):
+        shares = {}
+        share_rows = (
+            ExpenseShare.objects.filter(expense_id__in=[expense['id'] for expense in expenses])
+            .order_by('expense_id', 'id').values(*SHARE_FIELDS).iterator(chunk_size=chunk_size)
+        )
+        for share in share_rows:
+            shares.setdefault(share['expense_id'], []).append(share)
+        for expense in expenses:
+            expense['record'] = 'expense'
+            yield expense, shares.get(expense['id'], [])
+
+    for settlements in keyset_pages(Settlement.objects.filter(group=group), SETTLEMENT_FIELDS, chunk_size):
+        for settlement in settlements:
+            settlement['record'] = 'settlement'
+            yield settlement, None
+
+
+def _csv_rows(record, shares):
+    if record['record'] == 'settlement':
+        yield [
+            'settlement', record['id'], record['date'].isoformat(), '', '', record['amount'], '', '',
+            record['payer__username'], record['receiver__username'], '', record['status'],
+            record['payment_method'], record['notes'],
+        ]
+        return
+    yield [
+        'expense', record['id'], record['date'].isoformat(), record['id'], record['title'], record['amount'],
+        record['currency'], record['split_type'], record['paid_by__username'], '', '', '', '',
+        record['description'],
+    ]
+    for share in shares:
+        yield [
+            'share', share['id'], '', record['id'], '', share['amount'], record['currency'], '',
+            share['user__username'], record['paid_by__username'],
+            '' if share['percentage'] is None else share['percentage'], '', '', '',
+        ]
+
+
+def export_csv(group, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield the ledger as CSV, one encoded chunk per keyset page."""
+    writer = csv.writer(_LineBuffer())
+    lines = [writer.writerow(CSV_COLUMNS)]
+    for record, shares in ledger_records(group, chunk_size):
+        lines.extend(writer.writerow(row) for row in _csv_rows(record, shares))
+        if len(lines) >= chunk_size:
+            yield ''.join(lines).encode()
+            lines = []
+    if lines:
+        yield ''.join(lines).encode()
+
+
+def export_jsonl(group, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield the ledger as newline-delimited JSON with shares nested in their expense."""
+    encoder = DjangoJSONEncoder()
+    lines = []
+    for record, shares in ledger_records(group, chunk_size):
+        if shares is not None:
+            record['shares'] = [
+                {'id': share['id'], 'user': share['user__username'], 'amount': share['amount'],
+                 'percentage': share['percentage']}
+                for share in shares
+            ]
+            record['paid_by'] = record.pop('paid_by__username')
+        else:
+            record['payer'] = record.pop('payer__username')
+            record['receiver'] = record.pop('receiver__username')
+        lines.append(encoder.encode(record) + '\n')
+        if len(lines) >= chunk_size:
+            yield ''.join(lines).encode()
+            lines = []
+    if lines:
+        yield ''.join(lines).encode()
+
+
+def gzip_stream(chunks, level=6):
+    """Compress an iterable of byte chunks into a gzip stream on the fly."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_group(group, fmt='csv', gzip=False, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Return the chunk generator for ``fmt`` ('csv' or 'jsonl'), optionally gzipped."""
+    chunks = export_jsonl(group, chunk_size) if fmt == 'jsonl' else export_csv(group, chunk_size)
+    return gzip_stream(chunks) if gzip else chunks
+
+
+async def aiter_chunks(chunks, batch_size=ASYNC_BATCH_SIZE):
+    """Async iterator over a sync chunk generator, pulling ``batch_size`` chunks per thread hop."""
+    # Thread-sensitive, so every batch runs on the thread holding the export's cursor
+    next_batch = sync_to_async(lambda: list(itertools.islice(chunks, batch_size)), thread_sensitive=True)
+    while batch := await next_batch():
+        for chunk in batch:
+            yield chunk
@@ -2,6 +2,7 @@ from django import forms
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.models import User
 from .models import Group, Expense, ExpenseShare, Settlement, Comment
+from .splits import SplitError, allocate_shares
 from crispy_forms.helper import FormHelper
 from crispy_forms.layout import Submit, Layout, Field, Div
 
@@ -42,12 +43,40 @@ class ExpenseForm(forms.ModelForm):
     
     def __init__(self, *args, **kwargs):
         user = kwargs.pop('user', None)
+        members = kwargs.pop('members', None)
         super().__init__(*args, **kwargs)
         if user:
             self.fields['group'].queryset = user.group_set.all()
+        
+        # One input per member, used as an amount or a percentage depending on split type
+        self.members = list(members) if members is not None else None
+        self.allocations = []
+        for member in self.members or []:
+            self.fields[f'share_{member.id}'] = forms.DecimalField(
+                label=member.username,
+                max_digits=10,
+                decimal_places=2,
+                min_value=0,
+                required=False,
+                widget=forms.NumberInput(attrs={'class': 'share-amount', 'step': '0.01'}),
+                help_text='Amount for exact splits, percentage for percent splits.',
+            )
+        
         self.helper = FormHelper()
         self.helper.form_method = 'post'
         self.helper.add_input(Submit('submit', 'Add Expense', css_class='btn btn-primary'))
+    
+    def clean(self):
+        cleaned_data = super().clean()
+        amount = cleaned_data.get('amount')
+        split_type = cleaned_data.get('split_type')
+        if self.members is not None and amount and split_type:
+            values = {member.id: cleaned_data.get(f'share_{member.id}') for member in self.members}
+            try:
+                self.allocations = allocate_shares(amount, split_type, self.members, values)
+            except SplitError as e:
+                raise forms.ValidationError(str(e))
+        return cleaned_data
 
 class ExpenseShareForm(forms.ModelForm):
     class Meta:
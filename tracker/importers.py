@@ -0,0 +1,259 @@
+"""
+Streaming bulk import of expenses from CSV and OFX bank exports.
+
+Rows are read lazily, validated a chunk at a time and written with batched
+``bulk_create`` calls, so memory stays bounded however large the file is. A
+bad row is recorded in the result and skipped; it never aborts the import.
+
+CSV files need a header row. ``title`` and ``amount`` are required; ``date``,
+``description``, ``currency``, ``paid_by`` (username or email, defaults to the
+importing user) and ``split_between`` (``;``-separated usernames, defaults to
+every member) are optional. Shares are split equally.
+"""
+import csv
+import re
+import time
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .activity import broadcast
+from .balances import BalanceChanges
+from .caching import bump_groups
+from .models import Expense, ExpenseShare
+from .rollups import SpendingChanges
+from .search import index_expenses
+from .splits import SplitError, allocate_shares
+
+DEFAULT_CHUNK_SIZE = 1000
+
+# Only the first errors are kept in full; the rest are just counted
+MAX_REPORTED_ERRORS = 1000
+
+OFX_TRANSACTION = re.compile(r'<STMTTRN>(.*?)</STMTTRN>', re.DOTALL | re.IGNORECASE)
+OFX_FIELD = re.compile(r'<([A-Z0-9.]+)>([^<\r\n]*)', re.IGNORECASE)
+OFX_CURRENCY = re.compile(r'<CURDEF>([A-Z]{3})', re.IGNORECASE)
+
+
+class ImportRowError(ValueError):
+    """A single row could not be turned into an expense."""
+
+
+class ImportResult:
+    def __init__(self):
+        self.rows = 0
+        self.created = 0
+        self.error_count = 0
+        self.errors = []
+        self.seconds = 0.0
+
+    @property
+    def rows_per_second(self):
+        return round(self.rows / self.seconds, 1) if self.seconds else 0.0
+
+    def add_error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line, 'error': message})
+
+    def as_dict(self):
+        return {
+            'rows': self.rows,
+            'created': self.created,
+            'error_count': self.error_count,
+            'errors': self.errors,
+            'seconds': round(self.seconds, 3),
+            'rows_per_second': self.rows_per_second,
+        }
+
+
+def read_csv(stream):
+    """Yield ``(line_number, row)`` pairs from a text stream with a header row."""
+    reader = csv.DictReader(stream)
+    for row in reader:
+        yield reader.line_num, {
+            (key or '').strip().lower(): (value or '').strip()
+            for key, value in row.items()
+            if isinstance(value, str) or value is None
+        }
+
+
+def read_ofx(stream, read_size=64 * 1024):
+    """
+    Yield ``(transaction_number, row)`` pairs from an OFX statement.
+
+    The file is scanned in ``read_size`` pieces and only the text of the
+    current ``<STMTTRN>`` block is held in memory. Debits become positive
+    amounts; credits come through negative and are rejected by validation.
+    """
+    buffer = ''
+    currency = ''
+    number = 0
+    while True:
+        piece = stream.read(read_size)
+        buffer += piece
+        if not currency:
+            match = OFX_CURRENCY.search(buffer)
+            if match:
+                currency = match.group(1).upper()
+
+        end = 0
+        for match in OFX_TRANSACTION.finditer(buffer):
+            number += 1
+            fields = {name.upper(): value.strip() for name, value in OFX_FIELD.findall(match.group(1))}
+            amount = fields.get('TRNAMT', '').lstrip('+')
+            yield number, {
+                'title': fields.get('NAME') or fields.get('MEMO', ''),
+                'description': fields.get('MEMO', ''),
+                'amount': amount[1:] if amount.startswith('-') else f'-{amount}' if amount else '',
+                'date': fields.get('DTPOSTED', ''),
+                'currency': currency,
+            }
+            end = match.end()
+
+        if not piece:
+            return
+        # Keep only the unfinished tail; drop anything before the next block
+        buffer = buffer[end:]
+        start = buffer.upper().find('<STMTTRN>')
+        buffer = buffer[start:] if start >= 0 else buffer[-16:]
+
+
+def _parse_date(value):
+    if not value:
+        return timezone.now()
+    digits = re.match(r'(\d{8})(\d{6})?', value)
+    if digits:
+        # OFX style: YYYYMMDD[HHMMSS][.XXX][TZ]
+        stamp = digits.group(1) + (digits.group(2) or '000000')
+        value = f'{stamp[:4]}-{stamp[4:6]}-{stamp[6:8]}T{stamp[8:10]}:{stamp[10:12]}:{stamp[12:14]}'
+    parsed = parse_datetime(value)
+    if parsed is None:
+        day = parse_date(value)
+        if day is None:
+            raise ImportRowError(f'Invalid date {value!r}.')
+        parsed = datetime(day.year, day.month, day.day)
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed, timezone.get_default_timezone())
+    return parsed
+
+
+class ExpenseImporter:
+    """Import expense rows into ``group`` on behalf of ``user``."""
+
+    def __init__(self, group, user, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.group = group
+        self.user = user
+        self.chunk_size = chunk_size
+        self.members = list(group.members.order_by('id'))
+        self.lookup = {}
+        for member in self.members:
+            self.lookup[member.username.lower()] = member
+            if member.email:
+                self.lookup.setdefault(member.email.lower(), member)
+
+    def _member(self, name):
+        member = self.lookup.get(name.lower())
+        if member is None:
+            raise ImportRowError(f'{name!r} is not a member of this group.')
+        return member
+
+    def build(self, row):
+        """Validate one row and return ``(expense, allocations)`` without touching the database."""
+        title = row.get('title', '')
+        if not title:
+            raise ImportRowError('Missing title.')
+        if len(title) > 200:
+            raise ImportRowError('Title is longer than 200 characters.')
+
+        try:
+            amount = Decimal(row.get('amount', '').replace(',', ''))
+        except InvalidOperation:
+            amount = None
+        if amount is None or not amount.is_finite():
+            raise ImportRowError(f'Invalid amount {row.get("amount")!r}.')
+        if amount < 0:
+            raise ImportRowError('Negative amounts (credits and refunds) are not imported.')
+        if amount < Decimal('0.01'):
+            raise ImportRowError('Amount must be at least 0.01.')
+        if amount.as_tuple().exponent < -2 or amount >= Decimal('100000000'):
+            raise ImportRowError(f'Amount {amount} does not fit in 10 digits with 2 decimal places.')
+
+        currency = (row.get('currency') or 'USD').upper()
+        if not re.fullmatch(r'[A-Z]{3}', currency):
+            raise ImportRowError(f'Invalid currency {currency!r}.')
+
+        paid_by = self._member(row['paid_by']) if row.get('paid_by') else self.user
+        if row.get('split_between'):
+            split_between = [self._member(name.strip()) for name in row['split_between'].split(';') if name.strip()]
+        else:
+            split_between = self.members
+
+        expense = Expense(
+            title=title,
+            amount=amount,
+            description=row.get('description', ''),
+            date=_parse_date(row.get('date')),
+            group=self.group,
+            paid_by=paid_by,
+            split_type='equal',
+            currency=currency,
+        )
+        try:
+            allocations = allocate_shares(amount, 'equal', split_between)
+        except SplitError as e:
+            raise ImportRowError(str(e))
+        return expense, allocations
+
+    def write(self, built):
+        """Insert one validated chunk: expenses, shares, ledger and rollup deltas in one transaction."""
+        changes = BalanceChanges()
+        spending = SpendingChanges()
+        with transaction.atomic():
+            expenses = Expense.objects.bulk_create([expense for expense, _ in built])
+            shares = []
+            for expense, (_, allocations) in zip(expenses, built):
+                changes.paid(self.group.id, expense.paid_by_id, expense.amount, expense.currency)
+                spending.paid(self.group.id, expense.paid_by_id, expense.currency, expense.date, expense.amount)
+                for allocation in allocations:
+                    shares.append(ExpenseShare(expense=expense, user=allocation.user, amount=allocation.amount))
+                    changes.owed(self.group.id, allocation.user.id, allocation.amount, expense.currency)
+                    spending.share(self.group.id, allocation.user.id, expense.currency, expense.date, allocation.amount)
+            ExpenseShare.objects.bulk_create(shares, batch_size=self.chunk_size)
+            changes.apply()
+            spending.apply()
+            index_expenses(expenses)
+            bump_groups(self.group.id)
+            broadcast(self.group.id, 'expense', 'imported', count=len(expenses))
+        return len(expenses)
+
+    def run(self, rows, progress=None):
+        """
+        Import ``(line, row)`` pairs and return an ``ImportResult``.
+
+        ``progress`` is called with the running result after every chunk.
+        """
+        result = ImportResult()
+        started = time.perf_counter()
+        built = []
+        for line, row in rows:
+            result.rows += 1
+            try:
+                built.append(self.build(row))
+            except ImportRowError as e:
+                result.add_error(line, str(e))
+            if len(built) >= self.chunk_size:
+                result.created += self.write(built)
+                built = []
+                result.seconds = time.perf_counter() - started
+                if progress:
+                    progress(result)
+        if built:
+            result.created += self.write(built)
+        result.seconds = time.perf_counter() - started
+        if progress:
+            progress(result)
+        return result
@@ -0,0 +1,193 @@
+"""
+Per-request query and timing instrumentation.
+
+``QueryInstrumentationMiddleware`` records, for every request, how many SQL
+queries ran, the time spent in the database and in template rendering, and
+the total wall time. The numbers go out as a ``Server-Timing`` header and as a
+structured record on the ``tracker.performance`` logger.
+
+The middleware works for sync and async views alike. Queries are attributed
+through a context variable rather than a wrapper on the current thread's
+connection, so the queries an async view runs via ``sync_to_async`` on another
+thread are still counted against its request.
+
+Views declare the most queries they should ever need with ``@query_budget(n)``.
+Going over budget logs a warning, or raises ``QueryBudgetExceeded`` when
+``settings.QUERY_BUDGET_STRICT`` is on (as it is for the test suite).
+"""
+import functools
+import logging
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.template import base as template_base
+
+logger = logging.getLogger('tracker.performance')
+
+_active_recorder = ContextVar('tracker_active_recorder', default=None)
+
+
+class QueryBudgetExceeded(AssertionError):
+    """A view issued more queries than its declared budget."""
+
+
+def _record_query(execute, sql, params, many, context):
+    recorder = _active_recorder.get()
+    if recorder is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        # Nested recorders (a benchmark around a request) all see the query
+        while recorder is not None:
+            recorder.queries += 1
+            recorder.db_time += elapsed
+            recorder = recorder._parent
+
+
+def instrument(connection):
+    if not getattr(connection, '_tracker_instrumented', False):
+        connection.execute_wrappers.append(_record_query)
+        connection._tracker_instrumented = True
+
+
+@receiver(connection_created)
+def instrument_new_connection(sender, connection, **kwargs):
+    # Connections are per thread, and async views query from executor threads
+    instrument(connection)
+
+
+class RequestRecorder:
+    """
+    Context manager that records queries on every configured database and
+    template render time while it is active, in this context and in the
+    ``sync_to_async`` calls made from it.
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.total_time = 0.0
+        self._template_depth = 0
+        self._parent = None
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        self._parent = _active_recorder.get()
+        self._token = _active_recorder.set(self)
+        for alias in connections:
+            instrument(connections[alias])
+        return self
+
+    def __exit__(self, *exc_info):
+        _active_recorder.reset(self._token)
+        self.total_time = time.perf_counter() - self._started
+
+    def as_dict(self):
+        return {
+            'queries': self.queries,
+            'db_ms': round(self.db_time * 1000, 2),
+            'template_ms': round(self.template_time * 1000, 2),
+            'total_ms': round(self.total_time * 1000, 2),
+        }
+
+    def server_timing(self):
+        return ', '.join([
+            f'db;dur={self.db_time * 1000:.2f};desc="{self.queries} queries"',
+            f'tpl;dur={self.template_time * 1000:.2f}',
+            f'total;dur={self.total_time * 1000:.2f}',
+        ])
+
+
+def _timed_render(render):
+    @functools.wraps(render)
+    def wrapper(self, context):
+        recorder = _active_recorder.get()
+        if recorder is None:
+            return render(self, context)
+        # Only the outermost template is timed so includes are not counted twice
+        recorder._template_depth += 1
+        started = time.perf_counter()
+        try:
+            return render(self, context)
+        finally:
+            recorder._template_depth -= 1
+            if recorder._template_depth == 0:
+                recorder.template_time += time.perf_counter() - started
+    wrapper._tracker_timed = True
+    return wrapper
+
+
+def install_template_timer():
+    if not getattr(template_base.Template.render, '_tracker_timed', False):
+        template_base.Template.render = _timed_render(template_base.Template.render)
+
+
+def query_budget(max_queries):
+    """Declare the most queries a view may issue for a single request."""
+    def decorator(view):
+        view.query_budget = max_queries
+        return view
+    return decorator
+
+
+def check_budget(view_name, budget, recorder):
+    if budget is None or recorder.queries <= budget:
+        return
+    message = f'{view_name} issued {recorder.queries} queries, over its budget of {budget}'
+    if getattr(settings, 'QUERY_BUDGET_STRICT', False):
+        raise QueryBudgetExceeded(message)
+    logger.warning(message)
+
+
+class QueryInstrumentationMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            # Keeps the handler chain async under ASGI instead of moving it to a thread
+            markcoroutinefunction(self)
+        install_template_timer()
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        with RequestRecorder() as recorder:
+            response = self.get_response(request)
+        return self.report(request, response, recorder)
+
+    async def __acall__(self, request):
+        with RequestRecorder() as recorder:
+            response = await self.get_response(request)
+        return self.report(request, response, recorder)
+
+    def report(self, request, response, recorder):
+        match = getattr(request, 'resolver_match', None)
+        view_name = match.view_name if match else None
+        record = {
+            'view': view_name,
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            **recorder.as_dict(),
+        }
+        response['Server-Timing'] = recorder.server_timing()
+        logger.info(
+            'view=%s status=%s queries=%d db_ms=%.2f template_ms=%.2f total_ms=%.2f',
+            view_name, response.status_code, recorder.queries, record['db_ms'],
+            record['template_ms'], record['total_ms'], extra={'timing': record},
+        )
+        if match:
+            check_budget(view_name, getattr(match.func, 'query_budget', None), recorder)
+        return response
@@ -0,0 +1,169 @@
+"""
+Synthetic data for load testing.
+
+``seed`` fills the database with users, groups, memberships, expenses with
+shares, settlements, comments and notifications using bulk inserts. Activity
+is skewed the way real data is: a few large groups and a few very active users
+account for most of the rows (Zipf-like weights), rather than everything being
+uniform.
+"""
+import heapq
+import itertools
+import random
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+
+from .balances import rebuild_balances
+from .models import Comment, Expense, ExpenseShare, Group, GroupMember, Notification, Settlement
+from .rollups import rebuild_rollups
+from .search import rebuild_index
+from .splits import allocate_shares
+
+BATCH_SIZE = 2000
+
+SCALES = {
+    'small': {'users': 50, 'groups': 10, 'expenses': 1000, 'settlements': 100, 'comments': 500, 'notifications': 2000},
+    'medium': {'users': 500, 'groups': 100, 'expenses': 20000, 'settlements': 2000, 'comments': 10000, 'notifications': 40000},
+    'large': {'users': 5000, 'groups': 500, 'expenses': 200000, 'settlements': 20000, 'comments': 100000, 'notifications': 400000},
+}
+
+EXPENSE_TITLES = ['Groceries', 'Dinner', 'Rent', 'Taxi', 'Utilities', 'Movie tickets', 'Coffee', 'Hotel', 'Fuel', 'Drinks']
+COMMENT_TEXTS = ['Thanks!', 'Paid you back', 'Was this the Friday one?', 'Receipt attached', 'Splitting evenly']
+
+
+def zipf_weights(count, exponent=1.1):
+    """Weights for ``count`` items where item ``k`` is ``k**exponent`` times less likely than the first."""
+    return [1 / (rank ** exponent) for rank in range(1, count + 1)]
+
+
+def seed(users=50, groups=10, expenses=1000, settlements=100, comments=500, notifications=2000,
+         max_group_size=80, history_days=3 * 365, rng=None, prefix='load', log=None):
+    """
+    Generate a data set and return a dict of row counts per model.
+
+    ``prefix`` is used for usernames so several runs can share a database.
+    """
+    rng = rng or random.Random(0)
+    log = log or (lambda message: None)
+    now = timezone.now()
+    counts = {}
+
+    def when():
+        # Recent activity is denser than old activity
+        return now - timedelta(days=history_days * rng.random() ** 2, seconds=rng.randint(0, 86400))
+
+    with transaction.atomic():
+        password = make_password('password')
+        start = User.objects.count()
+        created_users = User.objects.bulk_create([
+            User(username=f'{prefix}{start + i}', email=f'{prefix}{start + i}@example.com', password=password)
+            for i in range(users)
+        ], batch_size=BATCH_SIZE)
+        user_weights = zipf_weights(len(created_users))
+        user_cum = list(itertools.accumulate(user_weights))
+        counts['users'] = len(created_users)
+        log(f'{users} users')
+
+        created_groups = Group.objects.bulk_create([
+            Group(name=f'{prefix.title()} group {i}', description='Generated for load testing')
+            for i in range(groups)
+        ], batch_size=BATCH_SIZE)
+        group_cum = list(itertools.accumulate(zipf_weights(len(created_groups), exponent=0.8)))
+        counts['groups'] = len(created_groups)
+
+        # Bigger groups first: size falls off with the group's rank
+        rosters = {}
+        memberships = []
+        for rank, group in enumerate(created_groups, start=1):
+            size = max(2, min(len(created_users), int(max_group_size / rank ** 0.5)))
+            # Weighted sampling without replacement (Efraimidis-Spirakis keys)
+            members = heapq.nlargest(
+                size, zip(created_users, user_weights), key=lambda pair: rng.random() ** (1 / pair[1])
+            )
+            rosters[group.id] = sorted((user for user, _ in members), key=lambda user: user.id)
+            memberships.extend(
+                GroupMember(user=user, group=group, role='admin' if index == 0 else 'member')
+                for index, user in enumerate(rosters[group.id])
+            )
+        GroupMember.objects.bulk_create(memberships, batch_size=BATCH_SIZE)
+        counts['memberships'] = len(memberships)
+        log(f'{len(memberships)} memberships')
+
+        counts['expenses'] = counts['shares'] = 0
+        expense_ids = []
+        remaining = expenses
+        while remaining > 0:
+            batch = min(BATCH_SIZE, remaining)
+            remaining -= batch
+            picked = rng.choices(created_groups, cum_weights=group_cum, k=batch)
+            plans = []
+            for group in picked:
+                roster = rosters[group.id]
+                # Most expenses are split between a handful of people
+                participants = rng.sample(roster, k=min(len(roster), 2 + int(rng.expovariate(0.25))))
+                amount = Decimal(rng.randint(100, 50000)) / 100
+                plans.append((
+                    Expense(title=rng.choice(EXPENSE_TITLES), amount=amount, group=group,
+                            paid_by=rng.choice(participants), date=when()),
+                    participants,
+                ))
+            created = Expense.objects.bulk_create([expense for expense, _ in plans])
+            shares = [
+                ExpenseShare(expense=expense, user=allocation.user, amount=allocation.amount)
+                for expense, (_, participants) in zip(created, plans)
+                for allocation in allocate_shares(expense.amount, 'equal', participants)
+            ]
+            ExpenseShare.objects.bulk_create(shares, batch_size=BATCH_SIZE)
+            expense_ids.extend(expense.id for expense in created)
+            counts['expenses'] += len(created)
+            counts['shares'] += len(shares)
+            log(f'{counts["expenses"]} expenses, {counts["shares"]} shares')
+
+        settlement_rows = []
+        for group in rng.choices(created_groups, cum_weights=group_cum, k=settlements):
+            payer, receiver = rng.sample(rosters[group.id], k=2)
+            settlement_rows.append(Settlement(
+                payer=payer, receiver=receiver, group=group, amount=Decimal(rng.randint(100, 20000)) / 100,
+                status=rng.choices(['completed', 'pending', 'cancelled'], weights=[6, 3, 1])[0],
+            ))
+        created_settlements = Settlement.objects.bulk_create(settlement_rows, batch_size=BATCH_SIZE)
+        counts['settlements'] = len(created_settlements)
+
+        commenters = rng.choices(created_users, cum_weights=user_cum, k=comments if expense_ids else 0)
+        comment_rows = [
+            Comment(expense_id=rng.choice(expense_ids), user=user, text=rng.choice(COMMENT_TEXTS))
+            for user in commenters
+        ]
+        Comment.objects.bulk_create(comment_rows, batch_size=BATCH_SIZE)
+        counts['comments'] = len(comment_rows)
+
+        notification_rows = []
+        for user in rng.choices(created_users, cum_weights=user_cum, k=notifications):
+            if expense_ids and rng.random() < 0.7:
+                notification_rows.append(Notification(
+                    user=user, type='expense_added', content='A new expense was added',
+                    related_expense_id=rng.choice(expense_ids), is_read=rng.random() < 0.8,
+                ))
+            elif created_settlements:
+                settlement = rng.choice(created_settlements)
+                notification_rows.append(Notification(
+                    user=user, type='settlement_request', content='You have a settlement request',
+                    related_settlement=settlement, related_group_id=settlement.group_id,
+                    is_read=rng.random() < 0.8,
+                ))
+        Notification.objects.bulk_create(notification_rows, batch_size=BATCH_SIZE)
+        counts['notifications'] = len(notification_rows)
+        log(f'{len(comment_rows)} comments, {len(notification_rows)} notifications')
+
+        # Bulk inserts skip the ledger, rollup and search signals, so rebuild them
+        group_ids = [group.id for group in created_groups]
+        counts['balances'] = rebuild_balances(group_ids)
+        counts['rollups'] = rebuild_rollups(group_ids)
+        counts['search'] = rebuild_index()
+
+    return counts
@@ -0,0 +1,46 @@
+import json
+import random
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+
+from tracker.settle_up import EXACT_SOLVER_LIMIT, simplify_debts
+
+
+def random_balances(members, rng):
+    """Random cent balances for ``members`` people that sum to zero."""
+    cents = [rng.randint(-50000, 50000) for _ in range(members - 1)]
+    cents.append(-sum(cents))
+    return {user_id: Decimal(amount) / 100 for user_id, amount in enumerate(cents, start=1)}
+
+
+class Command(BaseCommand):
+    help = 'Time the settle-up engine on random groups of increasing size and print JSON results.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', type=int, nargs='+',
+            default=[EXACT_SOLVER_LIMIT, 30, 80, 500, 1000, 5000],
+            help='Group sizes to benchmark.',
+        )
+        parser.add_argument('--repeat', type=int, default=5, help='Runs per size; the best time is reported.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        results = []
+        for size in options['sizes']:
+            balances = random_balances(size, rng)
+            timings = []
+            for _ in range(options['repeat']):
+                started = time.perf_counter()
+                transfers = simplify_debts(balances)
+                timings.append(time.perf_counter() - started)
+            results.append({
+                'members': size,
+                'solver': 'exact' if size <= EXACT_SOLVER_LIMIT else 'greedy',
+                'transfers': len(transfers),
+                'best_ms': round(min(timings) * 1000, 3),
+            })
+        self.stdout.write(json.dumps(results, indent=2))
@@ -0,0 +1,32 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from tracker.benchmarks import run
+from tracker.loadgen import SCALES
+
+
+class Command(BaseCommand):
+    help = 'Seed a throwaway test database at several scales, time the main views and print JSON results.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--scales', nargs='+', choices=sorted(SCALES), default=['small', 'medium'],
+            help='Data scales to benchmark, in order.',
+        )
+        parser.add_argument('--repeat', type=int, default=5, help='Requests per view; min and median are reported.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('-o', '--output', help='Also write the JSON report to this file.')
+
+    def handle(self, *args, **options):
+        report = run(
+            scales=options['scales'],
+            repeat=options['repeat'],
+            seed_value=options['seed'],
+            log=lambda message: self.stderr.write(message) if options['verbosity'] > 1 else None,
+        )
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as handle:
+                handle.write(output + '\n')
+        self.stdout.write(output)
@@ -0,0 +1,32 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from tracker.benchmarks import run_writes
+from tracker.db import SQLITE_PROFILES
+
+
+class Command(BaseCommand):
+    help = 'Create expenses from parallel clients in a throwaway database and print write throughput per profile as JSON.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--profiles', nargs='+', choices=sorted(SQLITE_PROFILES),
+            help='SQLite profiles to compare (default: all). Ignored on other databases.',
+        )
+        parser.add_argument('--workers', type=int, default=8, help='Parallel clients.')
+        parser.add_argument('--writes', type=int, default=25, help='Expenses created by each client.')
+        parser.add_argument('-o', '--output', help='Also write the JSON report to this file.')
+
+    def handle(self, *args, **options):
+        report = run_writes(
+            profiles=options['profiles'],
+            workers=options['workers'],
+            writes=options['writes'],
+            log=lambda message: self.stderr.write(message) if options['verbosity'] > 1 else None,
+        )
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as handle:
+                handle.write(output + '\n')
+        self.stdout.write(output)
@@ -0,0 +1,17 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from tracker.caching import cache_stats, reset_cache_stats
+
+
+class Command(BaseCommand):
+    help = 'Print hit and miss counts of the group and user summary caches as JSON.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Zero the counters after printing them.')
+
+    def handle(self, *args, **options):
+        self.stdout.write(json.dumps(cache_stats()))
+        if options['reset']:
+            reset_cache_stats()
@@ -0,0 +1,33 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from tracker.exporters import DEFAULT_CHUNK_SIZE, FORMATS, export_group
+from tracker.models import Group
+
+
+class Command(BaseCommand):
+    help = "Stream a group's expenses, shares and settlements as CSV or newline-delimited JSON."
+
+    def add_arguments(self, parser):
+        parser.add_argument('group_id', type=int)
+        parser.add_argument('--format', choices=sorted(FORMATS), default='csv')
+        parser.add_argument('--gzip', action='store_true', help='Compress the output with gzip.')
+        parser.add_argument('--output', '-o', help='File to write; defaults to stdout.')
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        try:
+            group = Group.objects.get(id=options['group_id'])
+        except Group.DoesNotExist:
+            raise CommandError(f'Group {options["group_id"]} does not exist.')
+
+        chunks = export_group(group, options['format'], gzip=options['gzip'], chunk_size=options['chunk_size'])
+        if options['output']:
+            with open(options['output'], 'wb') as output:
+                for chunk in chunks:
+                    output.write(chunk)
+        else:
+            for chunk in chunks:
+                sys.stdout.buffer.write(chunk)
+            sys.stdout.buffer.flush()
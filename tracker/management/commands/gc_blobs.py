@@ -0,0 +1,28 @@
+import json
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from tracker.storage import GC_GRACE, collect_garbage, recount_references
+
+
+class Command(BaseCommand):
+    help = 'Delete content-addressed blobs that no receipt or cover photo references any more.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--recount', action='store_true',
+            help='Recompute reference counts from the file fields first (fixes drift from admin edits).',
+        )
+        parser.add_argument(
+            '--grace-minutes', type=int, default=int(GC_GRACE.total_seconds() // 60),
+            help='Only delete blobs that have been unreferenced for at least this long.',
+        )
+
+    def handle(self, *args, **options):
+        result = {}
+        if options['recount']:
+            result['recounted'] = recount_references()
+        blobs, freed = collect_garbage(grace=timedelta(minutes=options['grace_minutes']))
+        result.update({'deleted': blobs, 'bytes_freed': freed})
+        self.stdout.write(json.dumps(result))
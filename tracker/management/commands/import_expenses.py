@@ -0,0 +1,46 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from tracker.importers import DEFAULT_CHUNK_SIZE, ExpenseImporter, read_csv, read_ofx
+from tracker.models import Group
+
+
+class Command(BaseCommand):
+    help = 'Stream expenses from a CSV or OFX file into a group.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('group_id', type=int)
+        parser.add_argument('path')
+        parser.add_argument('--user', required=True, help='Username of the member the import runs as.')
+        parser.add_argument('--format', choices=['csv', 'ofx'], help='Defaults to the file extension.')
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+        parser.add_argument('--show-errors', type=int, default=20, help='How many row errors to print.')
+
+    def handle(self, *args, **options):
+        try:
+            group = Group.objects.get(id=options['group_id'])
+            user = group.members.get(username=options['user'])
+        except Group.DoesNotExist:
+            raise CommandError(f'Group {options["group_id"]} does not exist.')
+        except User.DoesNotExist:
+            raise CommandError(f'{options["user"]} is not a member of {group}.')
+
+        fmt = options['format'] or ('ofx' if options['path'].lower().endswith(('.ofx', '.qfx')) else 'csv')
+        importer = ExpenseImporter(group, user, chunk_size=options['chunk_size'])
+
+        def progress(result):
+            self.stdout.write(
+                f'{result.rows} rows, {result.created} created, {result.error_count} errors '
+                f'({result.rows_per_second} rows/s)'
+            )
+
+        with open(options['path'], encoding='utf-8-sig', errors='replace', newline='') as stream:
+            rows = read_ofx(stream) if fmt == 'ofx' else read_csv(stream)
+            result = importer.run(rows, progress=progress)
+
+        for error in result.errors[:options['show_errors']]:
+            self.stderr.write(f'line {error["line"]}: {error["error"]}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {result.created} of {result.rows} rows in {result.seconds:.1f}s '
+            f'({result.rows_per_second} rows/s).'
+        ))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from tracker.currency import RateFileError, import_rates, read_rates
+
+
+class Command(BaseCommand):
+    help = 'Load exchange rates from a date,currency,rate CSV file (rates are in the base currency).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['path'], encoding='utf-8-sig', newline='') as stream:
+                rows = read_rates(stream)
+        except (OSError, RateFileError) as e:
+            raise CommandError(str(e))
+
+        count = import_rates(rows)
+        self.stdout.write(self.style.SUCCESS(f'Imported {count} exchange rate(s).'))
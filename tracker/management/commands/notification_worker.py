@@ -0,0 +1,43 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from tracker.notifications import COALESCE_WINDOW, EVENT_BATCH_SIZE, process_events
+from tracker.retention import apply_retention
+
+
+class Command(BaseCommand):
+    help = 'Fan queued notification events out to their recipients, coalescing bursts of expenses.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Process everything that is due, then exit.')
+        parser.add_argument('--interval', type=float, default=2.0, help='Seconds to sleep when the queue is idle.')
+        parser.add_argument(
+            '--window', type=int, default=COALESCE_WINDOW,
+            help='Seconds to hold expense events so bursts collapse into one notification.',
+        )
+        parser.add_argument('--batch-size', type=int, default=EVENT_BATCH_SIZE)
+        parser.add_argument(
+            '--retention-every', type=float, default=3600,
+            help='Seconds between notification retention runs (0 to leave it to prune_notifications).',
+        )
+
+    def handle(self, *args, **options):
+        next_retention = time.monotonic()
+        try:
+            while True:
+                if options['retention_every'] and time.monotonic() >= next_retention:
+                    summary = apply_retention()
+                    if options['verbosity'] > 1:
+                        self.stdout.write(f'retention: {summary}')
+                    next_retention = time.monotonic() + options['retention_every']
+                events, notifications = process_events(window=options['window'], limit=options['batch_size'])
+                if events and options['verbosity'] > 1:
+                    self.stdout.write(f'{events} events -> {notifications} notifications')
+                if events == options['batch_size']:
+                    continue
+                if options['once']:
+                    return
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from tracker.receipts import BATCH_SIZE, process_pending
+
+
+class Command(BaseCommand):
+    help = 'Compress uploaded receipts, strip their metadata and generate thumbnails.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Process every waiting receipt, then exit.')
+        parser.add_argument('--interval', type=float, default=5.0, help='Seconds to sleep when nothing is waiting.')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        try:
+            while True:
+                processed, failed = process_pending(options['batch_size'])
+                if (processed or failed) and options['verbosity'] > 1:
+                    self.stdout.write(f'{processed} receipts processed, {failed} unreadable')
+                if processed + failed == options['batch_size']:
+                    continue
+                if options['once']:
+                    return
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,24 @@
+import json
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from tracker.retention import BATCH_SIZE, digest_days, digest_unread, purge_read, retention_days
+
+
+class Command(BaseCommand):
+    help = 'Collapse old unread notifications into digests and delete expired read ones, in small batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--retention-days', type=int, help='Delete read notifications older than this.')
+        parser.add_argument('--digest-days', type=int, help='Digest unread notifications older than this.')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        digest_age = options['digest_days'] if options['digest_days'] is not None else digest_days()
+        retention_age = options['retention_days'] if options['retention_days'] is not None else retention_days()
+        digests, collapsed = digest_unread(now - timedelta(days=digest_age), options['batch_size'])
+        deleted = purge_read(now - timedelta(days=retention_age), options['batch_size'])
+        self.stdout.write(json.dumps({'digests': digests, 'collapsed': collapsed, 'deleted': deleted}))
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from tracker.balances import check_balances, rebuild_balances
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the per-member group balance ledger from expenses, shares and settlements.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--group', type=int, action='append', dest='groups',
+            help='Only rebuild this group id (may be given more than once).',
+        )
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Verify the ledger against the source tables without changing it.',
+        )
+
+    def handle(self, *args, **options):
+        group_ids = options['groups']
+
+        if options['check']:
+            mismatches = check_balances(group_ids)
+            for group_id, user_id, currency, expected, actual in mismatches:
+                self.stdout.write(
+                    f'group={group_id} user={user_id} currency={currency} '
+                    f'expected(paid, owed, settled)={[str(v) for v in expected]} '
+                    f'actual={[str(v) for v in actual]}'
+                )
+            if mismatches:
+                raise CommandError(f'{len(mismatches)} balance row(s) out of sync.')
+            self.stdout.write(self.style.SUCCESS('Balance ledger is consistent.'))
+            return
+
+        count = rebuild_balances(group_ids)
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {count} balance row(s).'))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from tracker.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the daily spending and transaction rollups from the source tables.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--group', type=int, action='append', dest='groups',
+            help='Only rebuild this group id (may be given more than once).',
+        )
+
+    def handle(self, *args, **options):
+        count = rebuild_rollups(options['groups'])
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {count} rollup row(s).'))
@@ -0,0 +1,36 @@
+import json
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from tracker.loadgen import SCALES, seed
+
+
+class Command(BaseCommand):
+    help = 'Bulk-generate skewed synthetic users, groups, expenses and notifications for load testing.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', choices=sorted(SCALES), default='small', help='Preset row counts.')
+        for name in ('users', 'groups', 'expenses', 'settlements', 'comments', 'notifications'):
+            parser.add_argument(f'--{name}', type=int, help=f'Override the number of {name}.')
+        parser.add_argument('--max-group-size', type=int, default=80)
+        parser.add_argument('--seed', type=int, default=0, help='Random seed, for reproducible data sets.')
+        parser.add_argument('--prefix', default='load', help='Username prefix for generated users.')
+
+    def handle(self, *args, **options):
+        sizes = dict(SCALES[options['scale']])
+        for name in sizes:
+            if options[name] is not None:
+                sizes[name] = options[name]
+
+        started = time.perf_counter()
+        counts = seed(
+            max_group_size=options['max_group_size'],
+            rng=random.Random(options['seed']),
+            prefix=options['prefix'],
+            log=lambda message: self.stderr.write(message) if options['verbosity'] > 1 else None,
+            **sizes,
+        )
+        counts['seconds'] = round(time.perf_counter() - started, 2)
+        self.stdout.write(json.dumps(counts, indent=2))
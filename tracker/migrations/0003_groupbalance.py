@@ -0,0 +1,61 @@
+# Generated by Django 5.0.2 on 2026-10-18 12:02
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def populate_balances(apps, schema_editor):
+    Expense = apps.get_model('tracker', 'Expense')
+    ExpenseShare = apps.get_model('tracker', 'ExpenseShare')
+    Settlement = apps.get_model('tracker', 'Settlement')
+    GroupBalance = apps.get_model('tracker', 'GroupBalance')
+
+    totals = {}
+
+    def add(group_id, user_id, field, amount):
+        row = totals.setdefault((group_id, user_id), {'paid': Decimal('0.00'), 'owed': Decimal('0.00'), 'settled': Decimal('0.00')})
+        row[field] += amount
+
+    for row in Expense.objects.filter(group__isnull=False).values('group_id', 'paid_by_id').annotate(total=Sum('amount')).order_by():
+        add(row['group_id'], row['paid_by_id'], 'paid', row['total'])
+    for row in ExpenseShare.objects.filter(expense__group__isnull=False).values('expense__group_id', 'user_id').annotate(total=Sum('amount')).order_by():
+        add(row['expense__group_id'], row['user_id'], 'owed', row['total'])
+    completed = Settlement.objects.filter(group__isnull=False, status='completed')
+    for row in completed.values('group_id', 'payer_id').annotate(total=Sum('amount')).order_by():
+        add(row['group_id'], row['payer_id'], 'settled', row['total'])
+    for row in completed.values('group_id', 'receiver_id').annotate(total=Sum('amount')).order_by():
+        add(row['group_id'], row['receiver_id'], 'settled', -row['total'])
+
+    GroupBalance.objects.bulk_create([
+        GroupBalance(group_id=group_id, user_id=user_id, **fields)
+        for (group_id, user_id), fields in totals.items()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0002_group_expense_comment_groupmember_group_members_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GroupBalance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('paid', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('owed', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('settled', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('group', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='balances', to='tracker.group')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='group_balances', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('group', 'user')},
+            },
+        ),
+        migrations.RunPython(populate_balances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.0.2 on 2026-10-18 12:06
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0003_groupbalance'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='expense',
+            name='date',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.0.2 on 2026-10-18 12:21
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0006_notification_event'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='notification',
+            name='type',
+            field=models.CharField(choices=[('expense_added', 'New Expense'), ('expense_updated', 'Expense Updated'), ('settlement_request', 'Settlement Request'), ('settlement_completed', 'Settlement Completed'), ('group_invite', 'Group Invitation'), ('digest', 'Digest')], max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='notificationevent',
+            name='type',
+            field=models.CharField(choices=[('expense_added', 'New Expense'), ('expense_updated', 'Expense Updated'), ('settlement_request', 'Settlement Request'), ('settlement_completed', 'Settlement Completed'), ('group_invite', 'Group Invitation'), ('digest', 'Digest')], max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(condition=models.Q(('is_read', True)), fields=['created_at'], name='notif_read_created_idx'),
+        ),
+    ]
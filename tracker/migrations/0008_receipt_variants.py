@@ -0,0 +1,29 @@
+# Generated by Django 5.0.2 on 2026-10-18 12:24
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0007_notification_retention'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='expense',
+            name='receipt_processed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='expense',
+            name='receipt_thumbnail',
+            field=models.ImageField(blank=True, null=True, upload_to='receipts/thumbs/'),
+        ),
+        migrations.AddIndex(
+            model_name='expense',
+            index=models.Index(condition=models.Q(('receipt_processed_at__isnull', True), models.Q(('receipt', ''), _negated=True), ('receipt__isnull', False)), fields=['id'], name='expense_receipt_pending_idx'),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.0.2 on 2026-10-18 12:26
+
+import tracker.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0008_receipt_variants'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='expense',
+            name='receipt',
+            field=models.ImageField(blank=True, null=True, storage=tracker.storage.get_blob_storage, upload_to='receipts/'),
+        ),
+        migrations.AlterField(
+            model_name='expense',
+            name='receipt_thumbnail',
+            field=models.ImageField(blank=True, null=True, storage=tracker.storage.get_blob_storage, upload_to='receipts/thumbs/'),
+        ),
+        migrations.AlterField(
+            model_name='group',
+            name='cover_photo',
+            field=models.ImageField(blank=True, null=True, storage=tracker.storage.get_blob_storage, upload_to='group_covers/'),
+        ),
+        migrations.CreateModel(
+            name='StoredBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(db_index=True, max_length=64)),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('size', models.BigIntegerField()),
+                ('refcount', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'indexes': [models.Index(condition=models.Q(('refcount', 0)), fields=['updated_at'], name='blob_unreferenced_idx')],
+            },
+        ),
+    ]
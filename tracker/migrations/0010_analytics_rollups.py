@@ -0,0 +1,90 @@
+# Generated by Django 5.0.2 on 2026-10-18 12:36
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+
+
+def populate_rollups(apps, schema_editor):
+    Expense = apps.get_model('tracker', 'Expense')
+    ExpenseShare = apps.get_model('tracker', 'ExpenseShare')
+    Transaction = apps.get_model('tracker', 'Transaction')
+    SpendingRollup = apps.get_model('tracker', 'SpendingRollup')
+    TransactionRollup = apps.get_model('tracker', 'TransactionRollup')
+
+    spending = {}
+
+    def add(key, field, amount):
+        row = spending.setdefault(key, {'paid': Decimal('0.00'), 'expense_count': 0, 'share': Decimal('0.00')})
+        row[field] += amount
+
+    paid = Expense.objects.filter(group__isnull=False).values(
+        'group_id', 'paid_by_id', 'currency', day=TruncDate('date')
+    ).annotate(total=Sum('amount'), count=Count('id')).order_by()
+    for row in paid:
+        key = (row['group_id'], row['paid_by_id'], row['currency'], row['day'])
+        add(key, 'paid', row['total'])
+        add(key, 'expense_count', row['count'])
+    shares = ExpenseShare.objects.filter(expense__group__isnull=False).values(
+        'expense__group_id', 'user_id', 'expense__currency', day=TruncDate('expense__date')
+    ).annotate(total=Sum('amount')).order_by()
+    for row in shares:
+        add((row['expense__group_id'], row['user_id'], row['expense__currency'], row['day']), 'share', row['total'])
+
+    SpendingRollup.objects.bulk_create([
+        SpendingRollup(group_id=group_id, user_id=user_id, currency=currency, day=day, **fields)
+        for (group_id, user_id, currency, day), fields in spending.items()
+    ], batch_size=1000)
+    TransactionRollup.objects.bulk_create([
+        TransactionRollup(day=row['date'], type=row['type'], category=row['category'],
+                          total=row['total'], count=row['count'])
+        for row in Transaction.objects.values('date', 'type', 'category').annotate(
+            total=Sum('amount'), count=Count('id')
+        ).order_by()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0009_content_addressed_storage'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TransactionRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('type', models.CharField(choices=[('income', 'Income'), ('expense', 'Expense')], max_length=7)),
+                ('category', models.CharField(max_length=50)),
+                ('total', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('count', models.IntegerField(default=0)),
+            ],
+            options={
+                'unique_together': {('day', 'type', 'category')},
+            },
+        ),
+        migrations.CreateModel(
+            name='SpendingRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('currency', models.CharField(max_length=3)),
+                ('day', models.DateField()),
+                ('paid', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('expense_count', models.IntegerField(default=0)),
+                ('share', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('group', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='spending_rollups', to='tracker.group')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='spending_rollups', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['group', 'day'], name='spending_rollup_day_idx')],
+                'unique_together': {('group', 'user', 'currency', 'day')},
+            },
+        ),
+        migrations.RunPython(populate_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,74 @@
+# Generated by Django 5.0.2 on 2026-10-18 12:41
+
+from decimal import Decimal
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def split_balances_by_currency(apps, schema_editor):
+    # Existing rows summed every currency together; recompute them per currency
+    Expense = apps.get_model('tracker', 'Expense')
+    ExpenseShare = apps.get_model('tracker', 'ExpenseShare')
+    Settlement = apps.get_model('tracker', 'Settlement')
+    GroupBalance = apps.get_model('tracker', 'GroupBalance')
+    base = getattr(settings, 'BASE_CURRENCY', 'USD')
+
+    totals = {}
+
+    def add(key, field, amount):
+        row = totals.setdefault(key, {'paid': Decimal('0.00'), 'owed': Decimal('0.00'), 'settled': Decimal('0.00')})
+        row[field] += amount
+
+    for row in Expense.objects.filter(group__isnull=False).values('group_id', 'paid_by_id', 'currency').annotate(total=Sum('amount')).order_by():
+        add((row['group_id'], row['paid_by_id'], row['currency']), 'paid', row['total'])
+    for row in ExpenseShare.objects.filter(expense__group__isnull=False).values('expense__group_id', 'user_id', 'expense__currency').annotate(total=Sum('amount')).order_by():
+        add((row['expense__group_id'], row['user_id'], row['expense__currency']), 'owed', row['total'])
+    completed = Settlement.objects.filter(group__isnull=False, status='completed')
+    for row in completed.values('group_id', 'payer_id').annotate(total=Sum('amount')).order_by():
+        add((row['group_id'], row['payer_id'], base), 'settled', row['total'])
+    for row in completed.values('group_id', 'receiver_id').annotate(total=Sum('amount')).order_by():
+        add((row['group_id'], row['receiver_id'], base), 'settled', -row['total'])
+
+    GroupBalance.objects.all().delete()
+    GroupBalance.objects.bulk_create([
+        GroupBalance(group_id=group_id, user_id=user_id, currency=currency, **fields)
+        for (group_id, user_id, currency), fields in totals.items()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0010_analytics_rollups'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='groupbalance',
+            unique_together=set(),
+        ),
+        migrations.AddField(
+            model_name='groupbalance',
+            name='currency',
+            field=models.CharField(default='USD', max_length=3),
+        ),
+        migrations.AlterUniqueTogether(
+            name='groupbalance',
+            unique_together={('group', 'user', 'currency')},
+        ),
+        migrations.CreateModel(
+            name='ExchangeRate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('currency', models.CharField(max_length=3)),
+                ('date', models.DateField()),
+                ('rate', models.DecimalField(decimal_places=8, max_digits=18)),
+            ],
+            options={
+                'unique_together': {('currency', 'date')},
+            },
+        ),
+        migrations.RunPython(split_balances_by_currency, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,77 @@
+# Generated by Django 5.0.2 on 2026-10-18 13:05
+
+from django.db import migrations
+
+
+SQLITE_TABLE = """
+CREATE VIRTUAL TABLE tracker_search USING fts5(
+    kind UNINDEXED, object_id UNINDEXED, group_id UNINDEXED, parent_id UNINDEXED, title, body,
+    tokenize = 'porter unicode61'
+)
+"""
+
+POSTGRES_TABLE = [
+    """
+    CREATE TABLE tracker_search (
+        rowid bigint PRIMARY KEY,
+        kind varchar(10) NOT NULL,
+        object_id bigint NOT NULL,
+        group_id bigint,
+        parent_id bigint,
+        title text NOT NULL DEFAULT '',
+        body text NOT NULL DEFAULT '',
+        document tsvector GENERATED ALWAYS AS (
+            setweight(to_tsvector('english', title), 'A') || setweight(to_tsvector('english', body), 'B')
+        ) STORED
+    )
+    """,
+    'CREATE INDEX tracker_search_document ON tracker_search USING GIN (document)',
+    'CREATE INDEX tracker_search_group_id ON tracker_search (group_id)',
+]
+
+POPULATE = [
+    """
+    INSERT INTO tracker_search (rowid, kind, object_id, group_id, parent_id, title, body)
+    SELECT id * 4 + 1, 'expense', id, group_id, NULL, title, description
+    FROM tracker_expense WHERE group_id IS NOT NULL
+    """,
+    """
+    INSERT INTO tracker_search (rowid, kind, object_id, group_id, parent_id, title, body)
+    SELECT c.id * 4 + 2, 'comment', c.id, e.group_id, c.expense_id, '', c.text
+    FROM tracker_comment c INNER JOIN tracker_expense e ON e.id = c.expense_id
+    WHERE e.group_id IS NOT NULL
+    """,
+    """
+    INSERT INTO tracker_search (rowid, kind, object_id, group_id, parent_id, title, body)
+    SELECT id * 4 + 3, 'group', id, id, NULL, name, description
+    FROM tracker_group
+    """,
+]
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        statements = [SQLITE_TABLE]
+    elif vendor == 'postgresql':
+        statements = POSTGRES_TABLE
+    else:
+        return
+    for sql in statements + POPULATE:
+        schema_editor.execute(sql)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor in ('sqlite', 'postgresql'):
+        schema_editor.execute('DROP TABLE tracker_search')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0011_currency_balances'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
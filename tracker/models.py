@@ -1,8 +1,12 @@
 from django.db import models
+from django.db.models import Q
 from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator
+from django.utils import timezone
 from decimal import Decimal
 
+from .storage import get_blob_storage
+
 # Create your models here.
 
 class Transaction(models.Model):
@@ -27,7 +31,7 @@ class Group(models.Model):
     description = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     members = models.ManyToManyField(User, through='GroupMember')
-    cover_photo = models.ImageField(upload_to='group_covers/', null=True, blank=True)
+    cover_photo = models.ImageField(upload_to='group_covers/', storage=get_blob_storage, null=True, blank=True)
     
     def __str__(self):
         return self.name
@@ -56,12 +60,29 @@ class Expense(models.Model):
     title = models.CharField(max_length=200)
     amount = models.DecimalField(max_digits=10, decimal_places=2, validators=[MinValueValidator(Decimal('0.01'))])
     description = models.TextField(blank=True)
-    date = models.DateTimeField(auto_now_add=True)
+    date = models.DateTimeField(default=timezone.now)
     group = models.ForeignKey(Group, on_delete=models.CASCADE, null=True, blank=True)
     paid_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='expenses_paid')
     split_type = models.CharField(max_length=10, choices=SPLIT_CHOICES, default='equal')
     currency = models.CharField(max_length=3, default='USD')
-    receipt = models.ImageField(upload_to='receipts/', null=True, blank=True)
+    receipt = models.ImageField(upload_to='receipts/', storage=get_blob_storage, null=True, blank=True)
+    # Filled in by the receipt worker, which also replaces the upload with a compressed copy
+    receipt_thumbnail = models.ImageField(
+        upload_to='receipts/thumbs/', storage=get_blob_storage, null=True, blank=True
+    )
+    receipt_processed_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        indexes = [
+            # Per-member totals and the newest-first group feed
+            models.Index(fields=['group', 'paid_by'], name='expense_group_payer_idx'),
+            models.Index(fields=['group', '-date', '-id'], name='expense_group_date_idx'),
+            # Receipts still waiting for the worker
+            models.Index(
+                fields=['id'], name='expense_receipt_pending_idx',
+                condition=Q(receipt_processed_at__isnull=True) & ~Q(receipt='') & Q(receipt__isnull=False),
+            ),
+        ]
     
     def __str__(self):
         return f"{self.title} - ${self.amount}"
@@ -74,6 +95,10 @@ class ExpenseShare(models.Model):
     
     class Meta:
         unique_together = ('expense', 'user')
+        indexes = [
+            # A member's shares, joined to expenses to filter by group
+            models.Index(fields=['user', 'expense'], name='share_user_expense_idx'),
+        ]
 
 class Settlement(models.Model):
     STATUS_CHOICES = [
@@ -91,6 +116,12 @@ class Settlement(models.Model):
     payment_method = models.CharField(max_length=50, blank=True)
     notes = models.TextField(blank=True)
     
+    class Meta:
+        indexes = [
+            models.Index(fields=['receiver', 'status'], name='settlement_receiver_status_idx'),
+            models.Index(fields=['group', 'status'], name='settlement_group_status_idx'),
+        ]
+    
     def __str__(self):
         return f"{self.payer} → {self.receiver}: ${self.amount}"
 
@@ -111,6 +142,7 @@ class Notification(models.Model):
         ('settlement_request', 'Settlement Request'),
         ('settlement_completed', 'Settlement Completed'),
         ('group_invite', 'Group Invitation'),
+        ('digest', 'Digest'),
     ]
     
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='notifications')
@@ -122,5 +154,140 @@ class Notification(models.Model):
     related_settlement = models.ForeignKey(Settlement, on_delete=models.CASCADE, null=True, blank=True)
     related_group = models.ForeignKey(Group, on_delete=models.CASCADE, null=True, blank=True)
     
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-created_at'], name='notif_user_created_idx'),
+            # Small partial index for the unread badge and unread-first listings
+            models.Index(fields=['user', '-created_at'], name='notif_unread_idx', condition=Q(is_read=False)),
+            # Lets retention find expired read rows without scanning every user's history
+            models.Index(fields=['created_at'], name='notif_read_created_idx', condition=Q(is_read=True)),
+        ]
+    
     def __str__(self):
         return f"{self.type} - {self.user}"
+
+class NotificationEvent(models.Model):
+    """Something users should hear about, queued for the notification worker.
+
+    Requests only insert one of these; ``tracker.notifications.process_events``
+    later fans each event out into ``Notification`` rows for the recipient, or
+    for every other member of ``group`` when there is no single recipient.
+    """
+    type = models.CharField(max_length=20, choices=Notification.TYPE_CHOICES)
+    content = models.TextField()
+    actor = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    recipient = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    group = models.ForeignKey(Group, on_delete=models.CASCADE, null=True, blank=True)
+    related_expense = models.ForeignKey(Expense, on_delete=models.CASCADE, null=True, blank=True)
+    related_settlement = models.ForeignKey(Settlement, on_delete=models.CASCADE, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # The worker only ever scans the pending rows
+            models.Index(fields=['created_at'], name='notif_event_pending_idx', condition=Q(processed_at__isnull=True)),
+        ]
+
+    def __str__(self):
+        return f"{self.type} event ({'processed' if self.processed_at else 'pending'})"
+
+class GroupBalance(models.Model):
+    """Running totals for one member of one group in one currency.
+
+    Maintained incrementally by ``tracker.signals`` and rebuilt from scratch by
+    the ``rebuild_balances`` management command. Amounts stay in their own
+    currency and are converted when balances are read.
+    """
+    group = models.ForeignKey(Group, on_delete=models.CASCADE, related_name='balances')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='group_balances')
+    currency = models.CharField(max_length=3, default='USD')
+    paid = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    owed = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    settled = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+
+    class Meta:
+        unique_together = ('group', 'user', 'currency')
+
+    @property
+    def balance(self):
+        # Positive means the member is owed money, negative means they owe
+        return self.paid - self.owed + self.settled
+
+    def __str__(self):
+        return f"{self.user} in {self.group}: {self.balance} {self.currency}"
+
+class ExchangeRate(models.Model):
+    """Value of one unit of ``currency`` in the base currency on ``date``.
+
+    Imported from a file by the ``import_rates`` management command.
+    """
+    currency = models.CharField(max_length=3)
+    date = models.DateField()
+    rate = models.DecimalField(max_digits=18, decimal_places=8)
+
+    class Meta:
+        unique_together = ('currency', 'date')
+
+    def __str__(self):
+        return f"{self.currency} on {self.date}: {self.rate}"
+
+class SpendingRollup(models.Model):
+    """Daily spending of one member of one group in one currency.
+
+    ``paid`` and ``expense_count`` cover the expenses the member paid for,
+    ``share`` their part of all expenses. Maintained by ``tracker.signals`` and
+    rebuilt by the ``rebuild_rollups`` management command.
+    """
+    group = models.ForeignKey(Group, on_delete=models.CASCADE, related_name='spending_rollups')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='spending_rollups')
+    currency = models.CharField(max_length=3)
+    day = models.DateField()
+    paid = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    expense_count = models.IntegerField(default=0)
+    share = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+
+    class Meta:
+        unique_together = ('group', 'user', 'currency', 'day')
+        indexes = [
+            # Time series of one group
+            models.Index(fields=['group', 'day'], name='spending_rollup_day_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user} in {self.group} on {self.day}: {self.paid} {self.currency}"
+
+class TransactionRollup(models.Model):
+    """Daily totals of the legacy transactions per type and category."""
+    day = models.DateField()
+    type = models.CharField(max_length=7, choices=Transaction.TYPE_CHOICES)
+    category = models.CharField(max_length=50)
+    total = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('day', 'type', 'category')
+
+    def __str__(self):
+        return f"{self.day} {self.type} {self.category}: {self.total}"
+
+class StoredBlob(models.Model):
+    """One stored file in the content-addressed store, shared by every field that uses it.
+
+    ``refcount`` is kept up to date by ``tracker.storage``; blobs that stay at
+    zero are removed by the ``gc_blobs`` command.
+    """
+    digest = models.CharField(max_length=64, db_index=True)
+    name = models.CharField(max_length=255, unique=True)
+    size = models.BigIntegerField()
+    refcount = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['updated_at'], name='blob_unreferenced_idx', condition=Q(refcount=0)),
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.refcount} refs)"
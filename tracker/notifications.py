@@ -0,0 +1,239 @@
+"""
+Unread-notification counters and real-time badge updates.
+
+Each user's unread count is cached under ``unread:<user_id>``. A cache miss
+falls back to a ``COUNT`` on the partial unread index and refills the key, so
+the cache never has to be warmed or persisted. Creating or reading
+notifications changes the count after the transaction commits, and the new
+value is pushed to the user's websocket group so open pages update their badge
+without polling.
+
+Only Redis, Memcached and the in-process LocMemCache ``incr``/``decr``
+atomically. On those the cached number is adjusted in place. Other backends
+(the file and database caches) implement ``incr`` as a get followed by a set,
+so concurrent changes from the worker and the web processes could lose
+updates. There a change drops the key instead, and the count is read again from
+the database.
+
+A counter that is missing when a change commits is left missing; the next
+read recounts it. The key also expires after ``UNREAD_TTL`` seconds, which
+bounds any drift from a miss racing with a concurrent change.
+
+Views don't create notifications themselves. They ``enqueue`` a
+``NotificationEvent`` and the ``notification_worker`` command fans events out
+with ``process_events``. Recipients are either a single user or every other
+member of the event's group, and rows are written with batched ``bulk_create``.
+Expense events in the same group are coalesced. A group's pending expense
+events wait until the oldest is ``COALESCE_WINDOW`` seconds old, and then each
+member gets one notification covering all of them.
+"""
+import functools
+from datetime import timedelta
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.cache.backends.memcached import BaseMemcachedCache
+from django.core.cache.backends.redis import RedisCache
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Group, GroupMember, Notification, NotificationEvent
+
+UNREAD_TTL = 60 * 60
+ATOMIC_COUNTER_CACHES = (RedisCache, BaseMemcachedCache, LocMemCache)
+
+COALESCE_WINDOW = 60
+EVENT_BATCH_SIZE = 500
+FANOUT_BATCH_SIZE = 1000
+
+# Event types that are merged per member and group, with the merged wording
+COALESCED_CONTENT = {
+    'expense_added': '{count} new expenses were added in {group}',
+}
+
+
+def unread_key(user_id):
+    return f'unread:{user_id}'
+
+
+def user_channel_group(user_id):
+    """Channel layer group that every open page of ``user_id`` subscribes to."""
+    return f'notifications.user.{user_id}'
+
+
+def unread_count(user_id):
+    """The user's unread notification count, from the cache when possible."""
+    key = unread_key(user_id)
+    count = cache.get(key)
+    if count is None:
+        count = Notification.objects.filter(user_id=user_id, is_read=False).count()
+        # add() rather than set() so a value written meanwhile by incr/decr wins
+        cache.add(key, count, UNREAD_TTL)
+    return count
+
+
+def atomic_counters():
+    """Whether the default cache's ``incr``/``decr`` are atomic."""
+    return isinstance(caches['default'], ATOMIC_COUNTER_CACHES)
+
+
+def _apply_delta(user_id, delta):
+    key = unread_key(user_id)
+    if not atomic_counters():
+        cache.delete(key)
+        push_unread_count(user_id, unread_count(user_id))
+        return
+    try:
+        count = cache.incr(key, delta) if delta > 0 else cache.decr(key, -delta)
+    except ValueError:
+        # Not cached: nothing to adjust, the next read counts from the database
+        count = unread_count(user_id)
+    else:
+        if count < 0:
+            cache.delete(key)
+            count = unread_count(user_id)
+    push_unread_count(user_id, count)
+
+
+def adjust_unread(user_id, delta):
+    """Move the user's cached unread count by ``delta`` once the current transaction commits."""
+    if delta:
+        transaction.on_commit(functools.partial(_apply_delta, user_id, delta))
+
+
+def push_unread_count(user_id, count):
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    async_to_sync(channel_layer.group_send)(
+        user_channel_group(user_id), {'type': 'unread.count', 'count': count}
+    )
+
+
+def create_notifications(notifications):
+    """
+    ``bulk_create`` the given notifications and bump each recipient's counter.
+
+    Bulk inserts skip the model signals, so code that creates notifications in
+    bulk goes through here to keep the unread counters right.
+    """
+    created = Notification.objects.bulk_create(notifications)
+    deltas = {}
+    for notification in created:
+        if not notification.is_read:
+            deltas[notification.user_id] = deltas.get(notification.user_id, 0) + 1
+    for user_id, delta in deltas.items():
+        adjust_unread(user_id, delta)
+    return created
+
+
+def mark_read(user, notification_ids=None, before=None):
+    """
+    Mark the user's unread notifications read in a single ``UPDATE``; returns how many changed.
+
+    ``notification_ids`` limits it to those rows and ``before`` to rows created
+    at or before that time. Only ``is_read`` is written.
+    """
+    unread = Notification.objects.filter(user=user, is_read=False)
+    if notification_ids is not None:
+        unread = unread.filter(id__in=notification_ids)
+    if before is not None:
+        unread = unread.filter(created_at__lte=before)
+    changed = unread.update(is_read=True)
+    adjust_unread(user.id, -changed)
+    return changed
+
+
+# Queued fan-out
+
+def enqueue(type, content, actor=None, recipient=None, group=None, expense=None, settlement=None):
+    """
+    Queue a notification for ``recipient``, or for every member of ``group`` but ``actor``.
+
+    With ``settings.NOTIFICATIONS_EAGER`` the queue is drained as soon as the
+    transaction commits, without coalescing, for setups that run no worker.
+    """
+    event = NotificationEvent.objects.create(
+        type=type, content=content, actor=actor, recipient=recipient, group=group,
+        related_expense=expense, related_settlement=settlement,
+    )
+    if getattr(settings, 'NOTIFICATIONS_EAGER', False):
+        transaction.on_commit(functools.partial(process_events, window=0))
+    return event
+
+
+def enqueue_many(events):
+    """``bulk_create`` several unsaved ``NotificationEvent`` objects at once."""
+    created = NotificationEvent.objects.bulk_create(events)
+    if created and getattr(settings, 'NOTIFICATIONS_EAGER', False):
+        transaction.on_commit(functools.partial(process_events, window=0))
+    return created
+
+
+def due_events(now, window=COALESCE_WINDOW):
+    """Pending events that are ready to fan out, oldest first."""
+    pending = NotificationEvent.objects.filter(processed_at__isnull=True)
+    coalesced = list(COALESCED_CONTENT)
+    # A group's coalesced events all become due once its oldest one is old enough
+    ripe_groups = pending.filter(
+        type__in=coalesced, created_at__lte=now - timedelta(seconds=window)
+    ).values('group_id')
+    return pending.filter(~Q(type__in=coalesced) | Q(group_id__in=ripe_groups)).order_by('id')
+
+
+def _notification(user_id, events, group_names):
+    latest = events[-1]
+    if len(events) == 1:
+        return Notification(
+            user_id=user_id, type=latest.type, content=latest.content,
+            related_expense_id=latest.related_expense_id,
+            related_settlement_id=latest.related_settlement_id,
+            related_group_id=latest.group_id,
+        )
+    content = COALESCED_CONTENT[latest.type].format(count=len(events), group=group_names.get(latest.group_id, ''))
+    return Notification(user_id=user_id, type=latest.type, content=content, related_group_id=latest.group_id)
+
+
+def process_events(now=None, window=COALESCE_WINDOW, limit=EVENT_BATCH_SIZE):
+    """
+    Fan out up to ``limit`` due events and mark them processed.
+
+    Returns ``(events, notifications)`` counts. Rows are claimed with
+    ``SELECT ... FOR UPDATE SKIP LOCKED`` where the database supports it, so
+    several workers can share the queue.
+    """
+    now = now or timezone.now()
+    with transaction.atomic():
+        events = list(due_events(now, window).select_for_update(skip_locked=True)[:limit])
+        if not events:
+            return 0, 0
+
+        group_ids = {event.group_id for event in events if event.group_id}
+        group_names = dict(Group.objects.filter(id__in=group_ids).values_list('id', 'name'))
+        members = {}
+        broadcast = {event.group_id for event in events if event.recipient_id is None and event.group_id}
+        for group_id, user_id in GroupMember.objects.filter(group_id__in=broadcast).values_list('group_id', 'user_id'):
+            members.setdefault(group_id, []).append(user_id)
+
+        buckets = {}
+        for event in events:
+            if event.recipient_id:
+                recipients = [event.recipient_id]
+            else:
+                recipients = [user_id for user_id in members.get(event.group_id, []) if user_id != event.actor_id]
+            for user_id in recipients:
+                if event.type in COALESCED_CONTENT:
+                    key = (user_id, event.type, event.group_id)
+                else:
+                    key = (user_id, event.id)
+                buckets.setdefault(key, []).append(event)
+
+        notifications = [_notification(key[0], bucket, group_names) for key, bucket in buckets.items()]
+        for start in range(0, len(notifications), FANOUT_BATCH_SIZE):
+            create_notifications(notifications[start:start + FANOUT_BATCH_SIZE])
+        NotificationEvent.objects.filter(id__in=[event.id for event in events]).update(processed_at=now)
+    return len(events), len(notifications)
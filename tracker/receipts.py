@@ -0,0 +1,125 @@
+"""
+Receipt image processing.
+
+Uploads are stored as-is so the request returns quickly. The
+``process_receipts`` worker then picks up every expense whose receipt has not
+been processed yet. For each one it:
+
+* applies the EXIF orientation and drops all metadata (GPS, camera, ...),
+* re-encodes the image to at most ``MAX_DIMENSION`` pixels and ``MAX_BYTES``
+  as JPEG or WebP (``settings.RECEIPT_IMAGE_FORMAT``), replacing the original,
+* writes a small thumbnail, which pages show by default.
+
+Files go through the field's storage, so the same code works for the local
+filesystem and S3.
+"""
+import io
+import os
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.utils import timezone
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from .caching import bump_expenses
+from .models import Expense
+
+MAX_DIMENSION = 2000
+MAX_BYTES = 500 * 1024
+THUMBNAIL_SIZE = (400, 400)
+QUALITY_STEPS = (82, 74, 66, 58, 50)
+BATCH_SIZE = 20
+
+EXTENSIONS = {'JPEG': 'jpg', 'WEBP': 'webp'}
+
+
+def image_format():
+    fmt = getattr(settings, 'RECEIPT_IMAGE_FORMAT', 'JPEG').upper()
+    return fmt if fmt in EXTENSIONS else 'JPEG'
+
+
+def load_image(file, max_dimension=MAX_DIMENSION):
+    """Open ``file`` upright and in RGB, decoding large JPEGs at reduced scale."""
+    image = Image.open(file)
+    # JPEG can decode straight to a smaller power-of-two scale, which is far cheaper
+    image.draft('RGB', (max_dimension, max_dimension))
+    image = ImageOps.exif_transpose(image)
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def encode(image, max_size, fmt, max_bytes=None):
+    """
+    Downscale a copy of ``image`` to fit ``max_size`` and encode it without metadata.
+
+    Quality steps down until the result fits in ``max_bytes``.
+    """
+    image = image.copy()
+    image.thumbnail(max_size, Image.LANCZOS)
+    for quality in QUALITY_STEPS:
+        buffer = io.BytesIO()
+        options = {'quality': quality}
+        if fmt == 'JPEG':
+            options.update(optimize=True, progressive=True)
+        image.save(buffer, fmt, **options)
+        if max_bytes is None or buffer.tell() <= max_bytes:
+            break
+    return buffer.getvalue()
+
+
+def process_receipt(expense):
+    """
+    Replace ``expense.receipt`` with a compressed copy and add its thumbnail.
+
+    Returns True on success. Files that aren't readable images are marked
+    processed without a thumbnail, so they are not retried forever.
+    """
+    fmt = image_format()
+    extension = EXTENSIONS[fmt]
+    original = expense.receipt.name
+    updates = {'receipt_processed_at': timezone.now()}
+    try:
+        with expense.receipt.open('rb') as file:
+            image = load_image(file)
+        full = encode(image, (MAX_DIMENSION, MAX_DIMENSION), fmt, MAX_BYTES)
+        thumbnail = encode(image, THUMBNAIL_SIZE, fmt)
+    except (OSError, UnidentifiedImageError, Image.DecompressionBombError, ValueError):
+        Expense.objects.filter(pk=expense.pk).update(**updates)
+        return False
+
+    stem = os.path.splitext(os.path.basename(original))[0]
+    for field, data, filename in [
+        ('receipt', full, f'{stem}.{extension}'),
+        ('receipt_thumbnail', thumbnail, f'{stem}_thumb.{extension}'),
+    ]:
+        file_field = getattr(expense, field)
+        name = file_field.field.generate_filename(expense, filename)
+        updates[field] = file_field.storage.save(name, ContentFile(data))
+    # update() rather than save(): only these columns change and the ledger signals stay out of it
+    Expense.objects.filter(pk=expense.pk).update(**updates)
+    # update() skips the signals, so the expense page's validators are bumped here
+    bump_expenses(expense.pk)
+    if updates['receipt'] != original:
+        expense.receipt.storage.delete(original)
+    for field, value in updates.items():
+        setattr(expense, field, value)
+    return True
+
+
+def pending_receipts():
+    return Expense.objects.filter(receipt_processed_at__isnull=True).exclude(receipt='').exclude(receipt=None)
+
+
+def process_pending(limit=BATCH_SIZE):
+    """Process up to ``limit`` waiting receipts; returns ``(processed, failed)``."""
+    processed = failed = 0
+    for expense in pending_receipts().order_by('id')[:limit]:
+        if process_receipt(expense):
+            processed += 1
+        else:
+            failed += 1
+    return processed, failed
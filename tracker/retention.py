@@ -0,0 +1,106 @@
+"""
+Notification retention.
+
+Two passes keep the ``Notification`` table from growing forever:
+
+* ``digest_unread`` collapses each user's unread notifications older than
+  ``NOTIFICATION_DIGEST_DAYS`` into a single ``digest`` notification.
+* ``purge_read`` deletes read notifications older than
+  ``NOTIFICATION_RETENTION_DAYS``.
+
+Both work in small id batches, each in its own short transaction, so a large
+backlog never holds locks for long or blocks the web process.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max
+from django.utils import timezone
+
+from .models import Notification
+from .notifications import adjust_unread
+
+BATCH_SIZE = 1000
+DEFAULT_RETENTION_DAYS = 90
+DEFAULT_DIGEST_DAYS = 30
+
+
+def retention_days():
+    return getattr(settings, 'NOTIFICATION_RETENTION_DAYS', DEFAULT_RETENTION_DAYS)
+
+
+def digest_days():
+    return getattr(settings, 'NOTIFICATION_DIGEST_DAYS', DEFAULT_DIGEST_DAYS)
+
+
+def purge_read(older_than, batch_size=BATCH_SIZE):
+    """Delete read notifications created before ``older_than``; returns how many were removed."""
+    expired = Notification.objects.filter(is_read=True, created_at__lt=older_than).order_by('id')
+    deleted = 0
+    while True:
+        ids = list(expired.values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        with transaction.atomic():
+            deleted += Notification.objects.filter(id__in=ids).delete()[0]
+
+
+def digest_content(counts):
+    total = sum(counts.values())
+    labels = dict(Notification.TYPE_CHOICES)
+    parts = ', '.join(f'{count} {labels.get(type, type).lower()}' for type, count in sorted(counts.items()))
+    return f'You have {total} older unread notifications ({parts})'
+
+
+def _digest_user(user_id, old_unread, batch_size):
+    # Pin the set being collapsed so rows that age in meanwhile wait for the next run
+    old_unread = old_unread.filter(user_id=user_id)
+    summary = old_unread.values('type').annotate(count=Count('id'), last_id=Max('id')).order_by()
+    counts = {row['type']: row['count'] for row in summary}
+    if not counts:
+        return 0
+    last_id = max(row['last_id'] for row in summary)
+    old_unread = old_unread.filter(id__lte=last_id).order_by('id')
+
+    Notification.objects.create(user_id=user_id, type='digest', content=digest_content(counts))
+    collapsed = 0
+    while True:
+        ids = list(old_unread.values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return collapsed
+        with transaction.atomic():
+            # Flip to read first so the delete signals leave the counter alone
+            changed = Notification.objects.filter(id__in=ids, is_read=False).update(is_read=True)
+            Notification.objects.filter(id__in=ids).delete()
+            adjust_unread(user_id, -changed)
+        collapsed += changed
+
+
+def digest_unread(older_than, batch_size=BATCH_SIZE):
+    """
+    Replace each user's unread notifications created before ``older_than`` with one digest.
+
+    Returns ``(digests, collapsed)``. Digests themselves are never collapsed again.
+    """
+    old_unread = Notification.objects.filter(is_read=False, created_at__lt=older_than).exclude(type='digest')
+    user_ids = old_unread.values_list('user_id', flat=True).distinct().order_by('user_id')
+    digests = collapsed = 0
+    last_user_id = 0
+    while True:
+        batch = list(user_ids.filter(user_id__gt=last_user_id)[:batch_size])
+        if not batch:
+            return digests, collapsed
+        for user_id in batch:
+            count = _digest_user(user_id, old_unread, batch_size)
+            digests += 1 if count else 0
+            collapsed += count
+        last_user_id = batch[-1]
+
+
+def apply_retention(now=None, batch_size=BATCH_SIZE):
+    """Run both passes with the configured ages and return a summary dict."""
+    now = now or timezone.now()
+    digests, collapsed = digest_unread(now - timedelta(days=digest_days()), batch_size)
+    deleted = purge_read(now - timedelta(days=retention_days()), batch_size)
+    return {'digests': digests, 'collapsed': collapsed, 'deleted': deleted}
@@ -0,0 +1,213 @@
+"""
+Daily analytics rollups.
+
+Charts read pre-aggregated rows instead of scanning the source tables:
+
+* ``SpendingRollup``: per group, member, currency and day, the amount the
+  member paid, how many expenses that covered and their share of expenses.
+* ``TransactionRollup``: per day, type and category, the legacy personal
+  transactions.
+
+Like the balance ledger, the rows are kept in step by the signal handlers in
+``tracker.signals`` (and by hand on the ``bulk_create`` paths). They can be
+rebuilt from scratch with ``manage.py rebuild_rollups``. Days are taken in the
+current time zone, the same way ``TruncDate`` buckets them when rebuilding.
+"""
+from collections import defaultdict
+from datetime import datetime
+
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate, TruncMonth, TruncWeek
+from django.utils import timezone
+
+from .balances import ZERO, add_increments, to_decimal
+from .batching import flush
+from .models import Expense, ExpenseShare, SpendingRollup, Transaction, TransactionRollup
+
+PERIODS = {'month': TruncMonth, 'week': TruncWeek}
+
+
+def to_day(value):
+    """The rollup day for an expense or transaction date."""
+    if isinstance(value, datetime):
+        if timezone.is_aware(value):
+            value = timezone.localtime(value)
+        return value.date()
+    return value
+
+
+class RollupChanges:
+    """Collects deltas for one rollup table keyed by ``key_fields`` and applies them at once."""
+
+    model = None
+    key_fields = ()
+    value_fields = ()
+
+    def __init__(self):
+        self.deltas = defaultdict(lambda: [0] * len(self.value_fields))
+
+    def add(self, key, *values):
+        if None in key:
+            return
+        delta = self.deltas[key]
+        for index, value in enumerate(values):
+            delta[index] += value
+
+    def apply(self, create=True):
+        """
+        Write the collected deltas the same way as the balance ledger.
+
+        Pass ``create=False`` when only reversing earlier changes, as with the
+        balance ledger.
+        """
+        deltas = {key: delta for key, delta in self.deltas.items() if any(delta)}
+        self.deltas.clear()
+        if not deltas:
+            return
+        if create:
+            add_increments(self.model, self.key_fields, self.value_fields, deltas)
+            return
+
+        flush(self.model)
+        # Narrow on every key column; the exact keys are matched below
+        lookups = {
+            f'{field}__in': {key[index] for key in deltas}
+            for index, field in enumerate(self.key_fields)
+        }
+        with transaction.atomic():
+            existing = {}
+            for row in self.model.objects.select_for_update().filter(**lookups):
+                key = tuple(getattr(row, field) for field in self.key_fields)
+                delta = deltas.get(key)
+                if delta is None:
+                    continue
+                for field, value in zip(self.value_fields, delta):
+                    setattr(row, field, getattr(row, field) + value)
+                existing[key] = row
+
+            if existing:
+                self.model.objects.bulk_update(existing.values(), self.value_fields)
+
+
+class SpendingChanges(RollupChanges):
+    model = SpendingRollup
+    key_fields = ('group_id', 'user_id', 'currency', 'day')
+    value_fields = ('paid', 'expense_count', 'share')
+
+    def paid(self, group_id, user_id, currency, date, amount, count=1):
+        self.add((group_id, user_id, currency, to_day(date)), to_decimal(amount), count, ZERO)
+
+    def share(self, group_id, user_id, currency, date, amount):
+        self.add((group_id, user_id, currency, to_day(date)), ZERO, 0, to_decimal(amount))
+
+
+class TransactionChanges(RollupChanges):
+    model = TransactionRollup
+    key_fields = ('day', 'type', 'category')
+    value_fields = ('total', 'count')
+
+    def record(self, date, type, category, amount, count=1):
+        self.add((to_day(date), type, category), to_decimal(amount), count)
+
+
+def compute_spending(group_ids=None):
+    """Aggregate spending rollups from the source tables, keyed like ``SpendingChanges``."""
+    changes = SpendingChanges()
+    expenses = Expense.objects.filter(group__isnull=False)
+    shares = ExpenseShare.objects.filter(expense__group__isnull=False)
+    if group_ids is not None:
+        expenses = expenses.filter(group_id__in=group_ids)
+        shares = shares.filter(expense__group_id__in=group_ids)
+
+    paid = expenses.values('group_id', 'paid_by_id', 'currency', day=TruncDate('date')).annotate(
+        total=Sum('amount'), count=Count('id')
+    ).order_by()
+    for row in paid:
+        changes.paid(row['group_id'], row['paid_by_id'], row['currency'], row['day'], row['total'], row['count'])
+    owed = shares.values(
+        'expense__group_id', 'user_id', 'expense__currency', day=TruncDate('expense__date')
+    ).annotate(total=Sum('amount')).order_by()
+    for row in owed:
+        changes.share(row['expense__group_id'], row['user_id'], row['expense__currency'], row['day'], row['total'])
+    return changes
+
+
+def compute_transactions():
+    changes = TransactionChanges()
+    rows = Transaction.objects.values('date', 'type', 'category').annotate(
+        total=Sum('amount'), count=Count('id')
+    ).order_by()
+    for row in rows:
+        changes.record(row['date'], row['type'], row['category'], row['total'], row['count'])
+    return changes
+
+
+def _replace(rows, changes):
+    rows.delete()
+    changes.model.objects.bulk_create([
+        changes.model(**dict(zip(changes.key_fields, key)), **dict(zip(changes.value_fields, delta)))
+        for key, delta in changes.deltas.items()
+        if any(delta)
+    ], batch_size=1000)
+    return len(changes.deltas)
+
+
+def rebuild_rollups(group_ids=None):
+    """
+    Replace the spending rollups (optionally only for ``group_ids``) with fresh totals.
+
+    The transaction rollups are rebuilt too when no groups are given. Returns
+    the number of rows written.
+    """
+    spending = compute_spending(group_ids)
+    with transaction.atomic():
+        rows = SpendingRollup.objects.all()
+        if group_ids is not None:
+            rows = rows.filter(group_id__in=group_ids)
+        count = _replace(rows, spending)
+        if group_ids is None:
+            count += _replace(TransactionRollup.objects.all(), compute_transactions())
+    return count
+
+
+def _between(rows, since=None, until=None):
+    if since:
+        rows = rows.filter(day__gte=since)
+    if until:
+        rows = rows.filter(day__lte=until)
+    return rows
+
+
+def spending_series(group, period='month', since=None, until=None):
+    """Paid totals and expense counts per ``period`` and currency, oldest first, as a values queryset."""
+    rows = _between(SpendingRollup.objects.filter(group=group), since, until)
+    return (
+        rows.annotate(period=PERIODS[period]('day')).values('period', 'currency')
+        .annotate(paid=Sum('paid'), expenses=Sum('expense_count'))
+        .order_by('period', 'currency')
+    )
+
+
+def member_breakdown(group, since=None, until=None):
+    """What each member paid and their share of expenses, per currency, as a values queryset."""
+    rows = _between(SpendingRollup.objects.filter(group=group), since, until)
+    return (
+        rows.values('user_id', 'user__username', 'currency')
+        .annotate(paid=Sum('paid'), share=Sum('share'), expenses=Sum('expense_count'))
+        .order_by('currency', '-share', 'user_id')
+    )
+
+
+def transaction_totals():
+    """``(income, expenses, categories)`` for the legacy summary, from one rollup query."""
+    income = expenses = ZERO
+    categories = []
+    rows = TransactionRollup.objects.values('type', 'category').annotate(total=Sum('total')).order_by('-total')
+    for row in rows:
+        if row['type'] == Transaction.INCOME:
+            income += row['total']
+        else:
+            expenses += row['total']
+            categories.append({'category': row['category'], 'total': row['total']})
+    return income, expenses, categories
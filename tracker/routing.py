@@ -0,0 +1,8 @@
+from django.urls import path
+
+from . import consumers
+
+websocket_urlpatterns = [
+    path('ws/notifications/', consumers.NotificationConsumer.as_asgi()),
+    path('ws/groups/<int:group_id>/', consumers.GroupActivityConsumer.as_asgi()),
+]
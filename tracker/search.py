@@ -0,0 +1,209 @@
+"""
+Full-text search over expenses, comments and groups.
+
+Everything searchable lives in one ``tracker_search`` table, created by
+migration 0012. On SQLite it is an FTS5 virtual table. On PostgreSQL it is a
+plain table with a stored, weighted ``tsvector`` column and a GIN index over
+it. Each row holds the text to match plus the ids needed to scope and link a
+result, so a search is a single query with no follow-up lookups:
+
+    rowid      object_id * 4 + kind code, so a row is replaced by primary key
+    kind       'expense', 'comment' or 'group'
+    object_id  the expense, comment or group id
+    group_id   the group a member must belong to to see the row
+    parent_id  the expense a comment belongs to
+    title      weighted above body in the ranking
+    body       expense description, comment text or group description
+
+The signal handlers keep rows current. Bulk inserts (imports, load generation)
+call ``index_expenses`` themselves, and ``manage.py rebuild_search_index``
+rebuilds the table from scratch.
+
+A search matches the text index first and only then filters the matches by
+the user's memberships, so its cost depends on how many rows match, not on
+the table size.
+"""
+import re
+
+from django.db import connection
+from django.urls import reverse
+
+from .batching import pending
+from .models import Comment
+
+KINDS = {'expense': 1, 'comment': 2, 'group': 3}
+PAGE_SIZE = 20
+MAX_TERMS = 8
+EXCERPT_LENGTH = 200
+
+# Migration 0012 runs a frozen copy of these to fill the table the first time
+POPULATE_SQL = [
+    """
+    INSERT INTO tracker_search (rowid, kind, object_id, group_id, parent_id, title, body)
+    SELECT id * 4 + 1, 'expense', id, group_id, NULL, title, description
+    FROM tracker_expense WHERE group_id IS NOT NULL
+    """,
+    """
+    INSERT INTO tracker_search (rowid, kind, object_id, group_id, parent_id, title, body)
+    SELECT c.id * 4 + 2, 'comment', c.id, e.group_id, c.expense_id, '', c.text
+    FROM tracker_comment c INNER JOIN tracker_expense e ON e.id = c.expense_id
+    WHERE e.group_id IS NOT NULL
+    """,
+    """
+    INSERT INTO tracker_search (rowid, kind, object_id, group_id, parent_id, title, body)
+    SELECT id * 4 + 3, 'group', id, id, NULL, name, description
+    FROM tracker_group
+    """,
+]
+
+INSERT_SQL = (
+    'INSERT INTO tracker_search (rowid, kind, object_id, group_id, parent_id, title, body) '
+    'VALUES (%s, %s, %s, %s, %s, %s, %s)'
+)
+UPSERT_SQL = INSERT_SQL + (
+    ' ON CONFLICT (rowid) DO UPDATE SET group_id = EXCLUDED.group_id, parent_id = EXCLUDED.parent_id,'
+    ' title = EXCLUDED.title, body = EXCLUDED.body'
+)
+
+# Members only see rows of their own groups
+SCOPE_SQL = 'group_id IN (SELECT group_id FROM tracker_groupmember WHERE user_id = %s)'
+SEARCH_SQL = {
+    'sqlite': (
+        'SELECT kind, object_id, group_id, parent_id, title, body FROM tracker_search '
+        f'WHERE tracker_search MATCH %s AND {SCOPE_SQL} '
+        'ORDER BY bm25(tracker_search, 0, 0, 0, 0, 10.0, 1.0), rowid DESC LIMIT %s OFFSET %s'
+    ),
+    'postgresql': (
+        'SELECT kind, object_id, group_id, parent_id, title, body FROM tracker_search, '
+        "to_tsquery('english', %s) query "
+        f'WHERE document @@ query AND {SCOPE_SQL} '
+        'ORDER BY ts_rank(document, query) DESC, rowid DESC LIMIT %s OFFSET %s'
+    ),
+}
+
+
+def doc_id(kind, object_id):
+    return object_id * 4 + KINDS[kind]
+
+
+def _upsert(rows):
+    """Insert or replace ``(kind, object_id, group_id, parent_id, title, body)`` rows."""
+    params = {
+        doc_id(kind, object_id): (doc_id(kind, object_id), kind, object_id, group_id, parent_id, title or '', body or '')
+        for kind, object_id, group_id, parent_id, title, body in rows
+    }
+    if not params:
+        return
+    batch = pending('search', _write)
+    if batch is None:
+        _write(params)
+    else:
+        batch.update(params)
+
+
+def _write(params):
+    params = list(params.values())
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.executemany(UPSERT_SQL, params)
+        else:
+            # FTS5 tables have no upsert; replacing by rowid is just as cheap
+            cursor.executemany('DELETE FROM tracker_search WHERE rowid = %s', [(row[0],) for row in params])
+            cursor.executemany(INSERT_SQL, params)
+
+
+def remove(kind, object_ids):
+    if not object_ids:
+        return
+    batch = pending('search', _write)
+    if batch:
+        # A row written earlier in the same batch must not come back when it is flushed
+        for object_id in object_ids:
+            batch.pop(doc_id(kind, object_id), None)
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            'DELETE FROM tracker_search WHERE rowid = %s', [(doc_id(kind, object_id),) for object_id in object_ids]
+        )
+
+
+def index_expenses(expenses):
+    """Index ``expenses``; personal expenses (no group) are not searchable."""
+    _upsert([
+        ('expense', e.id, e.group_id, None, e.title, e.description) for e in expenses if e.group_id
+    ])
+    remove('expense', [e.id for e in expenses if not e.group_id])
+
+
+def index_comments(comments, group_id):
+    if group_id is None:
+        remove('comment', [c.id for c in comments])
+    else:
+        _upsert([('comment', c.id, group_id, c.expense_id, '', c.text) for c in comments])
+
+
+def reindex_comments_of(expense):
+    """Re-scope an expense's comments after it moved to another group."""
+    index_comments(Comment.objects.filter(expense_id=expense.id).only('id', 'expense_id', 'text'), expense.group_id)
+
+
+def index_group(group):
+    _upsert([('group', group.id, group.id, None, group.name, group.description)])
+
+
+def rebuild_index():
+    """Drop every row and re-index all expenses, comments and groups; returns the row count."""
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM tracker_search')
+        for sql in POPULATE_SQL:
+            cursor.execute(sql)
+        if connection.vendor == 'sqlite':
+            # Merge the freshly written segments into one b-tree
+            cursor.execute("INSERT INTO tracker_search (tracker_search) VALUES ('optimize')")
+        cursor.execute('SELECT COUNT(*) FROM tracker_search')
+        return cursor.fetchone()[0]
+
+
+def parse_terms(query):
+    return re.findall(r'\w+', query.lower())[:MAX_TERMS]
+
+
+def match_expression(terms, vendor=None):
+    """Every term, as a prefix so results show up while the user types."""
+    if (vendor or connection.vendor) == 'postgresql':
+        return ' & '.join(f'{term}:*' for term in terms)
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def _result(row):
+    kind, object_id, group_id, parent_id, title, body = row
+    if kind == 'group':
+        url = reverse('tracker:group_detail', args=[object_id])
+    else:
+        url = reverse('tracker:expense_detail', args=[parent_id if kind == 'comment' else object_id])
+    return {
+        'kind': kind,
+        'id': object_id,
+        'group_id': group_id,
+        'title': title,
+        'excerpt': body[:EXCERPT_LENGTH],
+        'url': url,
+    }
+
+
+def search(user, query, page=1, page_size=PAGE_SIZE):
+    """
+    Return ``(results, has_next)`` for the best matches of ``query`` that ``user`` can see.
+
+    Results are ranked by relevance, with titles weighted above bodies, and
+    paged by offset. One extra row is fetched to know whether another page
+    exists.
+    """
+    terms = parse_terms(query)
+    if not terms:
+        return [], False
+    with connection.cursor() as cursor:
+        cursor.execute(SEARCH_SQL[connection.vendor], [
+            match_expression(terms), user.id, page_size + 1, (page - 1) * page_size,
+        ])
+        rows = cursor.fetchall()
+    return [_result(row) for row in rows[:page_size]], len(rows) > page_size
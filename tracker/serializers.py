@@ -0,0 +1,95 @@
+"""
+Serializers for the JSON API (see ``tracker.api``).
+
+Every serializer accepts ``fields`` (only return these) and ``embed`` (also
+return these nested relations) keyword arguments, which the API views fill in
+from ``?fields=`` and ``?embed=``. Embeddable relations are listed in
+``Meta.embeddable`` and are left out unless asked for, so the view only
+prefetches them when they are used.
+"""
+from django.contrib.auth.models import User
+from rest_framework import serializers
+
+from .models import Comment, Expense, ExpenseShare, Group, Notification, Settlement
+
+
+class DynamicFieldsSerializer(serializers.ModelSerializer):
+    def __init__(self, *args, fields=None, embed=(), **kwargs):
+        super().__init__(*args, **kwargs)
+        for name in getattr(self.Meta, 'embeddable', ()):
+            if name not in embed:
+                self.fields.pop(name)
+        if fields:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
+class UserSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = User
+        fields = ['id', 'username']
+
+
+class GroupSerializer(DynamicFieldsSerializer):
+    member_count = serializers.IntegerField(read_only=True)
+    members = UserSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = Group
+        fields = ['id', 'name', 'description', 'created_at', 'cover_photo', 'member_count', 'members']
+        embeddable = ['members']
+
+
+class ShareSerializer(DynamicFieldsSerializer):
+    user = UserSerializer(read_only=True)
+
+    class Meta:
+        model = ExpenseShare
+        fields = ['id', 'expense', 'user', 'amount', 'percentage']
+
+
+class EmbeddedShareSerializer(serializers.ModelSerializer):
+    user = UserSerializer(read_only=True)
+
+    class Meta:
+        model = ExpenseShare
+        fields = ['id', 'user', 'amount', 'percentage']
+
+
+class ExpenseSerializer(DynamicFieldsSerializer):
+    paid_by = UserSerializer(read_only=True)
+    shares = EmbeddedShareSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = Expense
+        fields = [
+            'id', 'group', 'title', 'amount', 'currency', 'description', 'date', 'split_type',
+            'paid_by', 'receipt', 'receipt_thumbnail', 'shares',
+        ]
+        embeddable = ['shares']
+
+
+class SettlementSerializer(DynamicFieldsSerializer):
+    payer = UserSerializer(read_only=True)
+    receiver = UserSerializer(read_only=True)
+
+    class Meta:
+        model = Settlement
+        fields = ['id', 'group', 'payer', 'receiver', 'amount', 'status', 'date', 'payment_method', 'notes']
+
+
+class CommentSerializer(DynamicFieldsSerializer):
+    user = UserSerializer(read_only=True)
+
+    class Meta:
+        model = Comment
+        fields = ['id', 'expense', 'user', 'text', 'created_at', 'updated_at']
+
+
+class NotificationSerializer(DynamicFieldsSerializer):
+    class Meta:
+        model = Notification
+        fields = [
+            'id', 'type', 'content', 'is_read', 'created_at',
+            'related_expense', 'related_settlement', 'related_group',
+        ]
@@ -0,0 +1,432 @@
+"""
+Signal handlers that keep derived data in step with the source tables.
+"""
+import functools
+
+from django.db import transaction
+from django.db.models import Sum
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .activity import comment_event, expense_event, settlement_event
+from .balances import BalanceChanges, to_decimal
+from .caching import bump_expenses, bump_groups, bump_users
+from .models import Comment, Expense, ExpenseShare, Group, GroupMember, Notification, Settlement, Transaction
+from .notifications import adjust_unread
+from .rollups import SpendingChanges, TransactionChanges, to_day
+from . import search
+
+
+def _previous_state(sender, instance, fields, raw):
+    """Fetch the stored values of ``fields`` before an update, or None for inserts."""
+    if raw or instance.pk is None or instance._state.adding:
+        return None
+    return sender.objects.filter(pk=instance.pk).values(*fields).first()
+
+
+def _share_expense(share):
+    """The share's expense as ``{'group_id', 'date', 'currency'}``, or None if it is gone."""
+    # Remembered on the instance so the ledger, rollup and cache handlers share one lookup
+    if not hasattr(share, '_expense_state'):
+        if ExpenseShare.expense.is_cached(share):
+            expense = share.expense
+            share._expense_state = {'group_id': expense.group_id, 'date': expense.date, 'currency': expense.currency}
+        else:
+            share._expense_state = Expense.objects.filter(pk=share.expense_id).values(
+                'group_id', 'date', 'currency'
+            ).first()
+    return share._expense_state
+
+
+def _share_group_id(share):
+    expense = _share_expense(share)
+    return expense['group_id'] if expense else None
+
+
+# Balance ledger: expenses
+
+@receiver(pre_save, sender=Expense)
+def remember_expense(sender, instance, raw=False, **kwargs):
+    # The file fields ride along so replaced receipts can be released without another lookup
+    instance._ledger_previous = _previous_state(
+        sender, instance, ('group_id', 'paid_by_id', 'amount', 'date', 'currency', 'receipt', 'receipt_thumbnail'), raw
+    )
+
+
+@receiver(post_save, sender=Expense)
+def update_balances_for_expense(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    changes = BalanceChanges()
+    previous = getattr(instance, '_ledger_previous', None)
+    if previous:
+        changes.paid(previous['group_id'], previous['paid_by_id'], -previous['amount'], previous['currency'])
+    changes.paid(instance.group_id, instance.paid_by_id, to_decimal(instance.amount), instance.currency)
+
+    # Moving an expense to another group or currency moves everything its shares owe too
+    if previous and (previous['group_id'], previous['currency']) != (instance.group_id, instance.currency):
+        owed = instance.shares.values('user_id').annotate(total=Sum('amount')).order_by()
+        for row in owed:
+            changes.owed(previous['group_id'], row['user_id'], -row['total'], previous['currency'])
+            changes.owed(instance.group_id, row['user_id'], row['total'], instance.currency)
+    changes.apply()
+
+
+@receiver(post_delete, sender=Expense)
+def reverse_balances_for_expense(sender, instance, **kwargs):
+    changes = BalanceChanges()
+    changes.paid(instance.group_id, instance.paid_by_id, -to_decimal(instance.amount), instance.currency)
+    changes.apply(create=False)
+
+
+# Balance ledger: shares
+
+@receiver(pre_save, sender=ExpenseShare)
+def remember_share(sender, instance, raw=False, **kwargs):
+    instance._ledger_previous = _previous_state(
+        sender, instance, ('expense__group_id', 'expense__date', 'expense__currency', 'user_id', 'amount'), raw
+    )
+
+
+@receiver(post_save, sender=ExpenseShare)
+def update_balances_for_share(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    changes = BalanceChanges()
+    previous = getattr(instance, '_ledger_previous', None)
+    if previous:
+        changes.owed(previous['expense__group_id'], previous['user_id'], -previous['amount'],
+                     previous['expense__currency'])
+    expense = _share_expense(instance)
+    if expense:
+        changes.owed(expense['group_id'], instance.user_id, to_decimal(instance.amount), expense['currency'])
+    changes.apply()
+
+
+@receiver(post_delete, sender=ExpenseShare)
+def reverse_balances_for_share(sender, instance, **kwargs):
+    expense = _share_expense(instance)
+    if expense:
+        changes = BalanceChanges()
+        changes.owed(expense['group_id'], instance.user_id, -to_decimal(instance.amount), expense['currency'])
+        changes.apply(create=False)
+
+
+# Balance ledger: settlements (only completed ones move money)
+
+def _settlement_changes(changes, state, sign):
+    if state['status'] != 'completed':
+        return
+    amount = to_decimal(state['amount']) * sign
+    changes.settled(state['group_id'], state['payer_id'], amount)
+    changes.settled(state['group_id'], state['receiver_id'], -amount)
+
+
+def _settlement_state(settlement):
+    return {
+        'status': settlement.status,
+        'amount': settlement.amount,
+        'group_id': settlement.group_id,
+        'payer_id': settlement.payer_id,
+        'receiver_id': settlement.receiver_id,
+    }
+
+
+@receiver(pre_save, sender=Settlement)
+def remember_settlement(sender, instance, raw=False, **kwargs):
+    instance._ledger_previous = _previous_state(
+        sender, instance, ('status', 'amount', 'group_id', 'payer_id', 'receiver_id'), raw
+    )
+
+
+@receiver(post_save, sender=Settlement)
+def update_balances_for_settlement(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    changes = BalanceChanges()
+    previous = getattr(instance, '_ledger_previous', None)
+    if previous:
+        _settlement_changes(changes, previous, -1)
+    _settlement_changes(changes, _settlement_state(instance), 1)
+    changes.apply()
+
+
+@receiver(post_delete, sender=Settlement)
+def reverse_balances_for_settlement(sender, instance, **kwargs):
+    changes = BalanceChanges()
+    _settlement_changes(changes, _settlement_state(instance), -1)
+    changes.apply(create=False)
+
+
+# Analytics rollups
+
+@receiver(post_save, sender=Expense)
+def update_rollups_for_expense(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    changes = SpendingChanges()
+    previous = getattr(instance, '_ledger_previous', None)
+    if previous:
+        changes.paid(previous['group_id'], previous['paid_by_id'], previous['currency'], previous['date'],
+                     -previous['amount'], -1)
+    changes.paid(instance.group_id, instance.paid_by_id, instance.currency, instance.date, instance.amount)
+
+    # A new group, currency or day moves every share's rollup along with the expense
+    old = previous and (previous['group_id'], previous['currency'], to_day(previous['date']))
+    if old and old != (instance.group_id, instance.currency, to_day(instance.date)):
+        owed = instance.shares.values('user_id').annotate(total=Sum('amount')).order_by()
+        for row in owed:
+            changes.share(previous['group_id'], row['user_id'], previous['currency'], previous['date'], -row['total'])
+            changes.share(instance.group_id, row['user_id'], instance.currency, instance.date, row['total'])
+    changes.apply()
+
+
+@receiver(post_delete, sender=Expense)
+def reverse_rollups_for_expense(sender, instance, **kwargs):
+    changes = SpendingChanges()
+    changes.paid(instance.group_id, instance.paid_by_id, instance.currency, instance.date,
+                 -to_decimal(instance.amount), -1)
+    changes.apply(create=False)
+
+
+@receiver(post_save, sender=ExpenseShare)
+def update_rollups_for_share(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    changes = SpendingChanges()
+    previous = getattr(instance, '_ledger_previous', None)
+    if previous:
+        changes.share(previous['expense__group_id'], previous['user_id'], previous['expense__currency'],
+                      previous['expense__date'], -previous['amount'])
+    expense = _share_expense(instance)
+    if expense:
+        changes.share(expense['group_id'], instance.user_id, expense['currency'], expense['date'], instance.amount)
+    changes.apply()
+
+
+@receiver(post_delete, sender=ExpenseShare)
+def reverse_rollups_for_share(sender, instance, **kwargs):
+    expense = _share_expense(instance)
+    if expense:
+        changes = SpendingChanges()
+        changes.share(expense['group_id'], instance.user_id, expense['currency'], expense['date'],
+                      -to_decimal(instance.amount))
+        changes.apply(create=False)
+
+
+@receiver(pre_save, sender=Transaction)
+def remember_transaction(sender, instance, raw=False, **kwargs):
+    instance._rollup_previous = _previous_state(sender, instance, ('date', 'type', 'category', 'amount'), raw)
+
+
+@receiver(post_save, sender=Transaction)
+def update_rollups_for_transaction(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    changes = TransactionChanges()
+    previous = getattr(instance, '_rollup_previous', None)
+    if previous:
+        changes.record(previous['date'], previous['type'], previous['category'], -previous['amount'], -1)
+    changes.record(instance.date, instance.type, instance.category, instance.amount)
+    changes.apply()
+
+
+@receiver(post_delete, sender=Transaction)
+def reverse_rollups_for_transaction(sender, instance, **kwargs):
+    changes = TransactionChanges()
+    changes.record(instance.date, instance.type, instance.category, -to_decimal(instance.amount), -1)
+    changes.apply(create=False)
+
+
+# Summary cache and page validators: bump the versions of whatever a change touches
+
+def _previous_group_id(instance):
+    previous = getattr(instance, '_ledger_previous', None)
+    return previous['group_id'] if previous else None
+
+
+@receiver([post_save, post_delete], sender=Expense)
+@receiver([post_save, post_delete], sender=Settlement)
+def invalidate_group_for_row(sender, instance, **kwargs):
+    bump_groups(instance.group_id, _previous_group_id(instance))
+
+
+@receiver([post_save, post_delete], sender=Expense)
+def invalidate_expense(sender, instance, **kwargs):
+    bump_expenses(instance.id)
+
+
+@receiver([post_save, post_delete], sender=ExpenseShare)
+def invalidate_group_for_share(sender, instance, **kwargs):
+    previous = getattr(instance, '_ledger_previous', None)
+    bump_groups(_share_group_id(instance), previous and previous['expense__group_id'])
+    bump_expenses(instance.expense_id)
+
+
+@receiver([post_save, post_delete], sender=Comment)
+def invalidate_expense_for_comment(sender, instance, **kwargs):
+    bump_expenses(instance.expense_id)
+
+
+@receiver([post_save, post_delete], sender=GroupMember)
+def invalidate_membership(sender, instance, **kwargs):
+    bump_groups(instance.group_id)
+    bump_users(instance.user_id)
+
+
+@receiver([post_save, post_delete], sender=Group)
+def invalidate_group(sender, instance, **kwargs):
+    bump_groups(instance.id)
+
+
+# Live group activity (see tracker/activity.py)
+
+@receiver(post_save, sender=Expense)
+def broadcast_expense(sender, instance, created, raw=False, **kwargs):
+    if not raw:
+        expense_event(instance, 'created' if created else 'updated')
+
+
+@receiver(post_delete, sender=Expense)
+def broadcast_deleted_expense(sender, instance, **kwargs):
+    expense_event(instance, 'deleted')
+
+
+def _comment_group_id(comment):
+    if Comment.expense.is_cached(comment):
+        return comment.expense.group_id
+    return Expense.objects.filter(id=comment.expense_id).values_list('group_id', flat=True).first()
+
+
+@receiver(post_save, sender=Comment)
+def broadcast_comment(sender, instance, created, raw=False, **kwargs):
+    if not raw:
+        comment_event(instance, 'created' if created else 'updated', _comment_group_id(instance))
+
+
+@receiver(post_delete, sender=Comment)
+def broadcast_deleted_comment(sender, instance, **kwargs):
+    comment_event(instance, 'deleted', _comment_group_id(instance))
+
+
+@receiver(post_save, sender=Settlement)
+def broadcast_settlement(sender, instance, created, raw=False, **kwargs):
+    if not raw:
+        settlement_event(instance, 'created' if created else 'updated')
+
+
+@receiver(post_delete, sender=Settlement)
+def broadcast_deleted_settlement(sender, instance, **kwargs):
+    settlement_event(instance, 'deleted')
+
+
+# Search index (see tracker/search.py)
+
+@receiver(post_save, sender=Expense)
+def index_expense(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    search.index_expenses([instance])
+    if not created and _previous_group_id(instance) != instance.group_id:
+        search.reindex_comments_of(instance)
+
+
+@receiver(post_delete, sender=Expense)
+def unindex_expense(sender, instance, **kwargs):
+    search.remove('expense', [instance.id])
+
+
+@receiver(post_save, sender=Comment)
+def index_comment(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.index_comments([instance], _comment_group_id(instance))
+
+
+@receiver(post_delete, sender=Comment)
+def unindex_comment(sender, instance, **kwargs):
+    search.remove('comment', [instance.id])
+
+
+@receiver(post_save, sender=Group)
+def index_group(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.index_group(instance)
+
+
+@receiver(post_delete, sender=Group)
+def unindex_group(sender, instance, **kwargs):
+    search.remove('group', [instance.id])
+
+
+# Unread notification counters
+
+@receiver(pre_save, sender=Notification)
+def remember_notification(sender, instance, raw=False, **kwargs):
+    instance._unread_previous = _previous_state(sender, instance, ('user_id', 'is_read'), raw)
+
+
+@receiver(post_save, sender=Notification)
+def update_unread_for_notification(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    deltas = {instance.user_id: 0 if instance.is_read else 1}
+    previous = getattr(instance, '_unread_previous', None)
+    if previous and not previous['is_read']:
+        deltas[previous['user_id']] = deltas.get(previous['user_id'], 0) - 1
+    for user_id, delta in deltas.items():
+        adjust_unread(user_id, delta)
+
+
+@receiver(post_delete, sender=Notification)
+def update_unread_for_deleted_notification(sender, instance, **kwargs):
+    if not instance.is_read:
+        adjust_unread(instance.user_id, -1)
+
+
+# Content-addressed files: a deleted row, or a replaced file, gives up its references
+
+def _release_files(instance, fields):
+    for field in fields:
+        file = getattr(instance, field)
+        if file:
+            file.storage.delete(file.name)
+
+
+def _release_replaced(instance, previous, fields):
+    """Release the stored files of ``fields`` that ``instance`` is about to replace or clear."""
+    for field in fields:
+        old = previous[field]
+        file = getattr(instance, field)
+        if old and old != (file.name or ''):
+            # Only once the new name is committed, so a rolled back edit keeps its file
+            transaction.on_commit(functools.partial(file.storage.delete, old))
+
+
+@receiver(pre_save, sender=Expense)
+def release_replaced_expense_files(sender, instance, raw=False, **kwargs):
+    previous = getattr(instance, '_ledger_previous', None)
+    if raw or not previous:
+        return
+    replaced = (instance.receipt.name or '') != (previous['receipt'] or '')
+    if replaced and (instance.receipt_thumbnail.name or '') == (previous['receipt_thumbnail'] or ''):
+        # The thumbnail belongs to the old receipt; the worker makes one for the new receipt
+        instance.receipt_thumbnail = ''
+        instance.receipt_processed_at = None
+    _release_replaced(instance, previous, ('receipt', 'receipt_thumbnail'))
+
+
+@receiver(pre_save, sender=Group)
+def release_replaced_cover_photo(sender, instance, raw=False, **kwargs):
+    previous = _previous_state(sender, instance, ('cover_photo',), raw)
+    if previous:
+        _release_replaced(instance, previous, ('cover_photo',))
+
+
+@receiver(post_delete, sender=Expense)
+def release_expense_files(sender, instance, **kwargs):
+    _release_files(instance, ('receipt', 'receipt_thumbnail'))
+
+
+@receiver(post_delete, sender=Group)
+def release_group_files(sender, instance, **kwargs):
+    _release_files(instance, ('cover_photo',))
@@ -0,0 +1,112 @@
+"""
+Share allocation for expenses.
+
+``allocate_shares`` turns an amount, a split type and per-member inputs into
+cent-exact share amounts in a single pass. Equal and percentage splits use
+largest-remainder rounding, so the shares always add up to the expense total.
+``create_shares`` then writes every row with one ``bulk_create``.
+"""
+from collections import namedtuple
+from decimal import Decimal
+from fractions import Fraction
+
+from .balances import BalanceChanges
+from .caching import bump_expenses, bump_groups
+from .models import ExpenseShare
+from .rollups import SpendingChanges
+
+CENT = Decimal('0.01')
+HUNDRED = Decimal('100')
+
+Allocation = namedtuple('Allocation', ['user', 'amount', 'percentage'])
+
+
+class SplitError(ValueError):
+    """The per-member inputs do not describe a valid split of the amount."""
+
+
+def largest_remainder(total_cents, weights):
+    """
+    Split ``total_cents`` proportionally to ``weights`` in whole cents.
+
+    Every part gets the floor of its exact quota and the cents left over go to
+    the parts with the largest fractional remainders (earliest first on ties).
+    """
+    weight_sum = sum(Fraction(weight) for weight in weights)
+    quotas = [Fraction(total_cents) * Fraction(weight) / weight_sum for weight in weights]
+    parts = [quota.numerator // quota.denominator for quota in quotas]
+    leftover = total_cents - sum(parts)
+    by_remainder = sorted(range(len(quotas)), key=lambda i: (parts[i] - quotas[i], i))
+    for i in by_remainder[:leftover]:
+        parts[i] += 1
+    return parts
+
+
+def allocate_shares(amount, split_type, members, values=None):
+    """
+    Compute each member's share of ``amount``.
+
+    ``values`` maps user id to the exact amount (``'exact'``) or percentage
+    (``'percent'``) entered for that member; it is ignored for ``'equal'``.
+    Members with a blank or zero value are left out of exact and percentage
+    splits. Raises ``SplitError`` when the inputs don't add up.
+    """
+    amount = Decimal(amount).quantize(CENT)
+    total_cents = int(amount / CENT)
+    members = list(members)
+    values = values or {}
+
+    if split_type == 'equal':
+        if not members:
+            raise SplitError('The group has no members to split between.')
+        parts = largest_remainder(total_cents, [1] * len(members))
+        return [Allocation(member, Decimal(cents) * CENT, None) for member, cents in zip(members, parts)]
+
+    entered = [(member, Decimal(values.get(member.id) or 0)) for member in members]
+    if any(value < 0 for _, value in entered):
+        raise SplitError('Shares cannot be negative.')
+    entered = [(member, value) for member, value in entered if value]
+    if not entered:
+        raise SplitError('Enter a share for at least one member.')
+
+    if split_type == 'exact':
+        total = sum(value for _, value in entered)
+        if total != amount:
+            raise SplitError(f'Exact shares add up to {total}, not {amount}.')
+        return [Allocation(member, value.quantize(CENT), None) for member, value in entered]
+
+    if split_type == 'percent':
+        total = sum(value for _, value in entered)
+        if total != HUNDRED:
+            raise SplitError(f'Percentages add up to {total}%, not 100%.')
+        parts = largest_remainder(total_cents, [value for _, value in entered])
+        return [
+            Allocation(member, Decimal(cents) * CENT, value)
+            for (member, value), cents in zip(entered, parts)
+        ]
+
+    raise SplitError(f'Unknown split type {split_type!r}.')
+
+
+def create_shares(expense, allocations):
+    """
+    Insert the expense's shares in one statement and record them in the ledger.
+
+    ``bulk_create`` skips model signals, so the ledger and rollup updates the
+    signals would have made are applied here in the same transaction.
+    """
+    shares = ExpenseShare.objects.bulk_create([
+        ExpenseShare(expense=expense, user=allocation.user, amount=allocation.amount,
+                     percentage=allocation.percentage)
+        for allocation in allocations
+    ])
+    changes = BalanceChanges()
+    spending = SpendingChanges()
+    for share in shares:
+        changes.owed(expense.group_id, share.user_id, share.amount, expense.currency)
+        spending.share(expense.group_id, share.user_id, expense.currency, expense.date, share.amount)
+    changes.apply()
+    spending.apply()
+    bump_groups(expense.group_id)
+    bump_expenses(expense.id)
+    return shares
@@ -0,0 +1,166 @@
+"""
+Content-addressed, deduplicated file storage.
+
+``ContentAddressedStorage`` wraps the configured default storage (the local
+filesystem or S3 through ``django-storages``). Each upload is hashed while it
+is read in chunks and stored once as ``cas/<aa>/<bb>/<sha256><ext>``. When that
+blob already exists, nothing is uploaded again and the field simply points at
+it. Blob names never change content, so their URLs can be cached forever.
+
+Every save adds a reference to the blob's ``StoredBlob`` row and every
+``delete`` drops one. The signal handlers call ``delete`` when a row is
+deleted, and after commit when a field's file is replaced or cleared.
+Bytes are only removed by ``collect_garbage`` (the ``gc_blobs`` command),
+once a blob has gone unreferenced for a grace period. That leaves room for
+an upload that is about to reuse the blob.
+"""
+import hashlib
+import os
+from datetime import timedelta
+
+from django.core.files.storage import Storage, default_storage
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.deconstruct import deconstructible
+
+PREFIX = 'cas/'
+GC_GRACE = timedelta(hours=1)
+
+
+def blob_name(digest, extension):
+    return f'{PREFIX}{digest[:2]}/{digest[2:4]}/{digest}{extension.lower()}'
+
+
+@deconstructible
+class ContentAddressedStorage(Storage):
+    def __init__(self, backend=None):
+        self._backend = backend
+
+    @property
+    def backend(self):
+        # Resolved lazily so settings overrides (tests, S3 in production) are honoured
+        return self._backend or default_storage
+
+    def get_available_name(self, name, max_length=None):
+        # The stored name comes from the content hash, so there is nothing to make unique
+        return name
+
+    def _save(self, name, content):
+        from .models import StoredBlob
+
+        digest = hashlib.sha256()
+        size = 0
+        for chunk in content.chunks():
+            digest.update(chunk)
+            size += len(chunk)
+        digest = digest.hexdigest()
+        name = blob_name(digest, os.path.splitext(name)[1])
+
+        # Take a reference, creating the row if this is the first copy of these bytes
+        while not StoredBlob.objects.filter(name=name).update(refcount=F('refcount') + 1, updated_at=timezone.now()):
+            try:
+                with transaction.atomic():
+                    StoredBlob.objects.create(digest=digest, name=name, size=size, refcount=1)
+                break
+            except IntegrityError:
+                continue
+
+        if not self.backend.exists(name):
+            content.seek(0)
+            saved = self.backend.save(name, content)
+            if saved != name:
+                # Lost a race with an identical upload; keep theirs
+                self.backend.delete(saved)
+        return name
+
+    def delete(self, name):
+        """Drop one reference; the bytes stay until ``collect_garbage`` finds the blob unused."""
+        from .models import StoredBlob
+
+        if not name:
+            return
+        if not name.startswith(PREFIX):
+            # Files written before content addressing are still owned by a single field
+            self.backend.delete(name)
+            return
+        StoredBlob.objects.filter(name=name, refcount__gt=0).update(
+            refcount=F('refcount') - 1, updated_at=timezone.now()
+        )
+
+    def _open(self, name, mode='rb'):
+        return self.backend.open(name, mode)
+
+    def exists(self, name):
+        return self.backend.exists(name)
+
+    def url(self, name):
+        return self.backend.url(name)
+
+    def size(self, name):
+        return self.backend.size(name)
+
+    def path(self, name):
+        return self.backend.path(name)
+
+    def listdir(self, path):
+        return self.backend.listdir(path)
+
+    def get_modified_time(self, name):
+        return self.backend.get_modified_time(name)
+
+
+blob_storage = ContentAddressedStorage()
+
+
+def get_blob_storage():
+    """Storage callable for file fields, so migrations don't pin a backend."""
+    return blob_storage
+
+
+def file_references():
+    """``{blob name: reference count}`` computed from every field that stores blobs."""
+    from .models import Expense, Group
+
+    references = {}
+    sources = [
+        (Expense, 'receipt'),
+        (Expense, 'receipt_thumbnail'),
+        (Group, 'cover_photo'),
+    ]
+    for model, field in sources:
+        names = model.objects.filter(**{f'{field}__startswith': PREFIX}).values_list(field, flat=True)
+        for name in names.iterator():
+            references[name] = references.get(name, 0) + 1
+    return references
+
+
+def recount_references():
+    """Reset every blob's refcount from the fields that use it; returns how many were corrected."""
+    from .models import StoredBlob
+
+    references = file_references()
+    fixed = 0
+    for blob in StoredBlob.objects.only('id', 'name', 'refcount').iterator():
+        actual = references.get(blob.name, 0)
+        if actual != blob.refcount:
+            StoredBlob.objects.filter(pk=blob.pk).update(refcount=actual, updated_at=timezone.now())
+            fixed += 1
+    return fixed
+
+
+def collect_garbage(grace=GC_GRACE, now=None):
+    """Delete blobs unreferenced for longer than ``grace``; returns ``(blobs, bytes)`` freed."""
+    from .models import StoredBlob
+
+    now = now or timezone.now()
+    freed = freed_bytes = 0
+    candidates = StoredBlob.objects.filter(refcount=0, updated_at__lt=now - grace)
+    for blob in candidates.iterator():
+        # Re-check inside the delete so a blob picked up again meanwhile survives
+        deleted, _ = StoredBlob.objects.filter(pk=blob.pk, refcount=0).delete()
+        if deleted:
+            blob_storage.backend.delete(blob.name)
+            freed += 1
+            freed_bytes += blob.size
+    return freed, freed_bytes
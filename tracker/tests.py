@@ -1,3 +1,1314 @@
-from django.test import TestCase
+import gzip
+import io
+import json
+import re
+import shutil
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import iscoroutinefunction
+from channels.layers import get_channel_layer
+from PIL import Image
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import CommandError
+from django.db import connection, transaction
+from django.db.models import Count, Sum
+from django.http import HttpResponse
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .balances import check_balances, group_balances
+from .batching import batched_writes
+from .benchmarks import private_cache
+from .caching import GroupSummary, UserSummary, cache_stats, get_versions
+from .checks import check_shared_cache
+from .exporters import export_group
+from .importers import ExpenseImporter, read_csv, read_ofx
+from .instrumentation import QueryBudgetExceeded, QueryInstrumentationMiddleware, RequestRecorder
+from .activity import group_channel_group
+from .consumers import GroupActivityConsumer, NotificationConsumer
+from .currency import RateFileError, RateTable, import_rates, read_rates
+from .loadgen import seed
+from .receipts import THUMBNAIL_SIZE, process_pending
+from .storage import PREFIX, collect_garbage, recount_references
+from .retention import apply_retention, digest_unread, purge_read
+from .rollups import compute_spending, rebuild_rollups, transaction_totals
+from .search import rebuild_index
+from .pagination import EstimatedCountPaginator
+from .notifications import (
+    atomic_counters, create_notifications, enqueue, mark_read, process_events, unread_count, unread_key,
+    user_channel_group,
+)
+from . import views
+from .models import (
+    Comment, Group, GroupMember, Expense, ExpenseShare, GroupBalance, Settlement, Notification, SpendingRollup,
+    StoredBlob, Transaction,
+)
+from .settle_up import simplify_debts
+from .splits import SplitError, allocate_shares, largest_remainder
+
+
+# Each test run gets a private cache instead of the shared one in settings
+TEST_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests'}}
+
+
+@override_settings(QUERY_BUDGET_STRICT=True, CACHES=TEST_CACHES)
+class TrackerTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = User.objects.create_user('alice', 'alice@example.com', 'pw')
+        cls.bob = User.objects.create_user('bob', 'bob@example.com', 'pw')
+        cls.carol = User.objects.create_user('carol', 'carol@example.com', 'pw')
+        cls.group = Group.objects.create(name='Trip')
+        GroupMember.objects.create(user=cls.alice, group=cls.group, role='admin')
+        GroupMember.objects.create(user=cls.bob, group=cls.group)
+        GroupMember.objects.create(user=cls.carol, group=cls.group)
+
+    def setUp(self):
+        # Cached counters would otherwise leak between tests that roll back the database
+        cache.clear()
+
+    def add_expense(self, payer, amount, shares, group=None):
+        expense = Expense.objects.create(
+            title='Dinner', amount=Decimal(amount), paid_by=payer, group=group or self.group
+        )
+        for user, share in shares.items():
+            ExpenseShare.objects.create(expense=expense, user=user, amount=Decimal(share))
+        return expense
+
+
+class BalanceLedgerTests(TrackerTestCase):
+    def test_expense_and_shares_update_ledger(self):
+        self.add_expense(self.alice, '30.00', {self.alice: '10.00', self.bob: '10.00', self.carol: '10.00'})
+
+        balances = group_balances(self.group)
+        self.assertEqual(balances[self.alice.id], Decimal('20.00'))
+        self.assertEqual(balances[self.bob.id], Decimal('-10.00'))
+        self.assertEqual(check_balances(), [])
+
+    def test_updates_and_deletes_are_reversed(self):
+        expense = self.add_expense(self.alice, '30.00', {self.bob: '15.00', self.carol: '15.00'})
+        expense.amount = Decimal('40.00')
+        expense.paid_by = self.bob
+        expense.save()
+        share = expense.shares.get(user=self.carol)
+        share.amount = Decimal('25.00')
+        share.save()
+        self.assertEqual(check_balances(), [])
+
+        expense.delete()
+        self.assertEqual(check_balances(), [])
+        self.assertEqual(set(group_balances(self.group).values()), {Decimal('0.00')})
+
+    def test_only_completed_settlements_count(self):
+        settlement = Settlement.objects.create(payer=self.bob, receiver=self.alice, amount=Decimal('5.00'), group=self.group)
+        self.assertEqual(group_balances(self.group), {})
+
+        settlement.status = 'completed'
+        settlement.save()
+        balances = group_balances(self.group)
+        self.assertEqual(balances[self.bob.id], Decimal('5.00'))
+        self.assertEqual(balances[self.alice.id], Decimal('-5.00'))
+        self.assertEqual(check_balances(), [])
+
+    def test_group_detail_reads_ledger(self):
+        self.add_expense(self.alice, '30.00', {self.alice: '10.00', self.bob: '10.00', self.carol: '10.00'})
+        self.client.force_login(self.bob)
+        response = self.client.get(reverse('tracker:group_detail', args=[self.group.id]))
+        self.assertEqual(response.context['balances'][self.bob], Decimal('-10.00'))
+
+    def test_concurrent_first_writes_do_not_collide(self):
+        # Another transaction commits the ledger and rollup rows for the same keys just before ours write
+        rivals = []
+
+        def rival(execute, sql, params, many, context):
+            if not rivals and sql.startswith('INSERT INTO "tracker_groupbalance"'):
+                rivals.append(sql)
+                GroupBalance.objects.create(group=self.group, user=self.alice, currency='USD', paid=Decimal('5.00'))
+                SpendingRollup.objects.create(
+                    group=self.group, user=self.alice, currency='USD', day=timezone.localdate(),
+                    paid=Decimal('5.00'), expense_count=1,
+                )
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(rival):
+            Expense.objects.create(title='Taxi', amount=Decimal('12.00'), paid_by=self.alice, group=self.group)
+        self.assertTrue(rivals)
+        self.assertEqual(GroupBalance.objects.get(user=self.alice).paid, Decimal('17.00'))
+        rollup = SpendingRollup.objects.get(user=self.alice)
+        self.assertEqual((rollup.paid, rollup.expense_count), (Decimal('17.00'), 2))
+
+    def test_batched_writes_go_out_once_at_the_end(self):
+        with transaction.atomic(), batched_writes():
+            self.add_expense(self.alice, '30.00', {self.bob: '15.00', self.carol: '15.00'})
+            self.assertFalse(GroupBalance.objects.exists())
+            # Deleting inside the batch must not bring its rows back when the batch is flushed
+            dropped = self.add_expense(self.bob, '9.00', {self.alice: '9.00'})
+            dropped.delete()
+        self.assertEqual(check_balances(), [])
+        self.assertEqual(group_balances(self.group)[self.bob.id], Decimal('-15.00'))
+        self.assertEqual(SpendingRollup.objects.aggregate(paid=Sum('paid'))['paid'], Decimal('30.00'))
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT object_id FROM tracker_search WHERE kind = 'expense'")
+            self.assertNotIn((dropped.id,), cursor.fetchall())
+
+    def test_rebuild_command_repairs_drift(self):
+        self.add_expense(self.alice, '30.00', {self.bob: '30.00'})
+        GroupBalance.objects.filter(user=self.bob).update(owed=Decimal('0.00'))
+
+        with self.assertRaises(CommandError):
+            call_command('rebuild_balances', '--check', stdout=StringIO())
+        call_command('rebuild_balances', stdout=StringIO())
+        call_command('rebuild_balances', '--check', stdout=StringIO())
+
+
+class SettleUpTests(TrackerTestCase):
+    def assertSettles(self, balances, transfers):
+        remaining = dict(balances)
+        for payer, receiver, amount in transfers:
+            remaining[payer] += amount
+            remaining[receiver] -= amount
+        self.assertEqual(set(remaining.values()), {Decimal('0.00')})
+
+    def test_exact_solver_finds_minimal_plan(self):
+        balances = {1: Decimal('10.00'), 2: Decimal('-10.00'), 3: Decimal('7.00'), 4: Decimal('-7.00'),
+                    5: Decimal('3.00'), 6: Decimal('-3.00')}
+        transfers = simplify_debts(balances)
+        self.assertSettles(balances, transfers)
+        self.assertEqual(len(transfers), 3)
+
+        balances = {1: Decimal('6.00'), 2: Decimal('4.00'), 3: Decimal('-5.00'), 4: Decimal('-5.00'),
+                    5: Decimal('1.00'), 6: Decimal('-1.00')}
+        transfers = simplify_debts(balances)
+        self.assertSettles(balances, transfers)
+        self.assertEqual(len(transfers), 4)
+
+    def test_greedy_plan_for_large_groups(self):
+        balances = {user_id: Decimal(user_id % 97 - 48) for user_id in range(1, 5000)}
+        balances[5000] = -sum(balances.values())
+        transfers = simplify_debts(balances)
+        self.assertSettles(balances, transfers)
+        self.assertLess(len(transfers), 5000)
+
+    def test_plan_endpoint_and_bulk_create(self):
+        self.add_expense(self.alice, '30.00', {self.alice: '10.00', self.bob: '10.00', self.carol: '10.00'})
+        self.client.force_login(self.bob)
+
+        plan = self.client.get(reverse('tracker:settle_up_plan', args=[self.group.id])).json()
+        self.assertEqual(
+            sorted((t['payer_username'], t['receiver_username'], t['amount']) for t in plan['transfers']),
+            [('bob', 'alice', '10.00'), ('carol', 'alice', '10.00')],
+        )
+
+        response = self.client.post(reverse('tracker:settle_up', args=[self.group.id]))
+        self.assertRedirects(response, reverse('tracker:group_detail', args=[self.group.id]))
+        self.assertEqual(Settlement.objects.filter(group=self.group, receiver=self.alice).count(), 2)
+        process_events()
+        self.assertEqual(Notification.objects.filter(user=self.alice, type='settlement_request').count(), 2)
+
+
+class CurrencyTests(TrackerTestCase):
+    def add_euro_expense(self, payer, amount, shares):
+        expense = Expense.objects.create(
+            title='Museum', amount=Decimal(amount), paid_by=payer, group=self.group, currency='EUR'
+        )
+        for user, share in shares.items():
+            ExpenseShare.objects.create(expense=expense, user=user, amount=Decimal(share))
+        return expense
+
+    def test_rate_lookup_uses_latest_rate_on_or_before_the_day(self):
+        day = timezone.localdate()
+        table = RateTable([
+            ('EUR', day - timedelta(days=10), Decimal('1.05')),
+            ('EUR', day - timedelta(days=2), Decimal('1.10')),
+        ])
+        self.assertEqual(table.rate('EUR', day), Decimal('1.10'))
+        self.assertEqual(table.rate('EUR', day - timedelta(days=5)), Decimal('1.05'))
+        self.assertEqual(table.rate('EUR', day - timedelta(days=30)), Decimal('1.05'))
+        self.assertEqual(table.rate('USD', day), Decimal(1))
+        self.assertEqual(table.convert(Decimal('10.00'), 'EUR'), Decimal('11.00'))
+
+    def test_balances_convert_per_currency_totals(self):
+        self.add_expense(self.alice, '30.00', {self.alice: '10.00', self.bob: '10.00', self.carol: '10.00'})
+        self.add_euro_expense(self.bob, '20.00', {self.alice: '10.00', self.bob: '10.00'})
+        import_rates([('EUR', timezone.localdate() - timedelta(days=1), Decimal('1.5'))])
+
+        # One ledger row per member and currency, converted when read
+        self.assertEqual(GroupBalance.objects.filter(user=self.bob).count(), 2)
+        balances = group_balances(self.group)
+        self.assertEqual(balances[self.alice.id], Decimal('5.00'))
+        self.assertEqual(balances[self.bob.id], Decimal('5.00'))
+        self.assertEqual(balances[self.carol.id], Decimal('-10.00'))
+        self.assertEqual(check_balances(), [])
+
+    def test_importing_rates_invalidates_converted_summaries(self):
+        self.add_euro_expense(self.bob, '20.00', {self.alice: '20.00'})
+        import_rates([('EUR', timezone.localdate() - timedelta(days=1), Decimal('1.5'))])
+        self.assertEqual(GroupSummary(self.group).balances()[self.bob.id], Decimal('30.00'))
+        version = get_versions('group', [self.group.id])[self.group.id]
+
+        # Any caller of import_rates, not just the command, bumps the groups it affects
+        with self.captureOnCommitCallbacks(execute=True):
+            import_rates([('EUR', timezone.localdate() - timedelta(days=1), Decimal('2'))])
+        self.assertGreater(get_versions('group', [self.group.id])[self.group.id], version)
+        self.assertEqual(GroupSummary(self.group).balances()[self.bob.id], Decimal('40.00'))
+        self.assertEqual(UserSummary(self.bob).balances()[self.group.id], Decimal('40.00'))
+
+    def test_a_new_day_picks_up_its_rate_without_a_bump(self):
+        today = timezone.localdate()
+        self.add_euro_expense(self.bob, '20.00', {self.alice: '20.00'})
+        import_rates([
+            ('EUR', today - timedelta(days=1), Decimal('1.5')),
+            ('EUR', today + timedelta(days=1), Decimal('2')),
+        ])
+        self.client.force_login(self.bob)
+        url = reverse('tracker:group_detail', args=[self.group.id])
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(GroupSummary(self.group).balances()[self.bob.id], Decimal('30.00'))
+
+        with mock.patch('django.utils.timezone.localdate', return_value=today + timedelta(days=1)):
+            self.assertEqual(GroupSummary(self.group).balances()[self.bob.id], Decimal('40.00'))
+            self.assertEqual(self.client.get(url, headers={'If-None-Match': etag}).status_code, 200)
+
+    def test_moving_an_expense_to_another_currency_moves_its_shares(self):
+        expense = self.add_expense(self.alice, '12.00', {self.bob: '12.00'})
+        expense.currency = 'EUR'
+        expense.save()
+        self.assertEqual(check_balances(), [])
+        self.assertEqual(
+            {row.currency: row.balance for row in GroupBalance.objects.filter(user=self.bob)},
+            {'USD': Decimal('0.00'), 'EUR': Decimal('-12.00')},
+        )
+
+    def test_read_rates_rejects_bad_lines(self):
+        rows = read_rates(io.StringIO('date,currency,rate\n2024-01-02,eur,1.09\n'))
+        self.assertEqual(rows, [('EUR', timezone.datetime(2024, 1, 2).date(), Decimal('1.09'))])
+        with self.assertRaises(RateFileError):
+            read_rates(io.StringIO('date,currency,rate\n2024-01-02,EUR,abc\n'))
+
+
+class ShareAllocationTests(TrackerTestCase):
+    def test_largest_remainder_sums_to_total(self):
+        self.assertEqual(largest_remainder(1000, [1, 1, 1]), [334, 333, 333])
+        self.assertEqual(sum(largest_remainder(1, [1] * 7)), 1)
+
+    def test_percent_and_exact_splits(self):
+        members = [self.alice, self.bob, self.carol]
+        shares = allocate_shares(Decimal('10.00'), 'percent', members,
+                                 {self.alice.id: Decimal('33.33'), self.bob.id: Decimal('33.33'),
+                                  self.carol.id: Decimal('33.34')})
+        self.assertEqual(sum(share.amount for share in shares), Decimal('10.00'))
+
+        shares = allocate_shares(Decimal('10.00'), 'exact', members,
+                                 {self.alice.id: Decimal('7.50'), self.bob.id: Decimal('2.50')})
+        self.assertEqual([(share.user, share.amount) for share in shares],
+                         [(self.alice, Decimal('7.50')), (self.bob, Decimal('2.50'))])
+
+        with self.assertRaises(SplitError):
+            allocate_shares(Decimal('10.00'), 'exact', members, {self.alice.id: Decimal('9.99')})
+        with self.assertRaises(SplitError):
+            allocate_shares(Decimal('10.00'), 'percent', members, {self.alice.id: Decimal('90')})
+
+    def test_expense_create_query_count_is_constant(self):
+        big = Group.objects.create(name='Big')
+        users = User.objects.bulk_create([User(username=f'user{i}') for i in range(200)])
+        GroupMember.objects.bulk_create([GroupMember(user=user, group=big) for user in users + [self.alice]])
+        self.client.force_login(self.alice)
+
+        with self.assertNumQueries(17):
+            response = self.client.post(reverse('tracker:expense_create', args=[big.id]), {
+                'title': 'Rent', 'amount': '1000.00', 'group': big.id, 'split_type': 'equal', 'currency': 'USD',
+            })
+        self.assertEqual(response.status_code, 302)
+        expense = Expense.objects.get(group=big)
+        self.assertEqual(expense.shares.count(), 201)
+        self.assertEqual(sum(share.amount for share in expense.shares.all()), Decimal('1000.00'))
+        self.assertEqual(check_balances(), [])
+
+
+class ExpenseImportTests(TrackerTestCase):
+    CSV = (
+        'date,title,amount,paid_by,split_between\n'
+        '2024-01-05,Groceries,30.00,bob,\n'
+        '2024-01-06,Taxi,abc,,\n'
+        '2024-01-07,Museum,20.00,,alice;carol\n'
+        '2024-01-08,Hotel,90.00,mallory,\n'
+    )
+
+    def test_bad_rows_are_reported_without_aborting(self):
+        importer = ExpenseImporter(self.group, self.alice, chunk_size=2)
+        result = importer.run(read_csv(StringIO(self.CSV)))
+
+        self.assertEqual((result.rows, result.created, result.error_count), (4, 2, 2))
+        self.assertEqual([error['line'] for error in result.errors], [3, 5])
+        museum = Expense.objects.get(title='Museum')
+        self.assertEqual(museum.date.day, 7)
+        self.assertEqual(sorted(museum.shares.values_list('user__username', flat=True)), ['alice', 'carol'])
+        self.assertEqual(check_balances(), [])
+
+    def test_ofx_debits_become_expenses(self):
+        ofx = (
+            'OFXHEADER:100\n<OFX><BANKMSGSRSV1><STMTTRNRS><STMTRS><CURDEF>EUR\n<BANKTRANLIST>\n'
+            '<STMTTRN><TRNTYPE>DEBIT<DTPOSTED>20240105120000<TRNAMT>-12.50<NAME>Bakery</STMTTRN>\n'
+            '<STMTTRN><TRNTYPE>CREDIT<DTPOSTED>20240106<TRNAMT>100.00<NAME>Salary</STMTTRN>\n'
+            '</BANKTRANLIST></STMTRS></STMTTRNRS></BANKMSGSRSV1></OFX>'
+        )
+        rows = list(read_ofx(StringIO(ofx), read_size=16))
+        self.assertEqual([row['amount'] for _, row in rows], ['12.50', '-100.00'])
+
+        result = ExpenseImporter(self.group, self.alice).run(rows)
+        self.assertEqual((result.created, result.error_count), (1, 1))
+        self.assertEqual(Expense.objects.get().currency, 'EUR')
+
+    def test_import_endpoint(self):
+        self.client.force_login(self.alice)
+        upload = SimpleUploadedFile('bank.csv', self.CSV.encode())
+        response = self.client.post(reverse('tracker:expense_import', args=[self.group.id]), {'file': upload})
+        self.assertEqual(response.json()['created'], 2)
+        self.assertIn('rows_per_second', response.json())
+
+
+class GroupExportTests(TrackerTestCase):
+    def setUp(self):
+        for i in range(5):
+            self.add_expense(self.alice, '30.00', {self.alice: '10.00', self.bob: '10.00', self.carol: '10.00'})
+        Settlement.objects.create(payer=self.bob, receiver=self.alice, amount=Decimal('10.00'), group=self.group)
+
+    def test_csv_pages_through_history(self):
+        body = b''.join(export_group(self.group, 'csv', chunk_size=2)).decode()
+        records = [line.split(',')[0] for line in body.splitlines()[1:]]
+        self.assertEqual(records.count('expense'), 5)
+        self.assertEqual(records.count('share'), 15)
+        self.assertEqual(records[-1], 'settlement')
+
+    def test_jsonl_nests_shares(self):
+        lines = b''.join(export_group(self.group, 'jsonl', chunk_size=2)).decode().splitlines()
+        first = json.loads(lines[0])
+        self.assertEqual(first['paid_by'], 'alice')
+        self.assertEqual(len(first['shares']), 3)
+        self.assertEqual(json.loads(lines[-1])['payer'], 'bob')
+
+    def test_gzipped_download(self):
+        self.client.force_login(self.bob)
+        response = self.client.get(reverse('tracker:group_export', args=[self.group.id]), {'format': 'jsonl', 'gzip': '1'})
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        body = gzip.decompress(b''.join(response.streaming_content)).decode()
+        self.assertEqual(len(body.splitlines()), 6)
+
+    async def test_asgi_download_streams_in_batches(self):
+        await self.async_client.aforce_login(self.bob)
+        response = await self.async_client.get(reverse('tracker:group_export', args=[self.group.id]), {'format': 'jsonl'})
+        self.assertTrue(response.is_async)
+        lines = b''.join([chunk async for chunk in response.streaming_content]).decode().splitlines()
+        self.assertEqual(len(lines), 6)
+
+
+class ExpenseFeedTests(TrackerTestCase):
+    def test_keyset_pages_cover_history_without_n_plus_one(self):
+        for i in range(60):
+            Expense.objects.create(title=f'Expense {i}', amount=Decimal('1.00'), paid_by=self.bob, group=self.group)
+        self.client.force_login(self.alice)
+
+        response = self.client.get(reverse('tracker:group_detail', args=[self.group.id]))
+        seen = [expense.id for expense in response.context['expenses']]
+        self.assertEqual(len(seen), 25)
+
+        next_url = reverse('tracker:group_expenses', args=[self.group.id]) + f"?cursor={response.context['next_cursor']}"
+        while next_url:
+            with self.assertNumQueries(4):
+                data = self.client.get(next_url).json()
+            seen.extend(int(pk) for pk in re.findall(r'/expenses/(\d+)/', data['html']))
+            next_url = data['next_url']
+
+        expected = list(Expense.objects.filter(group=self.group).order_by('-date', '-id').values_list('id', flat=True))
+        self.assertEqual(seen, expected)
+
+
+class QueryPlanTests(TrackerTestCase):
+    """EXPLAIN the hot query shapes so a dropped or unused index fails loudly."""
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = queryset.explain()
+        self.assertIn(index_name, plan, f'{index_name} not used:\n{plan}')
+
+    def test_hot_queries_use_indexes(self):
+        self.assertUsesIndex(Expense.objects.filter(group=self.group, paid_by=self.alice), 'expense_group_payer_idx')
+        self.assertUsesIndex(
+            Expense.objects.filter(group=self.group).order_by('-date', '-id')[:25], 'expense_group_date_idx'
+        )
+        self.assertUsesIndex(
+            ExpenseShare.objects.filter(expense__group=self.group, user=self.alice), 'share_user_expense_idx'
+        )
+        self.assertUsesIndex(
+            Notification.objects.filter(user=self.alice, is_read=False).order_by('-created_at'), 'notif_unread_idx'
+        )
+        self.assertUsesIndex(
+            Notification.objects.filter(user=self.alice).order_by('-created_at'), 'notif_user_created_idx'
+        )
+        self.assertUsesIndex(
+            Settlement.objects.filter(receiver=self.alice, status='pending'), 'settlement_receiver_status_idx'
+        )
+        self.assertUsesIndex(
+            Settlement.objects.filter(group=self.group, status='completed'), 'settlement_group_status_idx'
+        )
+
+
+class InstrumentationTests(TrackerTestCase):
+    def test_recorder_counts_queries(self):
+        with RequestRecorder() as recorder:
+            list(Group.objects.all())
+            list(User.objects.all())
+        self.assertEqual(recorder.queries, 2)
+        self.assertGreater(recorder.total_time, 0)
+
+    def test_server_timing_header(self):
+        self.client.force_login(self.alice)
+        response = self.client.get(reverse('tracker:dashboard'))
+        self.assertIn('db;dur=', response['Server-Timing'])
+        self.assertIn('tpl;dur=', response['Server-Timing'])
+
+    def test_budgets_hold_as_groups_grow(self):
+        for i in range(5):
+            group = Group.objects.create(name=f'Extra {i}')
+            for user in (self.alice, self.bob, self.carol):
+                GroupMember.objects.create(user=user, group=group)
+            self.add_expense(self.alice, '9.00', {self.alice: '3.00', self.bob: '3.00', self.carol: '3.00'}, group=group)
+        expense = self.add_expense(self.bob, '6.00', {self.alice: '3.00', self.bob: '3.00'})
+        self.client.force_login(self.alice)
+
+        # Strict mode turns any view over its @query_budget into a test failure
+        for url in [
+            reverse('tracker:dashboard'),
+            reverse('tracker:group_list'),
+            reverse('tracker:group_detail', args=[self.group.id]),
+            reverse('tracker:expense_detail', args=[expense.id]),
+            reverse('tracker:notifications'),
+        ]:
+            self.assertEqual(self.client.get(url).status_code, 200, url)
+
+    def test_exceeding_budget_fails_in_strict_mode(self):
+        self.client.force_login(self.alice)
+        with mock.patch.object(views.dashboard, 'query_budget', 1):
+            with self.assertRaises(QueryBudgetExceeded):
+                self.client.get(reverse('tracker:dashboard'))
+
+    async def test_async_views_stay_async_and_are_counted(self):
+        async def view(request):
+            return HttpResponse()
+        self.assertTrue(iscoroutinefunction(QueryInstrumentationMiddleware(view)))
+
+        await self.async_client.aforce_login(self.alice)
+        response = await self.async_client.get(reverse('tracker:group_analytics', args=[self.group.id]))
+        # Session, user, group, series and members, though the ORM ran them on another thread
+        self.assertIn('desc="5 queries"', response['Server-Timing'])
+
+
+class DatabaseProfileTests(TrackerTestCase):
+    def setUp(self):
+        super().setUp()
+        if connection.vendor != 'sqlite':
+            self.skipTest('SQLite only')
+
+    def pragma(self, name):
+        with connection.cursor() as cursor:
+            cursor.execute(f'PRAGMA {name}')
+            return cursor.fetchone()[0]
+
+    def test_sqlite_connections_are_tuned(self):
+        self.assertEqual(self.pragma('busy_timeout'), 5000)
+        self.assertEqual(self.pragma('synchronous'), 1)  # NORMAL
+
+    def test_profile_applies_on_connect(self):
+        new = connection.copy()
+        try:
+            with override_settings(SQLITE_PROFILE='default'):
+                new.ensure_connection()
+            self.assertEqual(new.connection.execute('PRAGMA synchronous').fetchone()[0], 2)  # FULL
+        finally:
+            new.close()
+
+
+class LoadGenerationTests(TrackerTestCase):
+    def test_seed_creates_consistent_data(self):
+        counts = seed(users=20, groups=4, expenses=150, settlements=20, comments=30, notifications=60)
+        self.assertEqual(counts['expenses'], 150)
+        self.assertEqual(User.objects.filter(username__startswith='load').count(), 20)
+        self.assertEqual(Notification.objects.count(), 60)
+        # Every expense is fully split and the ledger matches a recomputation
+        for amount, total in Expense.objects.annotate(total=Sum('shares__amount')).values_list('amount', 'total'):
+            self.assertEqual(Decimal(total).quantize(Decimal('0.01')), amount)
+        self.assertEqual(check_balances(), [])
+
+    def test_seed_skews_towards_first_group(self):
+        seed(users=30, groups=6, expenses=300, settlements=0, comments=0, notifications=0)
+        sizes = list(
+            Group.objects.filter(name__startswith='Load').annotate(n=Count('expense')).order_by('id')
+            .values_list('n', flat=True)
+        )
+        self.assertEqual(max(sizes), sizes[0])
+
+    def test_benchmarks_use_a_private_cache(self):
+        cache.set('live', 1)
+        with private_cache():
+            self.assertIsNone(cache.get('live'))
+            cache.set('benchmark', 1)
+        with private_cache():
+            # Each block starts empty, so cold timings need no cache.clear()
+            self.assertIsNone(cache.get('benchmark'))
+        self.assertEqual(cache.get('live'), 1)
+        self.assertIsNone(cache.get('benchmark'))
+
+
+class RollupTests(TrackerTestCase):
+    def assertRollupsMatchSource(self):
+        expected = {key: delta for key, delta in compute_spending().deltas.items() if any(delta)}
+        actual = {
+            (row.group_id, row.user_id, row.currency, row.day): [row.paid, row.expense_count, row.share]
+            for row in SpendingRollup.objects.all()
+            if row.paid or row.expense_count or row.share
+        }
+        self.assertEqual(actual, expected)
+
+    def test_rollups_follow_edits_and_deletes(self):
+        expense = self.add_expense(self.alice, '30.00', {self.alice: '10.00', self.bob: '20.00'})
+        self.add_expense(self.bob, '8.00', {self.carol: '8.00'})
+        self.assertRollupsMatchSource()
+
+        # Moving the expense to another day and currency moves its shares' rollups too
+        expense.date -= timedelta(days=40)
+        expense.currency = 'EUR'
+        expense.save()
+        self.assertRollupsMatchSource()
+
+        expense.delete()
+        self.assertRollupsMatchSource()
+
+    def test_rebuild_matches_incremental_rollups(self):
+        self.add_expense(self.alice, '12.00', {self.alice: '6.00', self.bob: '6.00'})
+        incremental = list(SpendingRollup.objects.order_by('user_id').values_list('user_id', 'paid', 'share'))
+        self.assertEqual(rebuild_rollups(), 2)
+        self.assertEqual(
+            list(SpendingRollup.objects.order_by('user_id').values_list('user_id', 'paid', 'share')), incremental
+        )
+
+    def test_transaction_summary_reads_rollups(self):
+        Transaction.objects.create(type='income', category='Salary', amount=Decimal('100.00'))
+        Transaction.objects.create(type='expense', category='Food', amount=Decimal('30.00'))
+        food = Transaction.objects.create(type='expense', category='Food', amount=Decimal('5.00'))
+        food.delete()
+        with self.assertNumQueries(1):
+            income, expenses, categories = transaction_totals()
+        self.assertEqual((income, expenses), (Decimal('100.00'), Decimal('30.00')))
+        self.assertEqual(categories, [{'category': 'Food', 'total': Decimal('30.00')}])
+
+    def test_analytics_view(self):
+        self.add_expense(self.alice, '30.00', {self.alice: '10.00', self.bob: '10.00', self.carol: '10.00'})
+        old = self.add_expense(self.bob, '9.00', {self.alice: '9.00'})
+        Expense.objects.filter(pk=old.pk).update(date=old.date - timedelta(days=70))
+        rebuild_rollups()
+        self.client.force_login(self.alice)
+        url = reverse('tracker:group_analytics', args=[self.group.id])
+
+        data = self.client.get(url, {'period': 'month'}).json()
+        self.assertEqual([Decimal(row['paid']) for row in data['series']], [Decimal('9'), Decimal('30')])
+        alice = next(row for row in data['members'] if row['user_id'] == self.alice.id)
+        self.assertEqual((Decimal(alice['paid']), Decimal(alice['share'])), (Decimal('30'), Decimal('19')))
+
+        since = (timezone.now() - timedelta(days=7)).date().isoformat()
+        data = self.client.get(url, {'period': 'week', 'since': since}).json()
+        self.assertEqual(sum(row['expenses'] for row in data['series']), 1)
+        self.assertEqual(self.client.get(url, {'period': 'year'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'since': '2024-02-30'}).status_code, 400)
+
+
+class SummaryCacheTests(TrackerTestCase):
+    @override_settings(CACHE_STATS_SAMPLE_RATE=1.0)
+    def test_repeat_page_loads_are_served_from_cache(self):
+        self.client.force_login(self.alice)
+        url = reverse('tracker:group_detail', args=[self.group.id])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.add_expense(self.alice, '30.00', {self.alice: '10.00', self.bob: '10.00', self.carol: '10.00'})
+
+        self.client.get(url)
+        self.assertEqual(cache_stats()['group']['hits'], 0)
+        # Session, user and the group itself
+        with self.assertNumQueries(3):
+            response = self.client.get(url)
+        self.assertEqual(response.context['balances'][self.alice], Decimal('20.00'))
+        self.assertEqual(cache_stats()['group'], {'hits': 3, 'misses': 3, 'hit_rate': 0.5})
+
+    @override_settings(CACHE_STATS_SAMPLE_RATE=0)
+    def test_unsampled_lookups_write_nothing(self):
+        GroupSummary(self.group).balances()
+        GroupSummary(self.group).balances()
+        self.assertEqual(cache_stats()['group'], {'hits': 0, 'misses': 0, 'hit_rate': None})
+
+    def test_member_roles_and_fragments_follow_the_shown_group(self):
+        other = Group.objects.create(name='Flat')
+        GroupMember.objects.create(user=self.bob, group=other, role='admin')
+        self.client.force_login(self.alice)
+        url = reverse('tracker:group_detail', args=[self.group.id])
+        roles = {member.username: member.role for member in self.client.get(url).context['members']}
+        self.assertEqual(roles, {'alice': 'admin', 'bob': 'member', 'carol': 'member'})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.add_expense(self.alice, '12.00', {self.alice: '6.00', self.bob: '6.00'})
+        self.assertContains(self.client.get(url), 'Dinner')
+        with self.captureOnCommitCallbacks(execute=True):
+            Expense.objects.filter(group=self.group).get().delete()
+        self.assertNotContains(self.client.get(url), 'Dinner')
+
+    def test_changes_invalidate_after_commit(self):
+        self.assertEqual(GroupSummary(self.group).balances(), {})
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.add_expense(self.bob, '9.00', {self.alice: '9.00'})
+            # Not visible until the transaction commits
+            self.assertEqual(GroupSummary(self.group).balances(), {})
+        for callback in callbacks:
+            callback()
+        self.assertEqual(GroupSummary(self.group).balances()[self.bob.id], Decimal('9.00'))
+
+    def test_per_process_cache_is_reported(self):
+        self.assertEqual([warning.id for warning in check_shared_cache(None)], ['tracker.W001'])
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache'}}):
+            self.assertEqual(check_shared_cache(None), [])
+
+    def test_membership_changes_invalidate_user_summaries(self):
+        other = Group.objects.create(name='Flat')
+        self.assertEqual([g.id for g in UserSummary(self.bob).groups()], [self.group.id])
+        version = get_versions('user', [self.bob.id])[self.bob.id]
+        with self.captureOnCommitCallbacks(execute=True):
+            GroupMember.objects.create(user=self.bob, group=other)
+        self.assertGreater(get_versions('user', [self.bob.id])[self.bob.id], version)
+        self.assertEqual({g.id for g in UserSummary(self.bob).groups()}, {self.group.id, other.id})
+
+    def test_member_previews_with_shared_members(self):
+        # alice, bob and carol all belong to Trip as well, in a different order
+        other = Group.objects.create(name='Flat')
+        dave = User.objects.create_user('dave')
+        for user in (self.carol, self.alice, dave, self.bob):
+            GroupMember.objects.create(user=user, group=other)
+        previews = {
+            group.name: [member.username for member in group.preview_members]
+            for group in UserSummary(self.alice).groups()
+        }
+        self.assertEqual(previews, {'Trip': ['alice', 'bob', 'carol'], 'Flat': ['carol', 'alice', 'dave']})
+
+
+class ConditionalGetTests(TrackerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.alice)
+
+    def test_unchanged_group_page_is_not_modified(self):
+        url = reverse('tracker:group_detail', args=[self.group.id])
+        response = self.client.get(url)
+        self.assertIn('Last-Modified', response)
+        etag = response['ETag']
+        # Only the session and user are loaded; the version comes from the cache
+        with self.assertNumQueries(2):
+            response = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.add_expense(self.bob, '9.00', {self.alice: '9.00'})
+        response = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_comments_change_the_expense_etag(self):
+        expense = self.add_expense(self.alice, '6.00', {self.alice: '3.00', self.bob: '3.00'})
+        url = reverse('tracker:expense_detail', args=[expense.id])
+        # The first response sets the CSRF cookie the tag depends on
+        self.client.get(url)
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, headers={'If-None-Match': etag}).status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Comment.objects.create(expense=expense, user=self.bob, text='Thanks!')
+        self.assertEqual(self.client.get(url, headers={'If-None-Match': etag}).status_code, 200)
+
+    def test_etag_is_per_viewer(self):
+        url = reverse('tracker:group_detail', args=[self.group.id])
+        etag = self.client.get(url)['ETag']
+        self.client.force_login(self.bob)
+        self.assertEqual(self.client.get(url, headers={'If-None-Match': etag}).status_code, 200)
+
+    def test_pages_must_be_revalidated_and_show_queued_messages(self):
+        url = reverse('tracker:group_detail', args=[self.group.id])
+        response = self.client.get(url)
+        self.assertEqual(set(response['Cache-Control'].split(', ')), {'private', 'no-cache'})
+        etag = response['ETag']
+        self.assertEqual(self.client.get(url, headers={'If-None-Match': etag}).status_code, 304)
+
+        # Nothing to settle: the redirect back carries a message the 304 would hide
+        response = self.client.post(
+            reverse('tracker:settle_up', args=[self.group.id]), headers={'If-None-Match': etag}, follow=True
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'already settled up')
+        self.assertEqual(self.client.get(url, headers={'If-None-Match': etag}).status_code, 304)
+
+    def test_non_members_get_no_validators(self):
+        expense = self.add_expense(self.alice, '6.00', {self.alice: '3.00', self.bob: '3.00'})
+        outsider = User.objects.create_user('dave', 'dave@example.com', 'pw')
+        self.client.force_login(outsider)
+        for url in [
+            reverse('tracker:group_detail', args=[self.group.id]),
+            reverse('tracker:expense_detail', args=[expense.id]),
+        ]:
+            response = self.client.get(url, headers={
+                'If-None-Match': '*', 'If-Modified-Since': 'Fri, 01 Jan 2100 00:00:00 GMT',
+            })
+            self.assertIn(response.status_code, (302, 404))
+            self.assertNotIn('ETag', response)
+            self.assertNotIn('Last-Modified', response)
+
+
+class ApiTests(TrackerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.alice)
+        self.outsider = User.objects.create_user('dave', 'dave@example.com', 'pw')
+        self.private = Group.objects.create(name='Private')
+        GroupMember.objects.create(user=self.outsider, group=self.private)
+        for i in range(5):
+            self.add_expense(self.alice, '9.00', {self.alice: '3.00', self.bob: '3.00', self.carol: '3.00'})
+        self.add_expense(self.outsider, '4.00', {self.outsider: '4.00'}, group=self.private)
+
+    def get(self, name, queries, **params):
+        with self.assertNumQueries(queries):
+            response = self.client.get(reverse(f'v1:{name}'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_expenses_embed_shares_without_n_plus_one(self):
+        # Session, user, the page, and one prefetch for every share on it
+        data = self.get('expense-list', 4, embed='shares')
+        self.assertEqual(len(data['results']), 5)
+        self.assertEqual(len(data['results'][0]['shares']), 3)
+        self.assertEqual(data['results'][0]['paid_by'], {'id': self.alice.id, 'username': 'alice'})
+
+        data = self.get('expense-list', 3)
+        self.assertNotIn('shares', data['results'][0])
+
+    def test_sparse_fieldsets(self):
+        data = self.get('expense-list', 3, fields='id,amount')
+        self.assertEqual(set(data['results'][0]), {'id', 'amount'})
+
+    def test_cursor_pagination_walks_every_row_once(self):
+        seen = []
+        data = self.get('expense-list', 3, page_size=2)
+        while True:
+            seen += [row['id'] for row in data['results']]
+            if not data['next']:
+                break
+            with self.assertNumQueries(3):
+                data = self.client.get(data['next']).json()
+        self.assertEqual(sorted(seen), sorted(Expense.objects.filter(group=self.group).values_list('id', flat=True)))
+
+    def test_endpoints_only_show_visible_rows(self):
+        groups = self.get('group-list', 4, embed='members')['results']
+        self.assertEqual([group['id'] for group in groups], [self.group.id])
+        self.assertEqual(groups[0]['member_count'], 3)
+        self.assertEqual([member['username'] for member in groups[0]['members']], ['alice', 'bob', 'carol'])
+        self.assertEqual(len(self.get('share-list', 3)['results']), 15)
+        self.assertEqual(self.get('settlement-list', 3)['results'], [])
+        self.assertEqual(self.get('comment-list', 3)['results'], [])
+        self.assertEqual(self.get('notification-list', 3)['results'], [])
+        with self.assertNumQueries(3):
+            self.assertEqual(self.client.get(reverse('v1:group-detail', args=[self.private.id])).status_code, 404)
+
+    def test_filters(self):
+        expense = Expense.objects.filter(group=self.group).first()
+        # The filter looks the expense up once to validate it
+        data = self.get('share-list', 4, expense=expense.id)
+        self.assertEqual({row['expense'] for row in data['results']}, {expense.id})
+
+    def test_requires_login(self):
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse('v1:expense-list')).status_code, 403)
+
+
+class SearchTests(TrackerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.alice)
+
+    def search(self, query, **params):
+        return self.client.get(reverse('tracker:search'), {'q': query, **params}).json()
+
+    def found(self, query):
+        return [(result['kind'], result['id']) for result in self.search(query)['results']]
+
+    def test_results_are_ranked_and_scoped_to_members(self):
+        described = Expense.objects.create(
+            title='Groceries', description='Pizza night supplies', amount=Decimal('5.00'), paid_by=self.bob, group=self.group
+        )
+        titled = Expense.objects.create(title='Pizza', amount=Decimal('5.00'), paid_by=self.bob, group=self.group)
+        other = Group.objects.create(name='Pizza club')
+        Expense.objects.create(title='Pizza', amount=Decimal('5.00'), paid_by=self.bob, group=other)
+
+        self.assertEqual(self.found('pizz'), [('expense', titled.id), ('expense', described.id)])
+        GroupMember.objects.create(user=self.alice, group=other)
+        self.assertIn(('group', other.id), self.found('pizza club'))
+
+    def test_index_follows_edits_comments_and_deletes(self):
+        expense = self.add_expense(self.alice, '30.00', {self.alice: '30.00'})
+        comment = Comment.objects.create(expense=expense, user=self.bob, text='Who ordered the lobster?')
+        self.assertEqual(self.found('lobster'), [('comment', comment.id)])
+        self.assertEqual(self.search('lobster')['results'][0]['url'], reverse('tracker:expense_detail', args=[expense.id]))
+
+        expense.title = 'Seafood dinner'
+        expense.save()
+        self.assertEqual(self.found('seafood'), [('expense', expense.id)])
+
+        # Moving the expense out of alice's groups takes its comments with it
+        expense.group = Group.objects.create(name='Elsewhere')
+        expense.save()
+        self.assertEqual(self.found('lobster'), [])
+        expense.delete()
+        self.assertEqual(self.found('seafood'), [])
+
+    def test_pages_and_query_budget(self):
+        for i in range(25):
+            Expense.objects.create(title=f'Taxi {i}', amount=Decimal('1.00'), paid_by=self.bob, group=self.group)
+        self.search('taxi')  # warm up the session
+        with self.assertNumQueries(3):
+            first = self.search('taxi')
+        self.assertEqual(len(first['results']), 20)
+        second = self.search('taxi', page=first['next_page'])
+        self.assertEqual((len(second['results']), second['next_page']), (5, None))
+        self.assertEqual(self.search('!!')['results'], [])
+
+    def test_rebuild_matches_signal_maintained_index(self):
+        self.add_expense(self.alice, '30.00', {self.alice: '30.00'})
+        found = self.found('dinner')
+        self.assertEqual(rebuild_index(), 1 + Group.objects.count())
+        self.assertEqual(self.found('dinner'), found)
+
+
+class AdminTests(TrackerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'pw'))
+
+    def changelist_queries(self, model_name):
+        url = reverse(f'admin:tracker_{model_name}_changelist')
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response, len(queries)
+
+    def test_changelist_queries_do_not_grow_with_rows(self):
+        self.add_expense(self.alice, '30.00', {self.alice: '15.00', self.bob: '15.00'})
+        before = {name: self.changelist_queries(name)[1] for name in ('group', 'expenseshare', 'settlement')}
+        for i in range(5):
+            group = Group.objects.create(name=f'Group {i}')
+            GroupMember.objects.create(user=self.carol, group=group)
+            self.add_expense(self.bob, '10.00', {self.alice: '5.00', self.carol: '5.00'}, group=group)
+            Settlement.objects.create(payer=self.alice, receiver=self.bob, amount=Decimal('5.00'), group=group)
+        after = {name: self.changelist_queries(name)[1] for name in ('group', 'expenseshare', 'settlement')}
+        self.assertEqual(after, before)
+
+        response, _ = self.changelist_queries('group')
+        counts = {group.name: group.member_count for group in response.context['cl'].result_list}
+        self.assertEqual(counts['Trip'], 3)
+
+    def test_large_unfiltered_changelists_are_estimated(self):
+        for i in range(3):
+            Expense.objects.create(title=f'Expense {i}', amount=Decimal('1.00'), paid_by=self.bob, group=self.group)
+        last = Expense.objects.order_by('-pk').first().pk
+        Expense.objects.filter(title='Expense 0').delete()
+        with mock.patch.object(EstimatedCountPaginator, 'threshold', 0):
+            self.assertEqual(EstimatedCountPaginator(Expense.objects.order_by('-pk'), 10).count, last)
+            self.assertEqual(EstimatedCountPaginator(Expense.objects.filter(paid_by=self.bob).order_by('-pk'), 10).count, 2)
+
+
+class UnreadCounterTests(TrackerTestCase):
+    def notify(self, user, **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Notification.objects.create(user=user, type='expense_added', content='New expense', **kwargs)
+
+    def test_counter_follows_creates_reads_and_deletes(self):
+        self.assertEqual(unread_count(self.alice.id), 0)
+        first = self.notify(self.alice)
+        self.notify(self.alice)
+        self.notify(self.alice, is_read=True)
+        with self.assertNumQueries(0):
+            self.assertEqual(unread_count(self.alice.id), 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.is_read = True
+            first.save()
+        self.assertEqual(cache.get(unread_key(self.alice.id)), 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            Notification.objects.filter(user=self.alice, is_read=False).get().delete()
+        self.assertEqual(cache.get(unread_key(self.alice.id)), 0)
+
+    def test_bulk_helpers_keep_counter_in_step(self):
+        unread_count(self.bob.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            create_notifications([
+                Notification(user=self.bob, type='expense_added', content=str(i)) for i in range(3)
+            ])
+        self.assertEqual(unread_count(self.bob.id), 3)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(mark_read(self.bob), 3)
+        self.assertEqual(unread_count(self.bob.id), 0)
+
+    def test_non_atomic_cache_recounts_instead_of_incrementing(self):
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location, ignore_errors=True)
+        file_cache = {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': location}
+        with override_settings(CACHES={'default': file_cache}):
+            self.assertFalse(atomic_counters())
+            self.assertEqual(unread_count(self.bob.id), 0)
+            with mock.patch.object(cache, 'incr', side_effect=AssertionError('get-then-set incr')):
+                first = self.notify(self.bob)
+                self.notify(self.bob)
+            self.assertEqual(cache.get(unread_key(self.bob.id)), 2)
+            with self.captureOnCommitCallbacks(execute=True):
+                first.is_read = True
+                first.save()
+            self.assertEqual(unread_count(self.bob.id), 1)
+        self.assertTrue(atomic_counters())
+
+    def test_badge_comes_from_context_processor(self):
+        self.notify(self.alice)
+        self.client.force_login(self.alice)
+        response = self.client.get(reverse('tracker:group_list'))
+        self.assertEqual(response.context['unread_count'], 1)
+
+    def test_mark_read_view_updates_counter(self):
+        notification = self.notify(self.alice)
+        self.notify(self.alice)
+        self.client.force_login(self.alice)
+        # Outside tests the save autocommits before the count is read back
+        with mock.patch('django.db.transaction.on_commit', lambda callback: callback()):
+            response = self.client.post(reverse('tracker:notifications'), {'notification_id': notification.id})
+        self.assertEqual(response.json()['unread_count'], 1)
+
+    def test_changes_are_pushed(self):
+        with mock.patch('tracker.notifications.push_unread_count') as push:
+            self.notify(self.carol)
+        push.assert_called_once_with(self.carol.id, 1)
+
+    async def test_consumer_relays_count(self):
+        cache.set(unread_key(self.alice.id), 4)
+        communicator = WebsocketCommunicator(NotificationConsumer.as_asgi(), '/ws/notifications/')
+        communicator.scope['user'] = self.alice
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        self.assertEqual(await communicator.receive_json_from(), {'type': 'unread', 'count': 4})
+
+        await get_channel_layer().group_send(user_channel_group(self.alice.id), {'type': 'unread.count', 'count': 5})
+        self.assertEqual(await communicator.receive_json_from(), {'type': 'unread', 'count': 5})
+        await communicator.disconnect()
+
+
+class GroupActivityTests(TrackerTestCase):
+    def connect(self, user):
+        communicator = WebsocketCommunicator(GroupActivityConsumer.as_asgi(), f'/ws/groups/{self.group.id}/')
+        communicator.scope['user'] = user
+        communicator.scope['url_route'] = {'kwargs': {'group_id': self.group.id}}
+        return communicator
+
+    def test_changes_are_broadcast_after_commit(self):
+        with mock.patch('tracker.activity._send') as send:
+            with self.captureOnCommitCallbacks(execute=True):
+                expense = self.add_expense(self.alice, '30.00', {self.alice: '15.00', self.bob: '15.00'})
+                Comment.objects.create(expense=expense, user=self.bob, text='Thanks')
+                self.assertFalse(send.called)
+        events = [(group_id, event['kind'], event['action']) for (group_id, event), _ in send.call_args_list]
+        self.assertEqual(events, [(self.group.id, 'expense', 'created'), (self.group.id, 'comment', 'created')])
+
+    def test_settle_up_sends_one_event(self):
+        self.add_expense(self.alice, '30.00', {self.bob: '15.00', self.carol: '15.00'})
+        self.client.force_login(self.bob)
+        with mock.patch('tracker.activity._send') as send:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(reverse('tracker:settle_up', args=[self.group.id]))
+        send.assert_called_once_with(self.group.id, {'kind': 'settlement', 'action': 'created', 'count': 2})
+
+    async def test_consumer_relays_group_events(self):
+        communicator = self.connect(self.bob)
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        await get_channel_layer().group_send(group_channel_group(self.group.id), {
+            'type': 'group.activity', 'event': {'kind': 'comment', 'action': 'created', 'id': 1},
+        })
+        self.assertEqual(
+            await communicator.receive_json_from(), {'type': 'activity', 'kind': 'comment', 'action': 'created', 'id': 1}
+        )
+        await communicator.disconnect()
+
+    async def test_non_members_are_rejected(self):
+        outsider = await User.objects.acreate(username='dave')
+        connected, _ = await self.connect(outsider).connect()
+        self.assertFalse(connected)
+
+
+class NotificationDispatchTests(TrackerTestCase):
+    def test_expense_create_queues_instead_of_notifying(self):
+        self.client.force_login(self.alice)
+        self.client.post(reverse('tracker:expense_create', args=[self.group.id]), {
+            'title': 'Taxi', 'amount': '30.00', 'currency': 'USD', 'split_type': 'equal',
+            'date': '2024-05-01 10:00',
+        })
+        self.assertEqual(Notification.objects.count(), 0)
+
+        # Still inside the coalescing window
+        self.assertEqual(process_events(), (0, 0))
+        self.assertEqual(process_events(now=timezone.now() + timedelta(minutes=2)), (1, 2))
+        self.assertEqual(
+            sorted(Notification.objects.values_list('user__username', flat=True)), ['bob', 'carol']
+        )
+
+    def test_burst_of_expenses_coalesces_per_member(self):
+        for i in range(10):
+            enqueue('expense_added', f'Expense {i}', actor=self.alice, group=self.group)
+        enqueue('expense_added', 'From bob', actor=self.bob, group=self.group)
+        with self.assertNumQueries(7):
+            self.assertEqual(process_events(window=0), (11, 3))
+
+        contents = dict(Notification.objects.values_list('user__username', 'content'))
+        self.assertEqual(contents['bob'], '10 new expenses were added in Trip')
+        self.assertEqual(contents['carol'], '11 new expenses were added in Trip')
+        self.assertEqual(contents['alice'], 'From bob')
+        self.assertEqual(process_events(window=0), (0, 0))
+
+    def test_direct_events_are_not_delayed(self):
+        settlement = Settlement.objects.create(payer=self.bob, receiver=self.alice, amount=Decimal('5.00'), group=self.group)
+        enqueue('settlement_request', 'Pay up', actor=self.bob, recipient=self.alice, group=self.group, settlement=settlement)
+        self.assertEqual(process_events(), (1, 1))
+        self.assertEqual(Notification.objects.get().related_settlement, settlement)
+
+    @override_settings(NOTIFICATIONS_EAGER=True)
+    def test_eager_mode_delivers_on_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            enqueue('expense_added', 'Lunch', actor=self.alice, group=self.group)
+        self.assertEqual(Notification.objects.count(), 2)
+
+
+class NotificationRetentionTests(TrackerTestCase):
+    def make(self, user, count, days_old, is_read=False, type='expense_added'):
+        rows = Notification.objects.bulk_create([
+            Notification(user=user, type=type, content='Old news', is_read=is_read) for _ in range(count)
+        ])
+        Notification.objects.filter(id__in=[row.id for row in rows]).update(
+            created_at=timezone.now() - timedelta(days=days_old)
+        )
+
+    def test_purge_deletes_only_expired_read_rows_in_batches(self):
+        self.make(self.alice, 5, days_old=100, is_read=True)
+        self.make(self.alice, 2, days_old=100)
+        self.make(self.alice, 3, days_old=10, is_read=True)
+        self.assertEqual(purge_read(timezone.now() - timedelta(days=90), batch_size=2), 5)
+        self.assertEqual(Notification.objects.count(), 5)
+
+    def test_digest_collapses_old_unread_and_keeps_counter(self):
+        self.make(self.alice, 4, days_old=40)
+        self.make(self.alice, 1, days_old=40, type='settlement_request')
+        self.make(self.alice, 2, days_old=1)
+        self.make(self.bob, 3, days_old=40, is_read=True)
+        self.assertEqual(unread_count(self.alice.id), 7)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(digest_unread(timezone.now() - timedelta(days=30), batch_size=2), (1, 5))
+        digest = Notification.objects.get(type='digest')
+        self.assertEqual(digest.user, self.alice)
+        self.assertIn('5 older unread notifications', digest.content)
+        self.assertEqual(unread_count(self.alice.id), 3)
+        self.assertEqual(cache.get(unread_key(self.alice.id)), Notification.objects.filter(
+            user=self.alice, is_read=False).count())
+
+        # Later on the digest stays, the recent unread rows get their own and bob's read rows expire
+        self.assertEqual(apply_retention(now=timezone.now() + timedelta(days=60)), {
+            'digests': 1, 'collapsed': 2, 'deleted': 3,
+        })
+        self.assertEqual(Notification.objects.filter(type='digest').count(), 2)
+
+    def test_notifications_view_is_paginated(self):
+        self.make(self.alice, views.NOTIFICATION_PAGE_SIZE + 5, days_old=1)
+        self.client.force_login(self.alice)
+        first = self.client.get(reverse('tracker:notifications'))
+        self.assertEqual(len(first.context['notifications']), views.NOTIFICATION_PAGE_SIZE)
+        second = self.client.get(reverse('tracker:notifications'), {'cursor': first.context['next_cursor']})
+        self.assertEqual(len(second.context['notifications']), 5)
+        self.assertIsNone(second.context['next_cursor'])
+
+
+@mock.patch('django.db.transaction.on_commit', lambda callback: callback())
+class NotificationActionTests(TrackerTestCase):
+    def setUp(self):
+        super().setUp()
+        rows = Notification.objects.bulk_create([
+            Notification(user=self.alice, type='expense_added', content=str(i)) for i in range(6)
+        ])
+        for days, row in enumerate(rows):
+            Notification.objects.filter(id=row.id).update(created_at=timezone.now() - timedelta(days=days))
+        self.rows = rows
+        Notification.objects.create(user=self.bob, type='expense_added', content='Not yours')
+        self.client.force_login(self.alice)
+
+    def act(self, **data):
+        return self.client.post(reverse('tracker:notification_actions'), data)
+
+    def test_mark_listed_ids_ignores_other_users(self):
+        bobs = Notification.objects.get(user=self.bob)
+        with self.assertNumQueries(4):
+            response = self.act(action='mark_read', ids=f'{self.rows[0].id},{self.rows[1].id},{bobs.id}')
+        self.assertEqual(response.json(), {'action': 'mark_read', 'updated': 2, 'unread_count': 4})
+        self.assertFalse(Notification.objects.get(id=bobs.id).is_read)
+
+    def test_mark_read_before_timestamp(self):
+        before = (timezone.now() - timedelta(days=2, hours=12)).isoformat()
+        response = self.act(action='mark_read_before', before=before)
+        self.assertEqual(response.json()['updated'], 3)
+        self.assertEqual(response.json()['unread_count'], 3)
+
+    def test_mark_all_then_counter_is_zero(self):
+        self.assertEqual(self.act(action='mark_all_read').json()['unread_count'], 0)
+        self.assertEqual(unread_count(self.bob.id), 1)
+
+    def test_bad_requests(self):
+        self.assertEqual(self.act(action='mark_read_before', before='yesterday').status_code, 400)
+        self.assertEqual(self.act(action='mark_read', ids='x').status_code, 400)
+        self.assertEqual(self.act(action='explode').status_code, 400)
+        self.assertEqual(self.client.get(reverse('tracker:notification_actions')).status_code, 405)
+
+
+class MediaTestCase(TrackerTestCase):
+    def setUp(self):
+        super().setUp()
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+
+class ReceiptProcessingTests(MediaTestCase):
+
+    def photo(self, size=(3000, 1200), orientation=6):
+        image = Image.new('RGB', size, 'white')
+        exif = Image.Exif()
+        exif[0x0112] = orientation
+        exif[0x010F] = 'PhoneCo'
+        buffer = io.BytesIO()
+        image.save(buffer, 'JPEG', exif=exif, quality=95)
+        return SimpleUploadedFile('IMG_0001.jpg', buffer.getvalue(), content_type='image/jpeg')
+
+    def test_worker_rotates_strips_and_thumbnails(self):
+        expense = self.add_expense(self.alice, '12.00', {self.alice: '6.00', self.bob: '6.00'})
+        expense.receipt = self.photo()
+        expense.save()
+        original = expense.receipt.name
+
+        self.assertEqual(process_pending(), (1, 0))
+        expense.refresh_from_db()
+        self.assertIsNotNone(expense.receipt_processed_at)
+        # The raw upload is released; gc_blobs removes the bytes later
+        self.assertEqual(StoredBlob.objects.get(name=original).refcount, 0)
+        with Image.open(expense.receipt.path) as full:
+            # Orientation 6 means the pixels were stored sideways
+            self.assertEqual(full.size, (800, 2000))
+            self.assertNotIn(0x010F, full.getexif())
+        with Image.open(expense.receipt_thumbnail.path) as thumb:
+            self.assertLessEqual(max(thumb.size), max(THUMBNAIL_SIZE))
+        self.assertEqual(process_pending(), (0, 0))
+
+        self.client.force_login(self.alice)
+        response = self.client.get(reverse('tracker:expense_detail', args=[expense.id]))
+        self.assertContains(response, expense.receipt_thumbnail.url)
+
+    def test_unreadable_upload_is_not_retried(self):
+        expense = self.add_expense(self.alice, '12.00', {self.alice: '12.00'})
+        expense.receipt = SimpleUploadedFile('scan.jpg', b'not an image')
+        expense.save()
+        self.assertEqual(process_pending(), (0, 1))
+        self.assertEqual(process_pending(), (0, 0))
+
+
+class BlobStorageTests(MediaTestCase):
+    def attach(self, expense, data, name='receipt.jpg'):
+        expense.receipt = SimpleUploadedFile(name, data)
+        expense.save()
+        return expense.receipt.name
+
+    def test_identical_uploads_share_one_blob(self):
+        first = self.add_expense(self.alice, '5.00', {self.alice: '5.00'})
+        second = self.add_expense(self.bob, '7.00', {self.bob: '7.00'})
+        name = self.attach(first, b'same bytes')
+        self.assertEqual(self.attach(second, b'same bytes', name='IMG_2.JPG'), name)
+        self.assertTrue(name.startswith(PREFIX))
+
+        blob = StoredBlob.objects.get()
+        self.assertEqual((blob.name, blob.refcount, blob.size), (name, 2, 10))
+        with first.receipt.open('rb') as file:
+            self.assertEqual(file.read(), b'same bytes')
+
+    def test_deletes_release_references_and_gc_removes_bytes(self):
+        first = self.add_expense(self.alice, '5.00', {self.alice: '5.00'})
+        second = self.add_expense(self.bob, '7.00', {self.bob: '7.00'})
+        name = self.attach(first, b'receipt')
+        self.attach(second, b'receipt')
+        storage = first.receipt.storage
+
+        first.delete()
+        self.assertEqual(StoredBlob.objects.get().refcount, 1)
+        self.assertEqual(collect_garbage(now=timezone.now() + timedelta(days=1)), (0, 0))
+
+        second.delete()
+        # Still within the grace period
+        self.assertEqual(collect_garbage(), (0, 0))
+        self.assertEqual(collect_garbage(now=timezone.now() + timedelta(days=1)), (1, 7))
+        self.assertFalse(storage.exists(name))
+
+    def test_replaced_files_are_released_after_commit(self):
+        expense = self.add_expense(self.alice, '5.00', {self.alice: '5.00'})
+        first = self.attach(expense, b'first')
+        expense.receipt_thumbnail = SimpleUploadedFile('receipt_thumb.jpg', b'thumb')
+        expense.receipt_processed_at = timezone.now()
+        expense.save()
+        thumbnail = expense.receipt_thumbnail.name
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            second = self.attach(expense, b'second')
+        # Nothing is released until the new name is committed
+        self.assertEqual(StoredBlob.objects.get(name=first).refcount, 1)
+        for callback in callbacks:
+            callback()
+        refcounts = dict(StoredBlob.objects.values_list('name', 'refcount'))
+        self.assertEqual(refcounts, {first: 0, thumbnail: 0, second: 1})
+        # The old thumbnail went with the old receipt, and the new receipt waits for the worker
+        expense.refresh_from_db()
+        self.assertFalse(expense.receipt_thumbnail)
+        self.assertIsNone(expense.receipt_processed_at)
+
+        self.group.cover_photo = SimpleUploadedFile('cover.jpg', b'cover')
+        self.group.save()
+        cover = self.group.cover_photo.name
+        with self.captureOnCommitCallbacks(execute=True):
+            self.group.cover_photo = ''
+            self.group.save()
+        self.assertEqual(StoredBlob.objects.get(name=cover).refcount, 0)
+        self.assertEqual(recount_references(), 0)
+
+    def test_recount_repairs_drift(self):
+        expense = self.add_expense(self.alice, '5.00', {self.alice: '5.00'})
+        self.attach(expense, b'receipt')
+        StoredBlob.objects.update(refcount=5)
+        self.assertEqual(recount_references(), 1)
+        self.assertEqual(StoredBlob.objects.get().refcount, 1)
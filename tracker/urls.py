@@ -8,10 +8,18 @@ urlpatterns = [
     path('groups/', views.group_list, name='group_list'),
     path('groups/create/', views.group_create, name='group_create'),
     path('groups/<int:group_id>/', views.group_detail, name='group_detail'),
+    path('groups/<int:group_id>/expenses/', views.group_expenses, name='group_expenses'),
+    path('groups/<int:group_id>/export/', views.group_export, name='group_export'),
+    path('groups/<int:group_id>/analytics/', views.group_analytics, name='group_analytics'),
     path('groups/<int:group_id>/expenses/create/', views.expense_create, name='expense_create'),
+    path('groups/<int:group_id>/expenses/import/', views.expense_import, name='expense_import'),
     path('expenses/<int:expense_id>/', views.expense_detail, name='expense_detail'),
     path('expenses/<int:expense_id>/delete/', views.expense_delete, name='expense_delete'),
     path('groups/<int:group_id>/settlements/create/', views.settlement_create, name='settlement_create'),
+    path('groups/<int:group_id>/settle-up/', views.settle_up, name='settle_up'),
+    path('groups/<int:group_id>/settle-up/plan/', views.settle_up_plan, name='settle_up_plan'),
     path('settlements/<int:settlement_id>/approve/', views.settlement_approve, name='settlement_approve'),
+    path('search/', views.search, name='search'),
     path('notifications/', views.notifications, name='notifications'),
+    path('notifications/actions/', views.notification_actions, name='notification_actions'),
 ] 
\ No newline at end of file
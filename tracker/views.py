@@ -1,10 +1,43 @@
+import functools
+import hashlib
+import io
+from datetime import datetime, timezone as dt_timezone
+
+from asgiref.sync import sync_to_async
 from django.shortcuts import render, redirect, get_object_or_404
+from django.template.loader import render_to_string
+from django.urls import reverse
 from django.contrib.auth.decorators import login_required
+from django.contrib.auth.views import redirect_to_login
+from django.core.handlers.asgi import ASGIRequest
 from django.contrib import messages
-from django.db.models import Sum, Q
-from django.http import JsonResponse
-from .models import Group, GroupMember, Expense, ExpenseShare, Settlement, Comment, Notification
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition, require_POST
+from .models import Group, GroupMember, Expense, ExpenseShare, Settlement, Comment, Notification, NotificationEvent
 from .forms import GroupForm, ExpenseForm, ExpenseShareForm, SettlementForm, CommentForm
+from .activity import broadcast
+from .balances import ZERO, group_balances
+from .batching import batched_writes
+from .currency import conversion_key
+from .caching import GroupSummary, UserSummary, annotate_versions, bump_groups, get_versions
+from .settle_up import simplify_debts
+from .splits import create_shares
+from .importers import ExpenseImporter, read_csv, read_ofx
+from .exporters import FORMATS as EXPORT_FORMATS, aiter_chunks, export_group
+from .pagination import akeyset_page, keyset_page
+from .rollups import PERIODS, member_breakdown, spending_series, transaction_totals
+from .instrumentation import query_budget
+from .search import search as search_index
+from .notifications import enqueue, enqueue_many, mark_read, unread_count
+
+EXPENSE_PAGE_SIZE = 25
+NOTIFICATION_PAGE_SIZE = 50
+SEARCH_PAGE_SIZE = 20
 
 # Create your views here.
 
@@ -26,10 +59,9 @@ def transaction_list(request):
 
 # Summary View
 def summary(request):
-    income = Transaction.objects.filter(type='income').aggregate(total=Sum('amount'))['total'] or 0
-    expenses = Transaction.objects.filter(type='expense').aggregate(total=Sum('amount'))['total'] or 0
+    # One query over the daily rollups instead of three scans of the transaction table
+    income, expenses, category_summary = transaction_totals()
     balance = income - expenses
-    category_summary = Transaction.objects.filter(type='expense').values('category').annotate(total=Sum('amount')).order_by('-total')
     return render(request, 'tracker/summary.html', {
         'income': income,
         'expenses': expenses,
@@ -38,36 +70,31 @@ def summary(request):
     })
 
 @login_required
+@query_budget(8)
 def dashboard(request):
-    user_groups = Group.objects.filter(members=request.user)
-    recent_expenses = Expense.objects.filter(
-        Q(group__in=user_groups) | Q(paid_by=request.user)
-    ).order_by('-date')[:5]
-    
-    # Get user's balances
-    balances = {}
-    for group in user_groups:
-        paid = Expense.objects.filter(group=group, paid_by=request.user).aggregate(total=Sum('amount'))['total'] or 0
-        owed = ExpenseShare.objects.filter(expense__group=group, user=request.user).aggregate(total=Sum('amount'))['total'] or 0
-        balances[group] = paid - owed
+    summary = UserSummary(request.user)
+    user_groups = summary.groups()
+    
+    # Get user's balances from the ledger
+    ledger = summary.balances()
+    balances = {group: ledger.get(group.id, ZERO) for group in user_groups}
     
     context = {
         'user_groups': user_groups,
-        'recent_expenses': recent_expenses,
+        'recent_expenses': summary.recent_expenses(),
         'balances': balances,
     }
     return render(request, 'tracker/dashboard.html', context)
 
 @login_required
+@query_budget(7)
 def group_list(request):
-    groups = Group.objects.filter(members=request.user)
+    summary = UserSummary(request.user)
+    groups = summary.groups()
     
-    # Calculate balances for each group
-    balances = {}
-    for group in groups:
-        paid = Expense.objects.filter(group=group, paid_by=request.user).aggregate(total=Sum('amount'))['total'] or 0
-        owed = ExpenseShare.objects.filter(expense__group=group, user=request.user).aggregate(total=Sum('amount'))['total'] or 0
-        balances[group] = paid - owed
+    # Look up the user's balance in each group from the ledger
+    ledger = summary.balances()
+    balances = {group: ledger.get(group.id, ZERO) for group in groups}
     
     context = {
         'groups': groups,
@@ -75,27 +102,165 @@ def group_list(request):
     }
     return render(request, 'tracker/group_list.html', context)
 
+def _page_version(request, kind, obj_id):
+    # Looked up once per request and shared by the ETag and Last-Modified callbacks
+    if not hasattr(request, '_page_version'):
+        request._page_version = get_versions(kind, [obj_id])[obj_id]
+    return request._page_version
+
+def _page_visible(request, kind, obj_id):
+    # Non-members get no validators, so a 304 can't reveal that the page exists or when it changed
+    if not hasattr(request, '_page_visible'):
+        if kind == 'expense':
+            visible = Expense.objects.filter(id=obj_id, group__members=request.user).exists()
+        else:
+            visible = obj_id in UserSummary(request.user).group_ids
+        request._page_visible = visible
+    return request._page_visible
+
+def _page_validated(request, kind, obj_id):
+    # A flash message queued before a redirect here must be shown, not swallowed by a 304
+    return _page_visible(request, kind, obj_id) and not len(messages.get_messages(request))
+
+def _page_etag(request, kind, obj_id):
+    if not _page_validated(request, kind, obj_id):
+        return None
+    # The page also shows the viewer's unread badge, totals converted at today's rates and their CSRF token
+    csrf = hashlib.md5(request.META.get('CSRF_COOKIE', '').encode()).hexdigest()[:8]
+    version = _page_version(request, kind, obj_id)
+    return f'{kind}-{obj_id}-{version}-{conversion_key()}-{request.user.id}-{unread_count(request.user.id)}-{csrf}'
+
+def _page_last_modified(request, kind, obj_id):
+    if not _page_validated(request, kind, obj_id):
+        return None
+    return datetime.fromtimestamp(_page_version(request, kind, obj_id) / 1000, tz=dt_timezone.utc)
+
+def _group_etag(request, group_id):
+    return _page_etag(request, 'group', group_id)
+
+def _group_last_modified(request, group_id):
+    return _page_last_modified(request, 'group', group_id)
+
+def _expense_etag(request, expense_id):
+    return _page_etag(request, 'expense', expense_id)
+
+def _expense_last_modified(request, expense_id):
+    return _page_last_modified(request, 'expense', expense_id)
+
 @login_required
+@query_budget(12)
+# Per-user pages: browsers and proxies must revalidate instead of reusing them
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=_group_etag, last_modified_func=_group_last_modified)
 def group_detail(request, group_id):
     group = get_object_or_404(Group, id=group_id, members=request.user)
-    expenses = Expense.objects.filter(group=group).order_by('-date')
-    members = group.members.all()
+    summary = GroupSummary(group)
+    expenses, next_cursor = summary.recent_expenses(EXPENSE_PAGE_SIZE)
+    annotate_versions('expense', expenses)
+    members = summary.roster()
     
-    # Calculate balances for each member
-    balances = {}
-    for member in members:
-        paid = Expense.objects.filter(group=group, paid_by=member).aggregate(total=Sum('amount'))['total'] or 0
-        owed = ExpenseShare.objects.filter(expense__group=group, user=member).aggregate(total=Sum('amount'))['total'] or 0
-        balances[member] = paid - owed
+    # Look up each member's balance from the ledger
+    ledger = summary.balances()
+    balances = {member: ledger.get(member.id, ZERO) for member in members}
     
     context = {
         'group': group,
         'expenses': expenses,
+        'next_cursor': next_cursor,
         'members': members,
         'balances': balances,
+        # Fragment cache keys for the expense feed and member list
+        'group_version': summary.version,
     }
     return render(request, 'tracker/group_detail.html', context)
 
+def async_login_required(view):
+    # login_required only wraps sync views in Django 5.0
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        user = await request.auser()
+        if not user.is_authenticated:
+            return redirect_to_login(request.get_full_path())
+        # request.user would load the user a second time for templates
+        request.user = user
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+async def _amember_group(request, group_id):
+    group = await Group.objects.filter(id=group_id, members=request.user).afirst()
+    if group is None:
+        raise Http404('No Group matches the given query.')
+    return group
+
+def _render_expense_cards(request, expenses):
+    annotate_versions('expense', expenses)
+    return render_to_string('tracker/partials/expense_cards.html', {'expenses': expenses}, request=request)
+
+@async_login_required
+@query_budget(5)
+async def group_expenses(request, group_id):
+    # Infinite-scroll fragment: the next page of expense cards after ?cursor=
+    group = await _amember_group(request, group_id)
+    expenses, next_cursor = await akeyset_page(
+        Expense.objects.filter(group=group).select_related('paid_by'),
+        cursor=request.GET.get('cursor'),
+        page_size=EXPENSE_PAGE_SIZE,
+    )
+    # Cache lookups and template rendering are sync-only
+    html = await sync_to_async(_render_expense_cards)(request, expenses)
+    next_url = None
+    if next_cursor:
+        next_url = f"{reverse('tracker:group_expenses', args=[group.id])}?cursor={next_cursor}"
+    return JsonResponse({
+        'html': html,
+        'next_cursor': next_cursor,
+        'next_url': next_url,
+    })
+
+@login_required
+def group_export(request, group_id):
+    group = get_object_or_404(Group, id=group_id, members=request.user)
+    fmt = request.GET.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        return JsonResponse({'error': f'Unknown format {fmt!r}.'}, status=400)
+    gzip = request.GET.get('gzip') in ('1', 'true', 'yes')
+    
+    filename = f'group-{group.id}.{fmt}' + ('.gz' if gzip else '')
+    chunks = export_group(group, fmt, gzip=gzip)
+    if isinstance(request, ASGIRequest):
+        # Django buffers sync iterators whole under ASGI; stream in batches instead
+        chunks = aiter_chunks(chunks)
+    response = StreamingHttpResponse(
+        chunks,
+        content_type='application/gzip' if gzip else EXPORT_FORMATS[fmt],
+    )
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+@async_login_required
+@query_budget(5)
+async def group_analytics(request, group_id):
+    # Chart data read from the daily rollups only, however long the group's history
+    group = await _amember_group(request, group_id)
+    period = request.GET.get('period', 'month')
+    if period not in PERIODS:
+        return JsonResponse({'error': f'Unknown period {period!r}.'}, status=400)
+    bounds = {}
+    for name in ('since', 'until'):
+        value = request.GET.get(name)
+        try:
+            bounds[name] = parse_date(value) if value else None
+        except ValueError:
+            bounds[name] = None
+        if value and bounds[name] is None:
+            return JsonResponse({'error': f'Invalid {name} date {value!r}.'}, status=400)
+    
+    return JsonResponse({
+        'period': period,
+        'series': [row async for row in spending_series(group, period, **bounds)],
+        'members': [row async for row in member_breakdown(group, **bounds)],
+    })
+
 @login_required
 def group_create(request):
     if request.method == 'POST':
@@ -104,7 +269,7 @@ def group_create(request):
             group = form.save()
             GroupMember.objects.create(user=request.user, group=group, role='admin')
             messages.success(request, 'Group created successfully!')
-            return redirect('group_detail', group_id=group.id)
+            return redirect('tracker:group_detail', group_id=group.id)
     else:
         form = GroupForm()
     return render(request, 'tracker/group_form.html', {'form': form})
@@ -112,39 +277,69 @@ def group_create(request):
 @login_required
 def expense_create(request, group_id):
     group = get_object_or_404(Group, id=group_id, members=request.user)
+    members = group.members.order_by('id')
     if request.method == 'POST':
-        form = ExpenseForm(request.POST, request.FILES, user=request.user)
+        form = ExpenseForm(request.POST, request.FILES, user=request.user, members=members)
         if form.is_valid():
-            expense = form.save(commit=False)
-            expense.paid_by = request.user
-            expense.group = group
-            expense.save()
-            
-            # Create expense shares based on split type
-            if expense.split_type == 'equal':
-                share_amount = expense.amount / group.members.count()
-                for member in group.members.all():
-                    ExpenseShare.objects.create(
-                        expense=expense,
-                        user=member,
-                        amount=share_amount
-                    )
+            # One ledger, rollup and search write for the expense and all its shares
+            with transaction.atomic(), batched_writes():
+                expense = form.save(commit=False)
+                expense.paid_by = request.user
+                expense.group = group
+                expense.save()
+                
+                # Shares were allocated by the form for the chosen split type
+                create_shares(expense, form.allocations)
+                
+                # The worker tells the other members, so big groups don't slow this request
+                enqueue(
+                    'expense_added',
+                    f'{request.user.username} added "{expense.title}" (${expense.amount}) in {group.name}',
+                    actor=request.user,
+                    group=group,
+                    expense=expense
+                )
             
             messages.success(request, 'Expense added successfully!')
-            return redirect('group_detail', group_id=group.id)
+            return redirect('tracker:group_detail', group_id=group.id)
     else:
-        form = ExpenseForm(user=request.user)
+        form = ExpenseForm(user=request.user, members=members)
     return render(request, 'tracker/expense_form.html', {'form': form, 'group': group})
 
 @login_required
+@require_POST
+def expense_import(request, group_id):
+    group = get_object_or_404(Group, id=group_id, members=request.user)
+    upload = request.FILES.get('file')
+    if upload is None:
+        return JsonResponse({'error': 'Upload a CSV or OFX file as "file".'}, status=400)
+    
+    fmt = request.POST.get('format') or ('ofx' if upload.name.lower().endswith(('.ofx', '.qfx')) else 'csv')
+    stream = io.TextIOWrapper(upload.file, encoding='utf-8-sig', errors='replace', newline='')
+    rows = read_ofx(stream) if fmt == 'ofx' else read_csv(stream)
+    result = ExpenseImporter(group, request.user).run(rows)
+    if result.created:
+        enqueue(
+            'expense_added',
+            f'{request.user.username} imported {result.created} expenses into {group.name}',
+            actor=request.user,
+            group=group
+        )
+    return JsonResponse(result.as_dict())
+
+@login_required
+@query_budget(8)
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=_expense_etag, last_modified_func=_expense_last_modified)
 def expense_detail(request, expense_id):
-    expense = get_object_or_404(Expense, id=expense_id)
-    if not expense.group or request.user not in expense.group.members.all():
+    expense = get_object_or_404(Expense.objects.select_related('group', 'paid_by'), id=expense_id)
+    # The membership check already ran for the ETag
+    if not _page_visible(request, 'expense', expense.id):
         messages.error(request, 'You do not have permission to view this expense.')
-        return redirect('dashboard')
+        return redirect('tracker:dashboard')
     
-    shares = expense.shares.all()
-    comments = expense.comments.all().order_by('-created_at')
+    shares = expense.shares.select_related('user')
+    comments = expense.comments.select_related('user').order_by('-created_at')
     
     if request.method == 'POST':
         comment_form = CommentForm(request.POST)
@@ -153,7 +348,7 @@ def expense_detail(request, expense_id):
             comment.expense = expense
             comment.user = request.user
             comment.save()
-            return redirect('expense_detail', expense_id=expense.id)
+            return redirect('tracker:expense_detail', expense_id=expense.id)
     else:
         comment_form = CommentForm()
     
@@ -176,58 +371,176 @@ def settlement_create(request, group_id):
             settlement.group = group
             settlement.save()
             
-            # Create notification for receiver
-            Notification.objects.create(
-                user=settlement.receiver,
-                type='settlement_request',
-                content=f'{request.user.username} requested a settlement of ${settlement.amount}',
-                related_settlement=settlement,
-                related_group=group
+            # Queue a notification for the receiver
+            enqueue(
+                'settlement_request',
+                f'{request.user.username} requested a settlement of ${settlement.amount}',
+                actor=request.user,
+                recipient=settlement.receiver,
+                group=group,
+                settlement=settlement
             )
             
             messages.success(request, 'Settlement request sent successfully!')
-            return redirect('group_detail', group_id=group.id)
+            return redirect('tracker:group_detail', group_id=group.id)
     else:
         form = SettlementForm(user=request.user, group=group)
     return render(request, 'tracker/settlement_form.html', {'form': form, 'group': group})
 
+def _settle_up_transfers(group):
+    """Suggested transfers for ``group`` with payer/receiver users resolved in one query."""
+    transfers = simplify_debts(group_balances(group))
+    users = User.objects.in_bulk({t.payer_id for t in transfers} | {t.receiver_id for t in transfers})
+    return [(users[t.payer_id], users[t.receiver_id], t.amount) for t in transfers]
+
+@login_required
+def settle_up(request, group_id):
+    group = get_object_or_404(Group, id=group_id, members=request.user)
+    transfers = _settle_up_transfers(group)
+    
+    if request.method == 'POST':
+        if not transfers:
+            messages.info(request, 'Everyone in this group is already settled up.')
+            return redirect('tracker:group_detail', group_id=group.id)
+        
+        # Create every suggested settlement and its notification together
+        with transaction.atomic():
+            settlements = Settlement.objects.bulk_create([
+                Settlement(payer=payer, receiver=receiver, amount=amount, group=group,
+                           notes='Suggested by Settle Up')
+                for payer, receiver, amount in transfers
+            ])
+            enqueue_many([
+                NotificationEvent(
+                    type='settlement_request',
+                    content=f'{settlement.payer.username} owes you ${settlement.amount} to settle up {group.name}',
+                    actor=request.user,
+                    recipient=settlement.receiver,
+                    group=group,
+                    related_settlement=settlement
+                )
+                for settlement in settlements
+            ])
+            bump_groups(group.id)
+            broadcast(group.id, 'settlement', 'created', count=len(settlements))
+        
+        messages.success(request, f'{len(settlements)} settlement requests created.')
+        return redirect('tracker:group_detail', group_id=group.id)
+    
+    return render(request, 'tracker/settle_up.html', {'group': group, 'transfers': transfers})
+
+@login_required
+def settle_up_plan(request, group_id):
+    group = get_object_or_404(Group, id=group_id, members=request.user)
+    transfers = _settle_up_transfers(group)
+    return JsonResponse({
+        'group': group.id,
+        'transfers': [
+            {
+                'payer': payer.id,
+                'payer_username': payer.username,
+                'receiver': receiver.id,
+                'receiver_username': receiver.username,
+                'amount': str(amount),
+            }
+            for payer, receiver, amount in transfers
+        ],
+    })
+
 @login_required
 def settlement_approve(request, settlement_id):
     settlement = get_object_or_404(Settlement, id=settlement_id, receiver=request.user)
     if request.method == 'POST':
-        settlement.status = 'completed'
-        settlement.save()
-        
-        # Create notification for payer
-        Notification.objects.create(
-            user=settlement.payer,
-            type='settlement_completed',
-            content=f'{request.user.username} approved your settlement of ${settlement.amount}',
-            related_settlement=settlement,
-            related_group=settlement.group
-        )
+        with transaction.atomic():
+            settlement.status = 'completed'
+            settlement.save()
+            
+            # Queue a notification for the payer
+            enqueue(
+                'settlement_completed',
+                f'{request.user.username} approved your settlement of ${settlement.amount}',
+                actor=request.user,
+                recipient=settlement.payer,
+                group=settlement.group,
+                settlement=settlement
+            )
         
         messages.success(request, 'Settlement approved successfully!')
-    return redirect('group_detail', group_id=settlement.group.id)
+    return redirect('tracker:group_detail', group_id=settlement.group.id)
 
 @login_required
+@query_budget(6)
 def notifications(request):
-    notifications = Notification.objects.filter(user=request.user).order_by('-created_at')
-    unread_count = notifications.filter(is_read=False).count()
+    notifications = Notification.objects.filter(user=request.user).select_related(
+        'related_expense', 'related_settlement', 'related_group'
+    )
     
     if request.method == 'POST':
         notification_id = request.POST.get('notification_id')
-        if notification_id:
-            notification = get_object_or_404(Notification, id=notification_id, user=request.user)
-            notification.is_read = True
-            notification.save()
-            return JsonResponse({'status': 'success'})
+        if notification_id and notification_id.isdigit():
+            mark_read(request.user, [int(notification_id)])
+            # The update has committed, so the cached counter already reflects this read
+            return JsonResponse({'status': 'success', 'unread_count': unread_count(request.user.id)})
+    
+    # Newest first, one keyset page at a time, however long the history gets
+    notifications, next_cursor = keyset_page(
+        notifications, request.GET.get('cursor'), NOTIFICATION_PAGE_SIZE, field='created_at'
+    )
     
+    # unread_count for the badge comes from the context processor
     return render(request, 'tracker/notifications.html', {
         'notifications': notifications,
-        'unread_count': unread_count
+        'next_cursor': next_cursor,
+    })
+
+@login_required
+@query_budget(3)
+def search(request):
+    # Ranked full-text search over what the user's groups contain (see tracker/search.py)
+    query = request.GET.get('q', '').strip()
+    page = request.GET.get('page', '1')
+    page = int(page) if page.isdigit() and int(page) > 0 else 1
+    results, has_next = search_index(request.user, query, page=page, page_size=SEARCH_PAGE_SIZE)
+    return JsonResponse({
+        'query': query,
+        'page': page,
+        'results': results,
+        'next_page': page + 1 if has_next else None,
     })
 
+def _notification_ids(values):
+    # Accept repeated ids=1&ids=2 as well as ids=1,2
+    return [int(part) for value in values for part in value.split(',') if part.strip()]
+
+@login_required
+@require_POST
+@query_budget(4)
+def notification_actions(request):
+    action = request.POST.get('action')
+    if action == 'mark_all_read':
+        updated = mark_read(request.user)
+    elif action == 'mark_read_before':
+        try:
+            before = parse_datetime(request.POST.get('before', ''))
+        except ValueError:
+            before = None
+        if before is None:
+            return JsonResponse({'error': 'Give "before" as an ISO 8601 timestamp.'}, status=400)
+        if timezone.is_naive(before):
+            before = timezone.make_aware(before)
+        updated = mark_read(request.user, before=before)
+    elif action == 'mark_read':
+        try:
+            ids = _notification_ids(request.POST.getlist('ids'))
+        except ValueError:
+            return JsonResponse({'error': '"ids" must be notification ids.'}, status=400)
+        updated = mark_read(request.user, ids)
+    else:
+        return JsonResponse({'error': 'Unknown action.'}, status=400)
+    
+    # Each action is one UPDATE; hand back the new count so the client needn't refetch
+    return JsonResponse({'action': action, 'updated': updated, 'unread_count': unread_count(request.user.id)})
+
 @login_required
 def expense_delete(request, expense_id):
     expense = get_object_or_404(Expense, id=expense_id)